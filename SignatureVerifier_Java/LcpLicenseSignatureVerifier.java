@@ -13,10 +13,12 @@ import java.io.FileInputStream;
 import java.io.FileNotFoundException;
 import java.io.IOException;
 import java.io.InputStreamReader;
+import java.io.PrintStream;
 import java.io.UnsupportedEncodingException;
 import java.lang.reflect.Type;
 import java.math.BigDecimal;
 import java.math.BigInteger;
+import java.nio.charset.StandardCharsets;
 import java.nio.file.Files;
 import java.nio.file.Paths;
 import java.security.InvalidKeyException;
@@ -98,6 +100,13 @@ public class LcpLicenseSignatureVerifier {
         "verbose\n" +
         ANSI_RESET +
         "        (if set, more information will be printed to standard output)\n" +
+        "\n" +
+        "To print the canonical form of a license (the input of the signature):\n" +
+        "    " +
+        ANSI_GREEN +
+        "canonical" +
+        ANSI_RESET +
+        " ebook_unzipped/META-INF/license.lcpl\n" +
         "\n\n" +
         ANSI_BLUE +
         "==================================\n" +
@@ -263,7 +272,8 @@ public class LcpLicenseSignatureVerifier {
             // while ((lineStr = lcpBufferedReader.readLine()) != null) { lcp_jsonString += lineStr; }
 
             lcp_jsonString = new String(
-                Files.readAllBytes(Paths.get(m_lcpFile.getAbsolutePath()))
+                Files.readAllBytes(Paths.get(m_lcpFile.getAbsolutePath())),
+                StandardCharsets.UTF_8
             );
             if (m_verbose) {
                 System.out.println("\n\n");
@@ -588,7 +598,7 @@ public class LcpLicenseSignatureVerifier {
             PublicKey publicKey = providerCertificate.getPublicKey();
             signatureVerifier.initVerify(publicKey);
 
-            byte[] lcp_canonicalJsonBytes = lcp_canonicalJsonString.getBytes();
+            byte[] lcp_canonicalJsonBytes = lcp_canonicalJsonString.getBytes(StandardCharsets.UTF_8);
             signatureVerifier.update(lcp_canonicalJsonBytes);
 
             byte[] lcp_signatureBytes_b64 = lcp_signature.getBytes();
@@ -749,6 +759,24 @@ public class LcpLicenseSignatureVerifier {
         return jsonMap;
     }
 
+    // Prints the canonical JSON of a license, as signed, to standard output
+    // (used by the conformance tests of the Python canonicalization)
+    private static void printCanonical(File lcpFile) {
+        PrintStream out = System.out;
+        // loadLcp() may print diagnostics, kept out of the canonical output
+        System.setOut(System.err);
+        LcpLicenseSignatureVerifier verifier = new LcpLicenseSignatureVerifier(
+            null,
+            lcpFile
+        );
+        verifier.loadLcp();
+        System.setOut(out);
+
+        byte[] canonicalBytes = verifier.m_lcp_canonicalJsonString.getBytes(StandardCharsets.UTF_8);
+        out.write(canonicalBytes, 0, canonicalBytes.length);
+        out.flush();
+    }
+
     private boolean m_verbose = false;
 
     String m_providerName_certificates = "SUN";
@@ -972,6 +1000,11 @@ public class LcpLicenseSignatureVerifier {
     }
 
     public static void main(String[] args) {
+        if (args.length == 2 && args[0].equalsIgnoreCase("canonical")) {
+            printCanonical(new File(args[1]));
+            return;
+        }
+
         if (args.length < 2) {
             System.err.println(
                 ANSI_RED + "### Missing input parameter(s).\n\n" + ANSI_RESET
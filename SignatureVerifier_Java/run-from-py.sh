@@ -1,5 +1,16 @@
 #!/bin/sh
-cd ./SignatureVerifier_Java 
-javac LcpLicenseSignatureVerifier.java -Xlint:unchecked -Xdiags:verbose -d "out" -classpath "lib/bcprov-jdk15on-1.56.jar:lib/gson-2.3.1.jar:lib/json-schema-validator-2.2.6.jar"\
-&&\
+cd ./SignatureVerifier_Java
+# compile the verifier only if the class file is missing or outdated,
+# to keep the cost of a signature check to the java startup
+if [ ! out/LcpLicenseSignatureVerifier.class -nt LcpLicenseSignatureVerifier.java ]; then
+# concurrent checks (serve mode, batch workers) may compile at the same time: each one compiles
+# in its own folder, then renames the class files into out, so that java never loads a partial file
+tmp_out=$(mktemp -d "out.XXXXXX") || exit $?
+javac LcpLicenseSignatureVerifier.java -Xlint:unchecked -Xdiags:verbose -d "$tmp_out" -classpath "lib/bcprov-jdk15on-1.56.jar:lib/gson-2.3.1.jar:lib/json-schema-validator-2.2.6.jar" || { status=$?; rm -rf "$tmp_out"; exit $status; }
+mkdir -p out
+for class_file in "$tmp_out"/*.class; do
+mv -f "$class_file" out/ || { status=$?; rm -rf "$tmp_out"; exit $status; }
+done
+rm -rf "$tmp_out"
+fi
 java -cp "lib/bcprov-jdk15on-1.56.jar:lib/gson-2.3.1.jar:lib/json-schema-validator-2.2.6.jar:./out" LcpLicenseSignatureVerifier "$@"
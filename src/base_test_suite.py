@@ -5,7 +5,9 @@ Base Test suite
 """
 
 import logging
+import time
 
+import memprofile
 from exception import TestSuiteLogicError, TestSuiteRunningError
 
 LOGGER = logging.getLogger(__name__)
@@ -13,6 +15,12 @@ LOGGER = logging.getLogger(__name__)
 class BaseTestSuite:
     """Base test suite"""
 
+    # results of the last run, one dict per test (see report())
+    results = None
+
+    # memory used by the initialization of the last run, when profiling (see memprofile)
+    memory = None
+
     def get_tests(self):
         """List of tests to execute"""
 
@@ -34,20 +42,31 @@ class BaseTestSuite:
 
             test_methods.append(method_name)
 
+        self.results = []
+        self.memory = None
+        method_name = "initialize"
+        probe = memprofile.probe()
+        start = time.perf_counter()
         try:
             # Initialize tests
             LOGGER.debug("Initialization start")
             self.initialize()
             LOGGER.debug("Initialization end")
+            if probe is not None:
+                self.memory = probe.stop()
 
             # Run every test
             for method_name in test_methods:
                 LOGGER.info("--------\nTest start: %s", method_name)
+                probe = memprofile.probe()
+                start = time.perf_counter()
                 method = getattr(self, method_name)
                 method()
+                self._add_result(method_name, start, probe=probe)
                 LOGGER.debug("Test succeeded")
         except TestSuiteRunningError as err:
             LOGGER.error(err)
+            self._add_result(method_name, start, err, probe)
             return False
         finally:
             # Clean tests
@@ -57,6 +76,39 @@ class BaseTestSuite:
 
         return True
 
+    def _add_result(self, method_name, start, error=None, probe=None):
+        """Record the outcome of a test, and its memory use when profiling"""
+
+        duration = time.perf_counter() - start
+        result = {
+            "test": method_name,
+            "passed": error is None,
+            "message": str(error) if error is not None else None,
+            "duration": duration
+            }
+        if probe is not None:
+            result["memory"] = probe.stop()
+        self.results.append(result)
+
+    def report(self):
+        """
+        Outcome of the last run
+
+        Returns
+            dict: suite name, global result and per test results
+        """
+
+        results = self.results or []
+        report = {
+            "suite": type(self).__name__,
+            "passed": bool(results) and all(r["passed"] for r in results),
+            "tests": results,
+            "duration": sum(r["duration"] for r in results)
+            }
+        if self.memory is not None:
+            report["memory"] = self.memory
+        return report
+
     def initialize(self):
         """
         Initialize tests
@@ -24,13 +24,20 @@ class TestConfig:
         raise FileNotFoundError
 
     with open(config_path, 'r') as stream:
-        yaml_config = yaml.load(stream)
+        # the C loader is much faster, use it if libyaml is available
+        yaml_config = yaml.load(stream, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
         self.working_path = yaml_config['working_path']
         self.cmd = yaml_config['cmd']
         self.common = yaml_config['common']
         self.lcp_server = yaml_config['lcp_server']
         self.lsd_server = yaml_config['lsd_server']
         self.test = yaml_config[test] if test else None
+        # optional: License Server deployments compared by lcpbench
+        self.benchmark = yaml_config.get('benchmark')
+        # optional: limits of the requests sent to live servers, see http_client
+        self.http = yaml_config.get('http') or {}
+        # optional: link checker and its HTTP cache, see link_checker
+        self.links = yaml_config.get('links') or {}
 
     # cmd config
     self.user_passphrase = self.cmd['user_passphrase']
@@ -39,6 +46,11 @@ class TestConfig:
     self.license_schema_path = self.common['schema']['license']
     self.status_schema_path= self.common['schema']['status']
     self.cacert = self.common['crypto']['cacert']
+    # optional: CRL files or folders used for the revocation checks, and the path of their index
+    crl = self.common['crypto'].get('crl')
+    self.crl = [crl] if isinstance(crl, str) else (crl or [])
+    self.crl_index_path = self.common['crypto'].get(
+        'crl_index', os.path.join(self.working_path, 'crl_index.json'))
     # lcp_server config
     self.lcp_server_base_uri = self.lcp_server['base_uri']
     self.lcp_server_auth_user = self.lcp_server['auth']['user']
@@ -48,6 +60,10 @@ class TestConfig:
     self.lsd_server_base_uri = self.lsd_server['base_uri']
     self.lsd_server_auth_user = self.lsd_server['auth']['user']
     self.lsd_server_auth_passwd = self.lsd_server['auth']['passwd']
+    # optional: parse the status documents incrementally, their events are only summarized
+    self.lsd_server_streaming = self.lsd_server.get('streaming', False)
+    # optional: latency budgets of the status server operations, see LSDTestSuite.test_latency
+    self.lsd_server_latency = self.lsd_server.get('latency') or {}
     # test x.y config
     if self.test:
         self.test_epub = self.test['epub']
@@ -15,13 +15,17 @@ class CmdConfig:
         raise FileNotFoundError
 
     with open(config_path, 'r') as stream:
-      yaml_config = yaml.load(stream)
+      yaml_config = yaml.load(stream, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
       self.working_path = yaml_config['working_path']
       self.cmd = yaml_config['cmd']
       self.lcp_server = yaml_config['lcp_server']
 
     # cmd config
-    self.encrypt_cmd_path = self.cmd['encrypt_cmd_path']
+    self.encrypt_cmd_path = self.cmd.get('encrypt_cmd_path')
+    # encrypt_engine: lcpencrypt (external command) or native (epub_encrypt module)
+    self.encrypt_engine = self.cmd.get('encrypt_engine', 'lcpencrypt')
+    # encrypt_cache_path: cache of the encrypted resources of the native engine (optional)
+    self.encrypt_cache_path = self.cmd.get('encrypt_cache_path')
     self.encrypted_file_path = self.cmd['encrypted_file_path']
     self.user_passphrase_hint = self.cmd['user_passphrase_hint']
     self.user_passphrase = self.cmd['user_passphrase']
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+
+"""
+Offline certificate revocation checking, from locally supplied CRL files.
+
+Each CRL is parsed once into an index of the revoked serial numbers of its issuer.
+The index is persisted in a json file and refreshed incrementally:
+only new or modified CRL files are parsed again, and the CRL of an issuer
+is replaced only by a newer one (higher CRL number, or later update).
+The CRL files removed are dropped from the index, with the revocations they brought.
+
+Copyright 2017 European Digital Reading Lab. All rights reserved.
+Licensed to the Readium Foundation under one or more contributor license agreements.
+Use of this source code is governed by a BSD-style license
+that can be found in the LICENSE file exposed on Github (readium) in the project repository.
+"""
+
+import glob
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from exception import LCPLicenseError
+
+LOGGER = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+
+# CRL file extensions, when a folder is given
+CRL_EXTENSIONS = ('.crl', '.pem', '.der')
+
+# minimum delay between two checks of the CRL files, in seconds
+REFRESH_DELAY = 60
+
+
+def issuer_key(name_der):
+    """Key of an issuer in the index: sha256 of its DER encoded name"""
+
+    return hashlib.sha256(name_der).hexdigest()
+
+
+class CRLIndex:
+    """Revoked serial numbers, per issuer"""
+
+    def __init__(self, crl_paths, index_path, cacert_path=None):
+        """
+        Args:
+            crl_paths (list): CRL files or folders containing CRL files
+            index_path (str): path of the persisted index
+            cacert_path (str): root certificate, used to verify the signature of the CRLs it issued
+        """
+
+        self.crl_paths = crl_paths
+        self.index_path = index_path
+        self.cacert_path = cacert_path
+        self.lock = threading.Lock()
+        self.last_refresh = 0
+        # CRL file path -> mtime, size, issuer
+        self.files = {}
+        # issuer key -> issuer name, source CRL, CRL number, last update, revoked serials
+        self.issuers = {}
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, 'r', encoding='utf8') as index_file:
+                index = json.load(index_file)
+        except ValueError:
+            LOGGER.warning("Invalid CRL index {}, rebuilt".format(self.index_path))
+            return
+        if index.get("version") != INDEX_VERSION:
+            return
+        self.files = index["files"]
+        self.issuers = index["issuers"]
+
+    def _save(self):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf8') as index_file:
+            json.dump({"version": INDEX_VERSION, "files": self.files, "issuers": self.issuers}, index_file)
+        os.replace(tmp_path, self.index_path)
+
+    def _crl_files(self):
+        for path in self.crl_paths:
+            if os.path.isdir(path):
+                for ext in CRL_EXTENSIONS:
+                    yield from glob.glob(os.path.join(path, '*' + ext))
+            else:
+                yield path
+
+    def refresh(self, force=False):
+        """
+        Parse the new or modified CRL files, at most every REFRESH_DELAY seconds
+
+        Raises
+            LCPLicenseError if a CRL file is invalid: the other files are indexed, and the files
+            are checked again on the next call, until the invalid one is fixed or removed
+        """
+
+        with self.lock:
+            if not force and time.time() - self.last_refresh < REFRESH_DELAY:
+                return
+
+            changed = False
+            errors = []
+            found = set()
+            for path in self._crl_files():
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    LOGGER.warning("CRL file {} not found".format(path))
+                    continue
+                found.add(path)
+                known = self.files.get(path)
+                if known and known["mtime"] == stat.st_mtime and known["size"] == stat.st_size:
+                    continue
+                try:
+                    self._add_crl(path, stat)
+                except LCPLicenseError as err:
+                    errors.append(err)
+                    continue
+                changed = True
+
+            removed = [path for path in self.files if path not in found]
+            if removed:
+                self._remove_crls(removed)
+                changed = True
+
+            if changed:
+                self._save()
+            if errors:
+                raise errors[0]
+            # the delay starts after a complete refresh only: an invalid CRL fails every check
+            self.last_refresh = time.time()
+
+    def _add_crl(self, path, stat):
+        from cryptography import x509
+
+        with open(path, 'rb') as crl_file:
+            data = crl_file.read()
+        try:
+            crl = x509.load_pem_x509_crl(data) if b"-----BEGIN" in data else x509.load_der_x509_crl(data)
+        except ValueError as err:
+            raise LCPLicenseError("Invalid CRL file {}: {}".format(path, err))
+
+        self._verify_signature(crl, path)
+
+        key = issuer_key(crl.issuer.public_bytes())
+        try:
+            number = crl.extensions.get_extension_for_class(x509.CRLNumber).value.crl_number
+        except x509.ExtensionNotFound:
+            number = None
+        last_update = crl.last_update_utc.isoformat()
+        self.files[path] = {"mtime": stat.st_mtime, "size": stat.st_size, "issuer": key}
+
+        current = self.issuers.get(key)
+        if current and _order(current["number"], current["last_update"]) >= _order(number, last_update):
+            LOGGER.debug("CRL {} is not newer than {}".format(path, current["source"]))
+            return
+
+        self.issuers[key] = {
+            "name": crl.issuer.rfc4514_string(),
+            "source": path,
+            "number": number,
+            "last_update": last_update,
+            "next_update": crl.next_update_utc.isoformat() if crl.next_update_utc else None,
+            "serials": {format(r.serial_number, 'x'): r.revocation_date_utc.isoformat() for r in crl}
+            }
+        LOGGER.info("CRL {} indexed: {} revoked certificates".format(path, len(self.issuers[key]["serials"])))
+
+    def _remove_crls(self, paths):
+        for path in paths:
+            LOGGER.info("CRL {} removed from the index".format(path))
+            del self.files[path]
+        # an issuer whose indexed CRL is gone is indexed again from its remaining CRL files, if any
+        for key, issuer in list(self.issuers.items()):
+            if issuer["source"] in paths:
+                del self.issuers[key]
+                for path, known in list(self.files.items()):
+                    if known["issuer"] == key:
+                        self._add_crl(path, os.stat(path))
+
+    def _verify_signature(self, crl, path):
+        # only the CRLs issued by the root certificate can be verified
+        if not self.cacert_path:
+            return
+        from cryptography import x509
+
+        with open(self.cacert_path, 'rb') as cert_file:
+            root = x509.load_pem_x509_certificate(cert_file.read())
+        if crl.issuer != root.subject:
+            LOGGER.warning("The signature of the CRL {} is not verified, its issuer is unknown".format(path))
+            return
+        if not crl.is_signature_valid(root.public_key()):
+            raise LCPLicenseError("Invalid signature of the CRL {}".format(path))
+
+    def revocation(self, name_der, serial_number):
+        """
+        Look up a certificate
+
+        Args:
+            name_der (bytes): DER encoded name of the certificate issuer
+            serial_number (int): serial number of the certificate
+
+        Returns
+            str: revocation datetime if the certificate is revoked, None if not revoked,
+            False if no CRL is known for the issuer
+        """
+
+        issuer = self.issuers.get(issuer_key(name_der))
+        if issuer is None:
+            return False
+        return issuer["serials"].get(format(serial_number, 'x'))
+
+
+def _order(number, last_update):
+    # CRLs of an issuer are ordered by CRL number, then update datetime
+    return (number if number is not None else -1, last_update)
+
+
+# one index per process, per configuration
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_index(crl_paths, index_path, cacert_path=None):
+    """
+    Shared CRL index, loaded once and refreshed if the CRL files changed
+
+    Raises
+        LCPLicenseError if a CRL file is invalid
+    """
+
+    key = (tuple(crl_paths), index_path, cacert_path)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = CRLIndex(crl_paths, index_path, cacert_path)
+    index.refresh()
+    return index
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+"""
+Cache of the encrypted resources of protected contents, used by the native encryption engine
+
+When a revised EPUB file is encrypted again under the same content id and content key,
+only the resources which changed are encrypted: the ciphertext of the others is copied
+byte for byte from the cache. The cache of a content is a folder:
+
+    <cache_path>/<content id>/index.json    path -> sha256 of the clear resource, deflated, length, blob
+    <cache_path>/<content id>/<blob>        ciphertext of a resource (iv + encrypted data)
+
+The index holds a fingerprint of the content key: the cache of a content encrypted
+with another key is discarded.
+
+Copyright 2017 European Digital Reading Lab. All rights reserved.
+Licensed to the Readium Foundation under one or more contributor license agreements.
+Use of this source code is governed by a BSD-style license
+that can be found in the LICENSE file exposed on Github (readium) in the project repository.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+LOGGER = logging.getLogger(__name__)
+
+INDEX_NAME = "index.json"
+
+
+class EncryptionCache:
+    """Cache of the encrypted resources, one folder per content"""
+
+    def __init__(self, cache_path):
+        """
+        Args:
+            cache_path (str): root folder of the cache
+        """
+
+        self.cache_path = cache_path
+
+    def open(self, content_id, content_key):
+        """
+        Returns
+            ContentCache: cache of the resources of a content encrypted with this key
+        """
+
+        return ContentCache(os.path.join(self.cache_path, content_id.replace(os.sep, '_')), content_key)
+
+
+class ContentCache:
+    """Encrypted resources of a content"""
+
+    def __init__(self, content_path, content_key):
+        self.content_path = content_path
+        self.key_fingerprint = hashlib.sha256(b"lcp-encrypt-cache" + content_key).hexdigest()
+        # blob -> entry of the resources encrypted before
+        self.blobs = {}
+        # resources of the current encryption
+        self.current = {}
+        self.reused = 0
+        self.encrypted = 0
+
+        index_path = os.path.join(content_path, INDEX_NAME)
+        try:
+            with open(index_path, 'r', encoding='utf8') as index_file:
+                index = json.load(index_file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as err:
+            LOGGER.warning("Invalid encryption cache {}: {}".format(content_path, err))
+            return
+        if index.get("key") != self.key_fingerprint:
+            LOGGER.warning("Encryption cache {} built with another content key, discarded".format(content_path))
+            return
+        self.blobs = {entry["blob"]: entry for entry in index.get("resources", {}).values()}
+
+    @staticmethod
+    def _blob_name(digest, deflated):
+        return digest + (".z" if deflated else "")
+
+    def get(self, path, digest, deflated):
+        """
+        Ciphertext of a resource, if the same clear resource was encrypted before
+
+        Args:
+            path (str): path of the resource in the archive
+            digest (str): sha256 of the clear resource (hex)
+            deflated (bool): the resource is deflated before encryption
+
+        Returns
+            str: path of the file holding the ciphertext, or None
+        """
+
+        blob = self._blob_name(digest, deflated)
+        entry = self.blobs.get(blob)
+        blob_path = os.path.join(self.content_path, blob)
+        if entry is None or not os.path.exists(blob_path):
+            return None
+        self.current[path] = entry
+        self.reused += 1
+        return blob_path
+
+    def put(self, path, digest, deflated, length, ciphertext):
+        """Add the ciphertext of a resource"""
+
+        for _ in self.tee(path, digest, deflated, length, [ciphertext]):
+            pass
+
+    def tee(self, path, digest, deflated, length, chunks):
+        """
+        Add the ciphertext of a resource given by chunks, yielding the chunks as they are written
+
+        Yields
+            the chunks
+        """
+
+        blob = self._blob_name(digest, deflated)
+        os.makedirs(self.content_path, exist_ok=True)
+        blob_path = os.path.join(self.content_path, blob)
+        with open(blob_path + ".tmp", 'wb') as blob_file:
+            for chunk in chunks:
+                blob_file.write(chunk)
+                yield chunk
+        os.replace(blob_path + ".tmp", blob_path)
+        entry = {"sha256": digest, "deflated": deflated, "length": length, "blob": blob}
+        self.blobs[blob] = entry
+        self.current[path] = entry
+        self.encrypted += 1
+
+    def save(self):
+        """Write the index of the current encryption, remove the blobs of the resources gone"""
+
+        if not self.current:
+            shutil.rmtree(self.content_path, ignore_errors=True)
+            return
+        os.makedirs(self.content_path, exist_ok=True)
+        index_path = os.path.join(self.content_path, INDEX_NAME)
+        with open(index_path + ".tmp", 'w', encoding='utf8') as index_file:
+            json.dump({"key": self.key_fingerprint, "resources": self.current}, index_file)
+        os.replace(index_path + ".tmp", index_path)
+
+        blobs = {entry["blob"] for entry in self.current.values()}
+        for name in os.listdir(self.content_path):
+            if name != INDEX_NAME and name not in blobs:
+                os.remove(os.path.join(self.content_path, name))
+        self.blobs = {entry["blob"]: entry for entry in self.current.values()}
@@ -0,0 +1,411 @@
+# -*- coding: utf-8 -*-
+
+"""
+Native LCP encryption of an EPUB file, an alternative to the lcpencrypt utility
+
+Every resource of the package is encrypted with AES-256-CBC and the content key, except:
+    - mimetype and the files of the META-INF folder
+    - the navigation document, the NCX document and the cover image
+Resources which are not media (images, audio, video) are deflated before being encrypted;
+the encrypted entries are stored without compression in the archive.
+The encrypted resources are listed in META-INF/encryption.xml.
+
+The resources are encrypted in parallel by a pool of threads (zlib and AES release the GIL),
+the large ones by chunks. The protected file is written as a stream (see zipstream): no temporary
+file, no extraction folder, the output can be a pipe or an upload body.
+A stored entry needs its CRC in its local header (see zipstream): a large resource is encrypted twice
+with the same iv, a first time in the pool for the CRC of the ciphertext, a second time as it is written.
+The result has the fields of the json message of lcpencrypt:
+
+    lcpcheck encrypt -i book.epub -o book.lcp.epub [--content-id <id>] [--jobs 8]
+    lcpcheck encrypt -i book.epub -o - | upload-command
+
+With a cache (see encrypt_cache), a revised EPUB encrypted again under the same content id and key
+only gets its changed resources encrypted:
+
+    lcpcheck encrypt -i book-v2.epub -o book.lcp.epub --content-id <id> --content-key <key> --cache <folder>
+
+Copyright 2017 European Digital Reading Lab. All rights reserved.
+Licensed to the Readium Foundation under one or more contributor license agreements.
+Use of this source code is governed by a BSD-style license
+that can be found in the LICENSE file exposed on Github (readium) in the project repository.
+"""
+
+import argparse
+import base64
+import collections
+import hashlib
+import json
+import logging
+import os
+import posixpath
+import sys
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, unquote
+
+from Crypto.Cipher import AES
+from lxml import etree
+
+import util
+import lcpcrypto
+import encrypt_cache
+from exception import EncryptionError, ZipArchiveError
+from zipview import ZipView, MmapSource, ZIP_DEFLATED
+from zipstream import ZipStreamWriter
+
+LOGGER = logging.getLogger(__name__)
+
+NAMESPACES = {
+    'c': 'urn:oasis:names:tc:opendocument:xmlns:container',
+    'enc': 'http://www.w3.org/2001/04/xmlenc#',
+    'ds': 'http://www.w3.org/2000/09/xmldsig#',
+    'comp': 'http://www.idpf.org/2016/encryption#compression',
+    'opf': 'http://www.idpf.org/2007/opf'
+    }
+
+AES256_CBC = "http://www.w3.org/2001/04/xmlenc#aes256-cbc"
+CONTENT_KEY_URI = "license.lcpl#/encryption/content_key"
+CONTENT_KEY_TYPE = "http://readium.org/2014/01/lcp#EncryptedContentKey"
+
+# media types of the resources which are not deflated before encryption
+MEDIA_TYPES = ('image/', 'audio/', 'video/')
+
+# number of resources read ahead of their encryption, per thread
+QUEUE_FACTOR = 2
+
+# larger resources are encrypted by chunks, as they are read and written
+STREAM_THRESHOLD = 4 << 20
+STREAM_CHUNK_SIZE = 1 << 20
+
+AES_BLOCK_SIZE = AES.block_size
+
+# the archive is not trusted: no entity expansion, no network access
+_PARSER = etree.XMLParser(resolve_entities=False, no_network=True)
+
+
+def package_resources(source):
+    """
+    Resources listed in the manifest of the package document
+
+    Args:
+        source (ZipView): EPUB archive
+
+    Returns
+        dict: path in the archive -> (media type, True if the resource is encrypted)
+    """
+
+    try:
+        container = etree.fromstring(source.read('META-INF/container.xml'), _PARSER)
+        opf_path = container.xpath('//c:rootfile/@full-path', namespaces=NAMESPACES)[0]
+        package = etree.fromstring(source.read(opf_path), _PARSER)
+    except (KeyError, IndexError, ZipArchiveError, etree.XMLSyntaxError) as err:
+        raise EncryptionError("Invalid EPUB package: {}".format(err))
+
+    base = posixpath.dirname(opf_path)
+    # EPUB 2 cover image
+    cover_ids = set(package.xpath('//opf:metadata/opf:meta[@name="cover"]/@content', namespaces=NAMESPACES))
+    resources = {}
+    for item in package.xpath('//opf:manifest/opf:item', namespaces=NAMESPACES):
+        path = posixpath.normpath(posixpath.join(base, unquote(item.get('href', ''))))
+        media_type = item.get('media-type', '')
+        properties = (item.get('properties') or '').split()
+        excluded = ('nav' in properties or 'cover-image' in properties
+                    or media_type == 'application/x-dtbncx+xml' or item.get('id') in cover_ids
+                    or path.startswith('META-INF/'))
+        resources[path] = (media_type, not excluded)
+    return resources
+
+
+def encrypt_resource(data, key, compress):
+    """
+    Encrypt a resource
+
+    Args:
+        data (bytes): resource
+        key (bytes): content key
+        compress (bool): deflate the resource before encrypting it
+
+    Returns
+        bytes: iv + ciphertext
+    """
+
+    if compress:
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        data = compressor.compress(data) + compressor.flush()
+    return lcpcrypto.encrypt_cbc(data, key)
+
+
+def encryption_xml(encrypted, original=None):
+    """
+    Build META-INF/encryption.xml
+
+    Args:
+        encrypted (list): (path, deflated, original length) of the encrypted resources
+        original (bytes): encryption.xml of the source EPUB (obfuscated fonts ...), completed if present
+
+    Returns
+        bytes
+    """
+
+    if original:
+        try:
+            root = etree.fromstring(original, _PARSER)
+        except etree.XMLSyntaxError as err:
+            raise EncryptionError("Invalid encryption.xml: {}".format(err))
+    else:
+        root = etree.Element("{%s}encryption" % NAMESPACES['c'],
+            nsmap={None: NAMESPACES['c'], 'enc': NAMESPACES['enc'], 'ds': NAMESPACES['ds']})
+
+    enc = "{%s}" % NAMESPACES['enc']
+    ds = "{%s}" % NAMESPACES['ds']
+    comp = "{%s}" % NAMESPACES['comp']
+    for path, deflated, length in encrypted:
+        data = etree.SubElement(root, enc + "EncryptedData")
+        etree.SubElement(data, enc + "EncryptionMethod", Algorithm=AES256_CBC)
+        key_info = etree.SubElement(data, ds + "KeyInfo")
+        etree.SubElement(key_info, ds + "RetrievalMethod", URI=CONTENT_KEY_URI, Type=CONTENT_KEY_TYPE)
+        cipher_data = etree.SubElement(data, enc + "CipherData")
+        etree.SubElement(cipher_data, enc + "CipherReference", URI=quote(path, safe="/"))
+        properties = etree.SubElement(data, enc + "EncryptionProperties")
+        prop = etree.SubElement(properties, enc + "EncryptionProperty", nsmap={'comp': NAMESPACES['comp']})
+        etree.SubElement(prop, comp + "Compression", Method="8" if deflated else "0", OriginalLength=str(length))
+    return etree.tostring(root, xml_declaration=True, encoding="UTF-8")
+
+
+def encrypted_chunks(chunks, key, compress, iv=None):
+    """
+    Encrypt a resource given by chunks, without holding it in memory
+
+    Args:
+        chunks: iterable of bytes-like objects, the clear resource
+        key (bytes): content key
+        compress (bool): deflate the resource before encrypting it
+        iv (bytes): initialization vector; random if None. The same iv gives the same ciphertext
+
+    Yields
+        bytes: iv, then the ciphertext
+    """
+
+    iv = iv or os.urandom(AES_BLOCK_SIZE)
+    # the CBC chaining goes on from one call to the next
+    cipher = AES.new(key, AES.MODE_CBC, iv)
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15) if compress else None
+    yield iv
+    pending = b""
+    for chunk in chunks:
+        pending += compressor.compress(chunk) if compressor is not None else chunk
+        full = len(pending) - len(pending) % AES_BLOCK_SIZE
+        if full:
+            yield cipher.encrypt(pending[:full])
+            pending = pending[full:]
+    if compressor is not None:
+        pending += compressor.flush()
+    padding = AES_BLOCK_SIZE - len(pending) % AES_BLOCK_SIZE
+    yield cipher.encrypt(pending + bytes([padding]) * padding)
+
+
+def _read_file(path, chunk_size=STREAM_CHUNK_SIZE):
+    with open(path, 'rb') as blob_file:
+        for chunk in iter(lambda: blob_file.read(chunk_size), b''):
+            yield chunk
+
+
+def _crc(chunks):
+    # CRC-32 and size of the data given by chunks
+    crc = size = 0
+    for chunk in chunks:
+        crc = zlib.crc32(chunk, crc)
+        size += len(chunk)
+    return crc, size
+
+
+def encrypt_epub(input_path, output, content_id=None, content_key=None, jobs=None, cache=None):
+    """
+    Encrypt an EPUB file
+
+    The protected EPUB file is written sequentially, as the resources are encrypted:
+    no temporary file, no seek on the output. The resources up to STREAM_THRESHOLD bytes
+    are encrypted in parallel; the larger ones are encrypted by chunks while they are read,
+    once in parallel for their CRC, then while they are written.
+
+    Args:
+        input_path (str): path of the EPUB file
+        output: path of the protected EPUB file, or a writable binary stream (file descriptor, pipe,
+            socket, upload body ...), which is not closed
+        content_id (str): content id; random if None
+        content_key (bytes): 32 bytes content key; random if None
+        jobs (int): number of encryption threads; the number of cores if None
+        cache (encrypt_cache.EncryptionCache): the resources unchanged since the last encryption
+            of the content with the same key are not encrypted again
+
+    Returns
+        dict: content-id, content-encryption-key (base64), protected-content-location,
+            protected-content-length, protected-content-sha256, protected-content-disposition
+
+    Raises
+        EncryptionError
+    """
+
+    content_id = content_id or str(uuid.uuid4())
+    content_key = content_key or os.urandom(32)
+    jobs = jobs or os.cpu_count() or 1
+    content_cache = cache.open(content_id, content_key) if cache is not None else None
+    output_path = output if isinstance(output, str) else None
+
+    try:
+        source = ZipView(MmapSource(input_path))
+    except (OSError, ZipArchiveError) as err:
+        raise EncryptionError("{}: {}".format(input_path, err))
+    output_file = open(output_path, 'wb') if output_path else output
+    writer = ZipStreamWriter(output_file)
+    encrypted = []
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            resources = package_resources(source)
+            names = source.namelist()
+            if 'mimetype' in names:
+                # first and stored, as required by the OCF container
+                entry = source.getinfo('mimetype')
+                writer.write_entry('mimetype', source.read('mimetype'), date_time=entry.date_time)
+            original_xml = source.read('META-INF/encryption.xml') if 'META-INF/encryption.xml' in names else None
+
+            # writes of the entries, in archive order
+            queue = collections.deque()
+
+            def copy(entry):
+                # byte for byte, still compressed
+                return lambda: writer.write_raw(entry.filename, source.raw(entry.filename), entry.CRC,
+                    entry.file_size, entry.compress_type, entry.date_time)
+
+            def write_future(entry, future, cache_key):
+                def write():
+                    ciphertext = future.result()
+                    if cache_key is not None:
+                        content_cache.put(entry.filename, *cache_key, ciphertext)
+                    writer.write_entry(entry.filename, ciphertext, date_time=entry.date_time)
+                return write
+
+            def write_stored(entry, chunks, crc_future, cache_key=None):
+                # chunks: function returning the same chunks at each call, once for the CRC, once here
+                def write():
+                    crc, size = crc_future.result()
+                    data = chunks()
+                    if cache_key is not None:
+                        data = content_cache.tee(entry.filename, *cache_key, data)
+                    writer.write_stored(entry.filename, data, crc, size, date_time=entry.date_time)
+                return write
+
+            def read_cached(path):
+                return lambda: _read_file(path)
+
+            def encrypt_chunks(name, deflated):
+                iv = os.urandom(AES_BLOCK_SIZE)
+                return lambda: encrypted_chunks(source.iter_content(name, STREAM_CHUNK_SIZE), content_key, deflated, iv)
+
+            for entry in source.infolist():
+                name = entry.filename
+                if name.endswith('/') or name in ('mimetype', 'META-INF/encryption.xml'):
+                    continue
+                media_type, encryptable = resources.get(name, (None, False))
+                if not encryptable:
+                    queue.append(copy(entry))
+                else:
+                    deflated = not media_type.startswith(MEDIA_TYPES)
+                    encrypted.append((name, deflated, entry.file_size))
+                    small = entry.file_size <= STREAM_THRESHOLD
+                    data = source.read(name) if small else None
+
+                    cache_key = cached = None
+                    if content_cache is not None:
+                        digest = hashlib.sha256()
+                        for chunk in [data] if small else source.iter_content(name, STREAM_CHUNK_SIZE):
+                            digest.update(chunk)
+                        cache_key = (digest.hexdigest(), deflated, entry.file_size)
+                        cached = content_cache.get(name, cache_key[0], deflated)
+
+                    if cached is not None:
+                        chunks = read_cached(cached)
+                        queue.append(write_stored(entry, chunks, pool.submit(_crc, chunks())))
+                    elif small:
+                        queue.append(write_future(entry, pool.submit(encrypt_resource, data, content_key, deflated), cache_key))
+                    else:
+                        # encrypted in the pool for the CRC, then again when its turn comes to be written
+                        chunks = encrypt_chunks(name, deflated)
+                        queue.append(write_stored(entry, chunks, pool.submit(_crc, chunks()), cache_key))
+                while len(queue) > jobs * QUEUE_FACTOR:
+                    queue.popleft()()
+            while queue:
+                queue.popleft()()
+
+            xml = encryption_xml(encrypted, original_xml)
+            writer.write_entry('META-INF/encryption.xml', xml, ZIP_DEFLATED, time.localtime()[:6])
+            writer.close()
+    except (OSError, ZipArchiveError, KeyError, EncryptionError) as err:
+        if output_path:
+            # no partial protected file is left
+            output_file.close()
+            os.remove(output_path)
+        if isinstance(err, EncryptionError):
+            raise
+        raise EncryptionError("{}: {}".format(input_path, err))
+    finally:
+        source.close()
+        if output_path and not output_file.closed:
+            output_file.close()
+
+    if content_cache is not None:
+        content_cache.save()
+        LOGGER.info("{}: {} resources encrypted, {} unchanged".format(
+            input_path, content_cache.encrypted, content_cache.reused))
+    else:
+        LOGGER.info("{}: {} resources encrypted".format(input_path, len(encrypted)))
+    return {
+        "content-id": content_id,
+        "content-encryption-key": base64.b64encode(content_key).decode('ascii'),
+        "protected-content-location": output_path,
+        "protected-content-length": writer.offset,
+        "protected-content-sha256": writer.sha256.hexdigest(),
+        "protected-content-disposition": os.path.basename(output_path) if output_path else "{}.epub".format(content_id)
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="lcpcheck encrypt")
+    parser.add_argument("-v", "--verbosity", action="count", help="increase output verbosity")
+    parser.add_argument("-i", "--input", required=True, help="path of the EPUB file")
+    parser.add_argument("-o", "--output", required=True, help="path of the protected EPUB file, '-' for the standard output")
+    parser.add_argument("--content-id", help="content id (default: random)")
+    parser.add_argument("--content-key", help="content key, base64 (default: random)")
+    parser.add_argument("--jobs", type=int, help="number of encryption threads (default: number of cores)")
+    parser.add_argument("--cache", help="folder of the encryption cache: a revised EPUB encrypted again with the same content id and key only encrypts the resources which changed")
+    args = parser.parse_args(argv)
+
+    util.init_logger(args.verbosity)
+
+    content_key = None
+    if args.content_key:
+        try:
+            content_key = base64.b64decode(args.content_key, validate=True)
+        except ValueError:
+            content_key = b""
+        if len(content_key) != 32:
+            LOGGER.error("The content key must be 32 bytes, base64 encoded")
+            return 1
+    cache = encrypt_cache.EncryptionCache(args.cache) if args.cache else None
+
+    try:
+        output = sys.stdout.buffer if args.output == '-' else args.output
+        result = encrypt_epub(args.input, output, args.content_id, content_key, args.jobs, cache)
+    except EncryptionError as err:
+        LOGGER.error(err)
+        return 1
+    # the protected file may be on the standard output
+    print(json.dumps(result, indent=2), file=sys.stderr if args.output == '-' else sys.stdout)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
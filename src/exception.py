@@ -24,3 +24,11 @@ class LCPLicenseError(Exception):
 class LCPCmdError(Exception):
     """Occurs during LCP license handling"""
     pass
+
+class ZipArchiveError(Exception):
+    """Occurs during zip archive reading"""
+    pass
+
+class EncryptionError(Exception):
+    """Occurs during the encryption of a publication"""
+    pass
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+
+"""
+HTTP layer of the test suites which call live servers (status documents, hint pages, remote publications)
+
+Every request goes through a scheduler shared by the process, configured in the http section
+of the configuration file:
+
+    http:
+      # maximum number of requests per second, all hosts together (default: no limit)
+      rate: 10
+      # number of requests which can be sent at once after an idle period (default: rate)
+      burst: 10
+      # maximum number of requests in progress per host (default: no limit)
+      max_per_host: 4
+      # number of retries of a request answered by 429, or by 503 for GET, HEAD and OPTIONS (default 3)
+      max_retries: 3
+      # longest Retry-After delay accepted, in seconds; beyond, the response is returned (default 60)
+      max_retry_after: 60
+      # maximum bandwidth of the downloads streamed by the checks, in bytes per second (default: no limit)
+      max_bandwidth: 10000000
+
+A 429 or 503 response holds back every request to the host, during the Retry-After delay
+(or an exponential backoff if the header is missing), then the request is sent again.
+A request which changes the state of the server (register, renew, return) is sent again after a 429 only,
+which means it was not processed; after a 503, it may have been.
+
+The worker processes of a batch share out max_per_host; with more workers than max_per_host,
+they share a semaphore instead, which limits their requests in progress to all hosts together.
+
+Copyright 2017 European Digital Reading Lab. All rights reserved.
+Licensed to the Readium Foundation under one or more contributor license agreements.
+Use of this source code is governed by a BSD-style license
+that can be found in the LICENSE file exposed on Github (readium) in the project repository.
+"""
+
+import contextlib
+import email.utils
+import logging
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+
+LOGGER = logging.getLogger(__name__)
+
+RETRY_STATUS = (429, 503)
+# status retried whatever the method: the request was not processed
+RETRY_ANY_METHOD = (429,)
+# methods retried after any status of RETRY_STATUS
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# first backoff delay when a 429/503 response has no Retry-After header, in seconds
+BACKOFF = 1.0
+
+
+class TokenBucket:
+    """Requests (or bytes) per second limit"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1.0, self.rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, amount=1):
+        """Wait for amount tokens; an amount above the capacity waits for a full bucket"""
+
+        needed = min(amount, self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= needed:
+                    self.tokens -= amount
+                    return
+                delay = (needed - self.tokens) / self.rate
+            time.sleep(delay)
+
+
+class Scheduler:
+    """Rate limit, per host concurrency limit and backoff of the requests of a process"""
+
+    def __init__(self, rate=None, burst=None, max_per_host=None, max_retries=3, max_retry_after=60):
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.max_per_host = max_per_host
+        self.max_retries = max_retries
+        self.max_retry_after = max_retry_after
+        self.lock = threading.Lock()
+        # host -> semaphore of the requests in progress
+        self.slots = {}
+        # host -> time before which no request is sent
+        self.blocked = {}
+
+    def _slot(self, host):
+        with self.lock:
+            if host not in self.slots:
+                self.slots[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self.slots[host]
+
+    def _wait_host(self, host):
+        # returns True if the host was blocked
+        waited = False
+        while True:
+            with self.lock:
+                delay = self.blocked.get(host, 0) - time.monotonic()
+            if delay <= 0:
+                return waited
+            time.sleep(delay)
+            waited = True
+
+    def _block_host(self, host, delay):
+        with self.lock:
+            self.blocked[host] = max(self.blocked.get(host, 0), time.monotonic() + delay)
+
+    def send(self, host, send_request, method="GET"):
+        """
+        Send a request, following the limits
+
+        Args:
+            host (str): host of the request
+            send_request: function sending the request, returns a response
+            method (str): method of the request
+
+        Returns
+            the response
+        """
+
+        attempt = 0
+        while True:
+            self._wait_host(host)
+            if self.bucket is not None:
+                self.bucket.acquire()
+                # the host may have been blocked while waiting for a token
+                while self._wait_host(host):
+                    self.bucket.acquire()
+            # the slots are held until the response headers are received
+            with contextlib.ExitStack() as slots:
+                if self.max_per_host:
+                    slots.enter_context(self._slot(host))
+                    if _shared_slots is not None:
+                        slots.enter_context(_shared_slots)
+                r = send_request()
+
+            if r.status_code not in RETRY_STATUS or attempt >= self.max_retries:
+                return r
+            if r.status_code not in RETRY_ANY_METHOD and method.upper() not in SAFE_METHODS:
+                return r
+            delay = retry_after(r)
+            if delay is None:
+                delay = BACKOFF * 2 ** attempt
+            if delay > self.max_retry_after:
+                LOGGER.warning("{} asks to retry in {}s, the request is not retried".format(host, delay))
+                return r
+            LOGGER.info("Error {} from {}, retry in {}s".format(r.status_code, host, delay))
+            r.close()
+            self._block_host(host, delay)
+            attempt += 1
+
+
+def retry_after(r):
+    """
+    Returns
+        the Retry-After delay of a response in seconds, or None
+    """
+
+    value = r.headers.get("Retry-After")
+    if value is None:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0, date.timestamp() - time.time())
+
+
+class ScheduledSession(requests.Session):
+    """requests session whose requests go through a scheduler"""
+
+    def __init__(self, scheduler):
+        super().__init__()
+        self.scheduler = scheduler
+
+    def request(self, method, url, *args, **kwargs):
+        host = urlsplit(url).netloc
+        return self.scheduler.send(host, lambda: super(ScheduledSession, self).request(method, url, *args, **kwargs),
+                                   method)
+
+
+# semaphore shared with the other worker processes of a batch, see share_slots
+_shared_slots = None
+
+def share_slots(semaphore):
+    """
+    Limit the requests in progress of the process with a semaphore shared by other processes,
+    when they are more than max_per_host
+
+    Args:
+        semaphore: multiprocessing semaphore of max_per_host slots, None to remove the limit
+    """
+
+    global _shared_slots
+    _shared_slots = semaphore
+
+
+# one scheduler per process and configuration
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+def get_scheduler(http_config):
+    """
+    Scheduler shared by the sessions of the process
+
+    Args:
+        http_config (dict): http section of the configuration file
+    """
+
+    options = {k: http_config.get(k) for k in ("rate", "burst", "max_per_host")}
+    options["max_retries"] = http_config.get("max_retries", 3)
+    options["max_retry_after"] = http_config.get("max_retry_after", 60)
+    key = tuple(sorted(options.items()))
+    with _schedulers_lock:
+        if key not in _schedulers:
+            _schedulers[key] = Scheduler(**options)
+        return _schedulers[key]
+
+# one bandwidth limit per process and rate
+_bandwidths = {}
+
+def get_bandwidth(http_config):
+    """
+    Bandwidth limit shared by the downloads of the process
+
+    Args:
+        http_config (dict): http section of the configuration file
+
+    Returns
+        TokenBucket: bytes per second, None if there is no limit
+    """
+
+    rate = http_config.get("max_bandwidth")
+    if not rate:
+        return None
+    with _schedulers_lock:
+        if rate not in _bandwidths:
+            _bandwidths[rate] = TokenBucket(rate)
+        return _bandwidths[rate]
+
+def session(config):
+    """
+    New session of a test suite
+
+    Args:
+        config (TestConfig): Configuration object
+    """
+
+    return ScheduledSession(get_scheduler(config.http))
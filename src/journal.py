@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+"""
+Job journal of a batch run: one json line per checked item, appended as the items complete.
+
+The records are written in batches, each batch is flushed to disk:
+after a crash or an interruption, at most one batch is lost and the run can be resumed.
+A journal can be read, and summarized, while the run is still going:
+an incomplete last line is ignored.
+Besides the item records, a record {"run": {...}} is written at the end of every run
+(shard, host, elapsed time, counters).
+
+Copyright 2017 European Digital Reading Lab. All rights reserved.
+Licensed to the Readium Foundation under one or more contributor license agreements.
+Use of this source code is governed by a BSD-style license
+that can be found in the LICENSE file exposed on Github (readium) in the project repository.
+"""
+
+import json
+import logging
+import os
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+
+def read_records(journal_path):
+    """
+    Records of a journal, in the order they were written
+
+    Yields
+        dict: one record per checked item or per run
+    """
+
+    with open(journal_path, 'rb') as journal_file:
+        for line in journal_file:
+            if not line.endswith(b"\n"):
+                # being written, or lost in a crash
+                break
+            try:
+                yield json.loads(line)
+            except ValueError:
+                LOGGER.warning("Invalid record in the journal {}".format(journal_path))
+
+
+def summarize(records):
+    """
+    Totals of a set of records
+
+    Returns
+        dict: number of items checked, passed, failed, in error, checking time and failures per test
+    """
+
+    summary = {"items": 0, "passed": 0, "failed": 0, "errors": 0, "duration": 0.0, "failures": {}}
+    for record in records:
+        if "item" not in record:
+            continue
+        summary["items"] += 1
+        summary["duration"] += record.get("duration", 0)
+        if "error" in record:
+            summary["errors"] += 1
+        elif record["passed"]:
+            summary["passed"] += 1
+        else:
+            summary["failed"] += 1
+            for failure in record.get("failures", []):
+                test = "{}.{}".format(failure["suite"], failure["test"])
+                summary["failures"][test] = summary["failures"].get(test, 0) + 1
+    summary["duration"] = round(summary["duration"], 3)
+    return summary
+
+
+class Journal:
+    """Append only journal of a batch run"""
+
+    def __init__(self, journal_path, batch_size=100, flush_interval=5.0):
+        """
+        Args:
+            journal_path (str): path of the journal (json lines)
+            batch_size (int): number of records written at once
+            flush_interval (float): maximum delay in seconds before pending records are written
+        """
+
+        self.journal_path = journal_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending = []
+        self.last_flush = time.monotonic()
+        self.journal_file = None
+
+    def done_items(self):
+        """
+        Items already checked in a previous run; the items which raised an unexpected error are checked again
+
+        Returns
+            set: item paths
+        """
+
+        if not os.path.exists(self.journal_path):
+            return set()
+        return {record["item"] for record in read_records(self.journal_path)
+                if "item" in record and "error" not in record}
+
+    def open(self):
+        """Open the journal for appending, dropping an incomplete last record"""
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.journal_path)), exist_ok=True)
+        self.journal_file = open(self.journal_path, 'ab')
+        size = self.journal_file.tell()
+        if size:
+            with open(self.journal_path, 'rb') as journal_file:
+                journal_file.seek(max(0, size - 65536))
+                tail = journal_file.read()
+            if not tail.endswith(b"\n"):
+                end = tail.rfind(b"\n") + 1
+                self.journal_file.truncate(size - len(tail) + end)
+                LOGGER.warning("Incomplete last record removed from the journal {}".format(self.journal_path))
+        return self
+
+    def append(self, record):
+        """Add a record, written with the next batch"""
+
+        self.pending.append(json.dumps(record, separators=(',', ':')).encode('utf-8') + b"\n")
+        if len(self.pending) >= self.batch_size or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Write the pending records, and make sure they are on disk"""
+
+        if self.pending:
+            self.journal_file.write(b"".join(self.pending))
+            self.pending = []
+            self.journal_file.flush()
+            os.fsync(self.journal_file.fileno())
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        if self.journal_file is not None:
+            self.flush()
+            self.journal_file.close()
+            self.journal_file = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+"""
+Canonical form of an LCP license, the input of the signature (cf 2.1.6)
+
+The canonical form is computed in a single pass from the raw bytes of the license:
+the keys of every object are sorted while the json is parsed,
+the top-level signature member is removed and the tree is serialized once, without whitespace.
+
+The output is byte for byte the one of the Java signature verifier (Gson, UTF-8 input and output):
+    - keys are sorted in UTF-16 code unit order (java.lang.String.compareTo)
+    - numbers are read as doubles and written as integers; a non-integral number is an error
+    - no html escaping; control characters, U+2028 and U+2029 are escaped
+    - unpaired surrogates are replaced by '?'
+
+The input must be strict json: the leniencies of Gson (comments, unquoted names ...) are errors.
+Objects nested in an array of arrays, which do not occur in a license, are sorted as well.
+
+Usage: python jsoncanon.py [--bench] license.lcpl...
+
+Copyright 2017 European Digital Reading Lab. All rights reserved.
+Licensed to the Readium Foundation under one or more contributor license agreements.
+Use of this source code is governed by a BSD-style license
+that can be found in the LICENSE file exposed on Github (readium) in the project repository.
+"""
+
+import json
+import math
+import sys
+import time
+from decimal import Decimal
+from operator import itemgetter
+
+# one encoder for every license
+_ENCODER = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), allow_nan=False)
+
+_KEY = itemgetter(0)
+
+
+class CanonicalizationError(ValueError):
+    """The license cannot be canonicalized"""
+
+
+def _utf16_key(pair):
+    return pair[0].encode('utf-16-be', 'surrogatepass')
+
+class _DuplicateKeys(dict):
+    """Object with a duplicate key, the last value is kept"""
+
+def _sorted_object(pairs):
+    # keys outside the Basic Multilingual Plane are ordered differently in UTF-16
+    if any(max(key, default=' ') >= '\ud800' for key, _ in pairs):
+        pairs.sort(key=_utf16_key)
+    else:
+        pairs.sort(key=_KEY)
+    obj = dict(pairs)
+    if len(obj) != len(pairs):
+        # Gson rejects a duplicate key at the top level only
+        return _DuplicateKeys(obj)
+    return obj
+
+def _number(literal):
+    # Gson reads every number as a double, then writes its exact integer value
+    value = float(literal)
+    if math.isinf(value):
+        raise CanonicalizationError("number out of range: {}".format(literal))
+    if value.is_integer():
+        # BigDecimal.valueOf(double) starts from the decimal representation of the double
+        return int(Decimal(repr(value))) if abs(value) >= 2**53 else int(value)
+    raise CanonicalizationError("non integral number: {}".format(literal))
+
+def _int_number(literal):
+    # integers up to 15 digits are exact doubles
+    if len(literal) <= 15:
+        return int(literal)
+    return _number(literal)
+
+def _constant(literal):
+    raise CanonicalizationError("invalid number: {}".format(literal))
+
+_DECODER = json.JSONDecoder(
+    object_pairs_hook=_sorted_object, parse_float=_number, parse_int=_int_number, parse_constant=_constant)
+
+
+def canonicalize(data):
+    """
+    Canonical form of a license
+
+    Args:
+        data (bytes or str): raw license
+
+    Returns
+        bytes: utf-8 encoded canonical json
+
+    Raises
+        CanonicalizationError if the license is not a json object or holds values Gson does not accept
+    """
+
+    if isinstance(data, (bytes, bytearray)):
+        try:
+            data = data.decode('utf-8')
+        except UnicodeDecodeError as err:
+            raise CanonicalizationError("invalid utf-8: {}".format(err))
+    try:
+        license = _DECODER.decode(data)
+    except CanonicalizationError:
+        raise
+    except ValueError as err:
+        raise CanonicalizationError("invalid json: {}".format(err))
+    if not isinstance(license, dict):
+        raise CanonicalizationError("a license is a json object")
+    if isinstance(license, _DuplicateKeys):
+        raise CanonicalizationError("duplicate key in the license")
+
+    # the first top-level member named signature, whatever its case
+    for key in license:
+        if key.lower() == "signature":
+            del license[key]
+            break
+
+    canonical = _ENCODER.encode(license)
+    if '\u2028' in canonical or '\u2029' in canonical:
+        canonical = canonical.replace('\u2028', '\\u2028').replace('\u2029', '\\u2029')
+    # java.lang.String.getBytes(UTF_8) replaces unpaired surrogates by '?'
+    return canonical.encode('utf-8', 'replace')
+
+
+def bench(paths, duration=2.0):
+    """
+    Measure the throughput of the canonicalization
+
+    Returns
+        dict: number of licenses, megabytes per second and licenses per second
+    """
+
+    licenses = []
+    for path in paths:
+        with open(path, 'rb') as license_file:
+            licenses.append(license_file.read())
+    size = sum(len(data) for data in licenses)
+
+    count = 0
+    start = time.perf_counter()
+    elapsed = 0
+    while elapsed < duration:
+        for data in licenses:
+            canonicalize(data)
+        count += 1
+        elapsed = time.perf_counter() - start
+    return {
+        "licenses": len(licenses),
+        "mb_per_s": round(count * size / elapsed / 1e6, 2),
+        "licenses_per_s": round(count * len(licenses) / elapsed)
+        }
+
+
+def main(argv=None):
+    args = sys.argv[1:] if argv is None else argv
+    if args and args[0] == "--bench":
+        print(json.dumps(bench(args[1:])))
+        return 0
+    for path in args:
+        with open(path, 'rb') as license_file:
+            try:
+                sys.stdout.buffer.write(canonicalize(license_file.read()) + b"\n")
+            except CanonicalizationError as err:
+                print("{}: {}".format(path, err), file=sys.stderr)
+                return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
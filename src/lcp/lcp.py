@@ -3,6 +3,7 @@ from jsonschema import validate as jsonvalidate
 from dateutil.parser import parse as dateparse
 import time
 
+import jsoncanon
 from config.testconfig import TestConfig
 
 class License():
@@ -64,7 +65,7 @@ class License():
 
   # compute canonical form 
   def get_canonical(self):
-    return self.crypto.canonical(self.rawlicense)
+    return jsoncanon.canonicalize(self.rawlicense).decode('utf-8')
 
   # check schema
   def check_schema(self):
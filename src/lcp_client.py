@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+"""
+Client of the License Server and License Status Server APIs,
+used by the tools which drive a server (benchmarks ...).
+
+Copyright 2017 European Digital Reading Lab. All rights reserved.
+Licensed to the Readium Foundation under one or more contributor license agreements.
+Use of this source code is governed by a BSD-style license
+that can be found in the LICENSE file exposed on Github (readium) in the project repository.
+"""
+
+import datetime
+import hashlib
+import json
+import re
+import uuid
+from urllib.parse import urljoin
+
+import requests
+
+W3C_DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S+00:00"
+
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+def build_partial_license(passphrase, passphrase_hint, user_id=None, rights=None, provider_id=None):
+    """
+    Build a partial license, to be completed by the License Server
+
+    Args:
+        passphrase (str): user passphrase, hashed in the partial license
+        passphrase_hint (str): user passphrase hint
+        user_id (str): user id; random if None
+        provider_id (str): provider uri; random if None
+        rights (dict): rights; if None: 2 pages to print, 100 characters to copy, 100 days to read
+
+    Returns:
+        dict
+    """
+
+    if rights is None:
+        # 100 days to read the publication
+        license_start_datetime = datetime.datetime.today()
+        license_end_datetime = license_start_datetime + \
+            datetime.timedelta(days=100)
+        rights = {
+            "print": 2,
+            "copy": 100,
+            "start": license_start_datetime.strftime(W3C_DATETIME_FORMAT),
+            "end": license_end_datetime.strftime(W3C_DATETIME_FORMAT)
+        }
+
+    # Random provider id, in the form of a uri
+    if provider_id is None:
+        provider_id = "http://{}.com".format(str(uuid.uuid4()))
+    # Random user id and email
+    if user_id is None:
+        user_id = str(uuid.uuid4())
+    user_email = "{}@lcp.edrlab.org".format(user_id)
+
+    # Hash the passphrase
+    hash_engine = hashlib.sha256()
+    hash_engine.update(passphrase.encode("utf-8"))
+    user_hashed_passphrase = hash_engine.hexdigest()
+
+    return {
+        "provider": provider_id,
+        "user": {
+            "id": user_id,
+            "email": user_email,
+            "encrypted": ["email"]
+        },
+        "encryption": {
+            "user_key": {
+                "text_hint": passphrase_hint,
+                "value": user_hashed_passphrase,
+                "algorithm": "http://www.w3.org/2001/04/xmlenc#sha256"
+                }
+        },
+        "rights": rights
+    }
+
+
+class LicenseServerClient:
+    """Calls to the License Server API"""
+
+    def __init__(self, base_uri, user, passwd, session=None):
+        """
+        Args:
+            base_uri (str): url of the License Server
+            user, passwd (str): credentials of the License Server API
+            session (requests.Session): session to use; a new one if None
+        """
+
+        self.base_uri = base_uri
+        self.auth = (user, passwd)
+        self.session = session or requests.Session()
+
+    def store_content(self, content_id, encryption_key, location, length, sha256, disposition):
+        """Store an encrypted publication: PUT /contents/{id}"""
+
+        body = json.dumps({
+            "content-id": content_id,
+            "content-encryption-key": encryption_key,
+            "protected-content-location": location,
+            "protected-content-length": length,
+            "protected-content-sha256": sha256,
+            "protected-content-disposition": disposition
+        })
+        url = urljoin(self.base_uri, "/contents/{0}".format(content_id))
+        return self.session.put(url, headers=JSON_HEADERS, data=body, auth=self.auth)
+
+    def generate_license(self, content_id, partial_license):
+        """Generate a license: POST /contents/{id}/license"""
+
+        url = urljoin(self.base_uri, "/contents/{}/license".format(content_id))
+        return self.session.post(url, headers=JSON_HEADERS, data=json.dumps(partial_license), auth=self.auth)
+
+    def generate_publication(self, content_id, partial_license):
+        """
+        Generate a protected publication: POST /contents/{id}/publication
+        The response is streamed, the caller reads the publication from it.
+        """
+
+        url = urljoin(self.base_uri, "/contents/{0}/publication".format(content_id))
+        return self.session.post(url, headers=JSON_HEADERS, data=json.dumps(partial_license),
+            auth=self.auth, stream=True)
+
+
+def find_link(document, rel):
+    """
+    Returns
+        the url of the first link of a license or status document with this rel, or None
+    """
+
+    for link in document.get('links', []):
+        if link.get('rel') == rel:
+            return link['href']
+    return None
+
+
+def expand_link(url):
+    """Remove the template part of a templated url"""
+
+    return re.sub("{.*?}", '', url)
+
+
+def register_device(session, status_document, device_id, device_name):
+    """Register a device, using the register link of a status document"""
+
+    url = expand_link(find_link(status_document, 'register'))
+    return session.post(url, params={"id": device_id, "name": device_name})
+
+
+def renew_license(session, status_document, device_id, device_name, end):
+    """Renew a license until the end datetime, using the renew link of a status document"""
+
+    url = expand_link(find_link(status_document, 'renew'))
+    return session.put(url, params={"id": device_id, "name": device_name, "end": end.strftime(W3C_DATETIME_FORMAT)})
+
+
+def return_license(session, status_document, device_id, device_name):
+    """Return a license, using the return link of a status document"""
+
+    url = expand_link(find_link(status_document, 'return'))
+    return session.put(url, params={"id": device_id, "name": device_name})
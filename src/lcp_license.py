@@ -8,16 +8,103 @@ import os
 import sys
 import logging
 import json
+import functools
 import jsonschema
 import base64
+import hashlib
 import datetime
-import lcpcrypto
 import dateutil.parser
 import subprocess
 from exception import LCPLicenseError
 
 LOGGER = logging.getLogger(__name__)
 
+# the only encryption algorithm of the content key (and of the user fields) in the LCP profiles
+AES256_CBC = "http://www.w3.org/2001/04/xmlenc#aes256-cbc"
+
+# signature algorithms of a license
+RSA_SHA256 = "http://www.w3.org/2001/04/xmldsig-more#rsa-sha256"
+ECDSA_SHA256 = "http://www.w3.org/2001/04/xmldsig-more#ecdsa-sha256"
+
+
+@functools.lru_cache(maxsize=None)
+def schema_validator(schema_path):
+  # the json schema is loaded and checked once per process, 
+  # the resulting validator is shared by every license
+  with open(schema_path, 'r', encoding='utf8') as schema_file:
+    json_schema = json.load(schema_file)
+  validator_class = jsonschema.validators.validator_for(json_schema)
+  validator_class.check_schema(json_schema)
+  return validator_class(json_schema, format_checker=jsonschema.FormatChecker())
+
+
+# result of the chain validation of provider certificates, 
+# keyed by (certificate sha256 fingerprint, root certificate path):
+# (validity start, validity end, error message or None)
+_certificate_cache = {}
+
+@functools.lru_cache(maxsize=None)
+def root_certificate(cacert_path):
+  # the root certificate is loaded once per process
+  from OpenSSL import crypto
+
+  if not os.path.exists(cacert_path):
+    raise LCPLicenseError("Root certificate file {0} not found".format(cacert_path))
+  with open(cacert_path, 'rb') as cert_file:
+    root = crypto.load_certificate(crypto.FILETYPE_PEM, cert_file.read())
+  return root, _asn1_datetime(root.get_notBefore()), _asn1_datetime(root.get_notAfter())
+
+def _asn1_datetime(value):
+  return datetime.datetime.strptime(value.decode('ascii'), '%Y%m%d%H%M%SZ').replace(tzinfo=datetime.timezone.utc)
+
+def certificate_chain(certificate_der, cacert_path):
+  # validate a provider certificate against the root certificate, once per certificate.
+  # returns the period during which the chain is valid, or raises LCPLicenseError.
+  fingerprint = hashlib.sha256(certificate_der).hexdigest()
+  key = (fingerprint, cacert_path)
+  if key not in _certificate_cache:
+    _certificate_cache[key] = _verify_chain(certificate_der, cacert_path)
+    LOGGER.debug("provider certificate {} checked".format(fingerprint))
+  not_before, not_after, error = _certificate_cache[key]
+  if error:
+    raise LCPLicenseError(error)
+  return not_before, not_after
+
+def _verify_chain(certificate_der, cacert_path):
+  from OpenSSL import crypto
+
+  root, root_not_before, root_not_after = root_certificate(cacert_path)
+  try:
+    certificate = crypto.load_certificate(crypto.FILETYPE_ASN1, certificate_der)
+  except crypto.Error as err:
+    return None, None, "Invalid provider certificate: {}".format(err)
+
+  # the chain must be valid during a common period of both certificates
+  not_before = max(_asn1_datetime(certificate.get_notBefore()), root_not_before)
+  not_after = min(_asn1_datetime(certificate.get_notAfter()), root_not_after)
+  if not_before > not_after:
+    return None, None, "The provider and root certificates have no common validity period"
+
+  # the verification time is set inside this period: 
+  # the validity at the issued datetime of each license is checked apart
+  store = crypto.X509Store()
+  store.add_cert(root)
+  store.set_time(not_before)
+  try:
+    crypto.X509StoreContext(store, certificate).verify_certificate()
+  except crypto.X509StoreContextError as err:
+    return None, None, "The provider certificate is not signed by the root certificate: {}".format(err)
+  return not_before, not_after, None
+
+
+@functools.lru_cache(maxsize=256)
+def _certificate_identity(data, pem=False):
+  # issuer (DER encoded name) and serial number of a certificate
+  from cryptography import x509
+
+  certificate = x509.load_pem_x509_certificate(data) if pem else x509.load_der_x509_certificate(data)
+  return certificate.issuer.public_bytes(), certificate.serial_number
+
 
 class LCPLicense:
 
@@ -26,6 +113,8 @@ class LCPLicense:
     self.l = None
     # license path
     self.license_path = None
+    # raw license, the source of the canonical form
+    self.raw = None
   
   def parse(self, license_path):
     self.license_path = license_path
@@ -34,8 +123,20 @@ class LCPLicense:
       raise LCPLicenseError(
         "License file {0} not found".format(self.license_path))
 
-    with open(license_path, 'r', encoding='utf8') as json_file:    
-      self.l = json.load(json_file)
+    with open(license_path, 'rb') as json_file:    
+      self.raw = json_file.read()
+    try:
+      self.l = json.loads(self.raw)
+    except ValueError as err:
+      raise LCPLicenseError("License file {0} is not valid json: {1}".format(self.license_path, err))
+
+  def canonical(self):
+    # returns the canonical form of the license, i.e. the input of the signature (cf 2.1.6)
+    import jsoncanon
+    try:
+      return jsoncanon.canonicalize(self.raw)
+    except jsoncanon.CanonicalizationError as err:
+      raise LCPLicenseError("The license cannot be canonicalized: {}".format(err))
 
 
   def validate(self, schema_path):
@@ -44,12 +145,9 @@ class LCPLicense:
     #   check the profile Value (basic or 1.0)
     #   check the encryption method (aes-cbc), user key (sha256) and signature algorithm (ecdsa-sha256)
 
-    with open(schema_path, 'r', encoding='utf8') as schema_file:
-      lcpl_json_schema = json.load(schema_file)
-      try:
-        jsonschema.validate(self.l, lcpl_json_schema, format_checker=jsonschema.FormatChecker())
-      except jsonschema.ValidationError as err:
-        raise LCPLicenseError(err)
+    error = jsonschema.exceptions.best_match(schema_validator(schema_path).iter_errors(self.l))
+    if error is not None:
+      raise LCPLicenseError(error)
 
 
   def hint_link(self):
@@ -117,34 +215,146 @@ class LCPLicense:
 
     hash_algorithm = self.l['encryption']['user_key']['algorithm']
 
-    passphrase_hash = lcpcrypto.hash(passphrase, hash_algorithm)
-    if passphrase_hash == None:
-        raise LCPLicenseError("error hashing the passphrase")
+    # pycryptodome is only loaded when a passphrase based check is run
+    import lcpcrypto
+    # the user key is derived once per passphrase
+    user_key = lcpcrypto.user_key(passphrase, hash_algorithm)
 
-    decrypt_algorithm = self.l['encryption']['content_key']['algorithm']
-    clear_value = lcpcrypto.decrypt(key_check_bytes, passphrase_hash, decrypt_algorithm)
+    clear_value = lcpcrypto.decrypt_cbc(key_check_bytes, user_key)
     if clear_value == None:
         raise LCPLicenseError("error decrypting the key check value")
 
     license_id = self.l['id']
-    if clear_value != license_id:
+    if clear_value != license_id.encode('utf-8'):
         raise LCPLicenseError("decrypted key check {} different from id {} ".format(clear_value, license_id))            
-    pass
+
+  def check_user_info(self, passphrase):
+    # check that the user fields listed in user/encrypted are decryptable with the user key
+    # (cf 2.1.4.7), using the algorithm identified in encryption/content_key/algorithm
+    user = self.l.get('user', {})
+    encrypted = user.get('encrypted', [])
+    if not encrypted:
+      LOGGER.info("No encrypted user info")
+      return
+
+    algorithm = self.l['encryption'].get('content_key', {}).get('algorithm')
+    if algorithm != AES256_CBC:
+      raise LCPLicenseError("The user fields cannot be decrypted with the algorithm {}".format(algorithm))
+
+    import lcpcrypto
+    # the user key is derived once per passphrase, for all licenses
+    user_key = lcpcrypto.user_key(passphrase, self.l['encryption']['user_key']['algorithm'])
+
+    for field in encrypted:
+      if field not in user:
+        raise LCPLicenseError("The encrypted user field '{}' is missing".format(field))
+      try:
+        data = base64.b64decode(user[field], validate=True)
+      except (TypeError, ValueError):
+        raise LCPLicenseError("The encrypted user field '{}' is not base64 encoded".format(field))
+
+      clear_value = lcpcrypto.decrypt_cbc(data, user_key)
+      if clear_value is None:
+        raise LCPLicenseError("The user field '{}' cannot be decrypted with the user key".format(field))
+      try:
+        clear_value.decode('utf-8')
+      except UnicodeDecodeError:
+        raise LCPLicenseError("The decrypted user field '{}' is not a valid utf-8 string".format(field))
+      # the decrypted values are personal data, they are not logged
+      LOGGER.info("user {} decrypted".format(field))
+
+  def check_certificate(self, cacert_path):
+    # check the provider certificate against the root certificate, and its validity at the issued datetime.
+    # the chain is validated once per certificate, see certificate_chain.
+    try:
+      certificate_der = base64.b64decode(self.l['signature']['certificate'])
+    except (KeyError, ValueError) as err:
+      raise LCPLicenseError("Invalid provider certificate in the license: {}".format(err))
+
+    not_before, not_after = certificate_chain(certificate_der, cacert_path)
+
+    issued = dateutil.parser.parse(self.l['issued'])
+    if issued.tzinfo is None:
+      issued = issued.replace(tzinfo=datetime.timezone.utc)
+    if issued < not_before or issued > not_after:
+      raise LCPLicenseError(
+        "The license was issued on {}, out of the certificate validity period ({} - {})".format(
+          self.l['issued'], not_before.isoformat(), not_after.isoformat()))
+
+  def check_revocation(self, crl_index, cacert_path):
+    # check that neither the provider certificate nor the root certificate is revoked,
+    # using an index of the revoked serial numbers (see crl_index)
+    certificate = _certificate_identity(base64.b64decode(self.l['signature']['certificate']))
+    with open(cacert_path, 'rb') as cert_file:
+      root = _certificate_identity(cert_file.read(), pem=True)
+
+    for name, (issuer, serial) in (("provider", certificate), ("root", root)):
+      revoked = crl_index.revocation(issuer, serial)
+      if revoked is False:
+        LOGGER.warning("No CRL for the issuer of the {} certificate".format(name))
+      elif revoked:
+        raise LCPLicenseError("The {} certificate (serial {:x}) was revoked on {}".format(name, serial, revoked))
+      else:
+        LOGGER.debug("The {} certificate is not revoked".format(name))
 
   def check_signature(self, cert_path):
-    # check the signature value using the java signature tool
-    # this java code returns 1+ if the signature is not valid 
+    # check the signature value over the canonical form of the license (cf 2.1.6),
+    # with the key of the provider certificate, itself validated against the root certificate.
+    # the java signature tool is used if the cryptography package is not available
     if not os.path.exists(cert_path):
         raise LCPLicenseError(
             "Root certificate file {0} not found".format(cert_path))
-        
+    try:
+      from cryptography import exceptions, x509
+      from cryptography.hazmat.primitives import hashes
+      from cryptography.hazmat.primitives.asymmetric import ec, padding, rsa, utils
+    except ImportError:
+      return self._check_signature_java(cert_path)
+
+    signature = self.l.get('signature')
+    if not isinstance(signature, dict):
+      raise LCPLicenseError("No signature in the license")
+    algorithm = signature.get('algorithm')
+    if algorithm not in (RSA_SHA256, ECDSA_SHA256):
+      raise LCPLicenseError("Bad signature algorithm {}, {} or {} expected".format(algorithm, RSA_SHA256, ECDSA_SHA256))
+    try:
+      certificate_der = base64.b64decode(signature['certificate'], validate=True)
+      value = base64.b64decode(signature['value'], validate=True)
+      public_key = x509.load_der_x509_certificate(certificate_der).public_key()
+    except (KeyError, TypeError, ValueError) as err:
+      raise LCPLicenseError("Invalid signature in the license: {}".format(err))
+    # the chain is validated once per certificate
+    certificate_chain(certificate_der, cert_path)
+
+    data = self.canonical()
+    try:
+      if algorithm == ECDSA_SHA256:
+        if not isinstance(public_key, ec.EllipticCurvePublicKey):
+          raise LCPLicenseError("ECDSA signature, but the provider certificate has no EC key")
+        # the value is r || s, DER encoded for the verification
+        half = len(value) // 2
+        der_value = utils.encode_dss_signature(int.from_bytes(value[:half], 'big'), int.from_bytes(value[half:], 'big'))
+        public_key.verify(der_value, data, ec.ECDSA(hashes.SHA256()))
+      else:
+        if not isinstance(public_key, rsa.RSAPublicKey):
+          raise LCPLicenseError("RSA signature, but the provider certificate has no RSA key")
+        public_key.verify(value, data, padding.PKCS1v15(), hashes.SHA256())
+    except exceptions.InvalidSignature:
+      raise LCPLicenseError("Invalid signature")
+    LOGGER.debug("Valid signature")
+
+  def _check_signature_java(self, cert_path):
+    # check the signature value using the java signature tool
+    # this java code returns 1+ if the signature is not valid 
     run_script = '../SignatureVerifier_Java/run-from-py.sh' if os.name == 'posix' else '../SignatureVerifier_Java/run-from-py.bat'
     run_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), run_script)
         
     # if a verbose signature check is needed for debug, add "verbose" as a last arg
-    args = [run_path, cert_path, self.license_path]
+    args = [run_path, os.path.abspath(cert_path), os.path.abspath(self.license_path)]
 
-    r = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    # the script expects to be launched from the root of the project
+    r = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True,
+      cwd=os.path.dirname(os.path.dirname(run_path)))
 
     if r.returncode > 0:
         LOGGER.error("return code is {}".format(r.returncode))
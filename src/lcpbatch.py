@@ -0,0 +1,479 @@
+# -*- coding: utf-8 -*-
+
+"""
+Batch audit of a store of LCP licenses and protected publications
+
+Every license (.lcpl) and protected publication (.epub) found in the given folders or lists is checked,
+by a pool of worker processes. The outcome of each item is recorded in a job journal (json lines);
+an interrupted run is continued with --resume, the items already recorded are skipped.
+
+    lcpcheck batch -c config.yml --journal audit.jsonl --jobs 8 /store/licenses /store/publications
+    lcpcheck batch -c config.yml --journal audit.jsonl --resume --list items.txt
+    lcpcheck batch --journal audit.jsonl --summary
+
+An audit can be split in N shards run on different machines sharing the store:
+    lcpcheck batch -c config.yml --shard 0/4 --journal audit-0.jsonl /store
+    ...
+    lcpcheck batch -c config.yml --shard 3/4 --journal audit-3.jsonl /store
+    lcpcheck merge -o audit.json audit-*.jsonl
+An item belongs to a single shard, chosen by a hash of its path (or of the license id):
+every shard must see the items under the same paths. Sharding by license id reads every license
+in every shard, before the shard is known; with --index, the ids of the indexed licenses are read
+from the index instead.
+
+Copyright 2017 European Digital Reading Lab. All rights reserved.
+Licensed to the Readium Foundation under one or more contributor license agreements.
+Use of this source code is governed by a BSD-style license
+that can be found in the LICENSE file exposed on Github (readium) in the project repository.
+"""
+
+import argparse
+import datetime
+import glob
+import hashlib
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import signal
+import socket
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import util
+import journal
+import memprofile
+import http_client
+from chkconfig import TestConfig
+
+LOGGER = logging.getLogger(__name__)
+
+# extensions of the files checked in a folder
+ITEM_EXTENSIONS = ('.lcpl', '.epub')
+
+# number of items submitted to the pool, per worker, ahead of their processing
+QUEUE_FACTOR = 4
+
+# minimum number of items checked by a worker to estimate its memory growth
+GROWTH_MIN_ITEMS = 100
+
+
+def iter_items(paths, list_path=None):
+    """
+    Items to check, in a stable order
+
+    Args:
+        paths (list): files, or folders searched recursively
+        list_path (str): file listing one item per line, '-' for stdin
+
+    Yields
+        str: item path
+    """
+
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(ITEM_EXTENSIONS):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+    if list_path:
+        list_file = sys.stdin if list_path == '-' else open(list_path, 'r', encoding='utf8')
+        try:
+            for line in list_file:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    yield line
+        finally:
+            if list_file is not sys.stdin:
+                list_file.close()
+
+
+def parse_shard(value):
+    """
+    Parse a shard specification "I/N", 0 <= I < N
+
+    Returns
+        (int, int): shard index and number of shards
+    """
+
+    try:
+        index, count = (int(v) for v in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError("a shard is given as I/N, e.g. 0/4")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError("the shard index must be between 0 and N-1")
+    return index, count
+
+
+def shard_of(item, count, key="path", index=None):
+    """
+    Shard of an item, stable across machines and runs
+
+    Args:
+        item (str): item path
+        count (int): number of shards
+        key (str): "path", or "id" to use the id of a license (the path of a publication)
+        index (license_index.LicenseIndex): index giving the id of the unchanged licenses;
+            the other licenses are parsed
+    """
+
+    value = item
+    if key == "id" and item.lower().endswith('.lcpl'):
+        license_id = index.license_id(item) if index is not None else None
+        if license_id is not None:
+            value = license_id
+        else:
+            try:
+                with open(item, 'r', encoding='utf8') as license_file:
+                    value = json.load(license_file)["id"]
+            except (OSError, ValueError, KeyError, TypeError):
+                # an unreadable license is sharded by path, and reported by its check
+                pass
+    digest = hashlib.sha1(str(value).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % count
+
+
+def record(item, result):
+    """
+    Journal record of a checked item: global result, timing and failed tests only
+    """
+
+    failures = []
+    for report in result["suites"]:
+        for test in report["tests"]:
+            if not test["passed"]:
+                failures.append({"suite": report["suite"], "test": test["test"], "message": test["message"]})
+    return {
+        "item": item,
+        "passed": result["passed"],
+        "duration": round(result["duration"], 4),
+        "suites": {report["suite"]: round(report["duration"], 4) for report in result["suites"]},
+        "failures": failures,
+        "finished": datetime.datetime.now(datetime.timezone.utc).isoformat()
+        }
+
+
+def memory_record(result):
+    """
+    Memory use of a checked item, when profiling: resident set size of the worker
+    and peak memory allocated by Python per suite (KiB)
+    """
+
+    suites = {}
+    for report in result["suites"]:
+        steps = [report.get("memory")] + [test.get("memory") for test in report["tests"]]
+        peaks = [step["peak_kib"] for step in steps if step is not None]
+        if peaks:
+            suites[report["suite"]] = max(peaks)
+    return {"pid": os.getpid(), "rss_kib": memprofile.current_rss(), "suites": suites}
+
+
+# configuration of a worker process
+_config = None
+
+def _init_worker(config_path, verbosity, jobs=1, profile_memory=False, pooled=None, run_id=None, http_slots=None):
+    global _config
+
+    if pooled is None:
+        # a single worker runs in the main process
+        pooled = jobs > 1
+
+    if pooled:
+        # an interruption is handled by the main process, which records the outcomes
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    util.init_logger(verbosity)
+    if profile_memory:
+        # the peaks only: the snapshots of the allocation sites are too slow for a batch
+        memprofile.start(top=0)
+    _config = TestConfig(config_path)
+    if pooled:
+        # every worker has its own http scheduler: the limits of the configuration are shared out
+        http = dict(_config.http)
+        if http.get('rate'):
+            http['rate'] = http['rate'] / jobs
+            http['burst'] = max(1, (http.get('burst') or http['rate'] * jobs) // jobs)
+        if http.get('max_per_host'):
+            http['max_per_host'] = max(1, http['max_per_host'] // jobs)
+        if http.get('max_bandwidth'):
+            http['max_bandwidth'] = http['max_bandwidth'] / jobs
+        _config.http = http
+        # more workers than max_per_host: one slot each is too much, they share max_per_host slots
+        http_client.share_slots(http_slots)
+    # the cache of the checked links is shared by the workers and kept between the runs
+    if not _config.links.get('cache_path'):
+        _config.links = dict(_config.links, cache_path=os.path.join(_config.working_path, "links.sqlite"))
+    # the files extracted by concurrent workers must not collide
+    _config.working_path = worker_path(_config.working_path, os.getpid() if run_id is None else run_id)
+    os.makedirs(_config.working_path, exist_ok=True)
+
+def worker_path(working_path, run_id, pid=None):
+    """
+    Returns
+        str: working folder of a worker of a run, identified by the pid of its main process
+    """
+
+    return os.path.join(working_path, "batch-{}-{}".format(run_id, os.getpid() if pid is None else pid))
+
+def remove_worker_paths(working_path, run_id):
+    """Remove the working folders of the workers of a run, not those of the other runs sharing the path"""
+
+    for path in glob.glob(os.path.join(glob.escape(working_path), "batch-{}-*".format(run_id))):
+        shutil.rmtree(path, ignore_errors=True)
+
+def _check(item):
+    import suite_runner
+
+    try:
+        result = suite_runner.check_file(_config, item)
+        rec = record(item, result)
+        if memprofile.active():
+            rec["memory"] = memory_record(result)
+        return rec
+    except Exception as err:
+        # an unexpected error does not stop the run, the item is checked again on resume
+        LOGGER.exception("Error checking {}".format(item))
+        return error_record(item, err)
+
+def shared_http_slots(http_config, jobs):
+    """
+    Returns
+        semaphore of max_per_host slots shared by the workers, if they are more than max_per_host, None otherwise
+    """
+
+    max_per_host = http_config.get('max_per_host')
+    if not max_per_host or jobs <= max_per_host:
+        return None
+    LOGGER.warning("{} workers for max_per_host {}: the workers send at most {} requests at once, "
+                   "to all hosts together".format(jobs, max_per_host, max_per_host))
+    return multiprocessing.BoundedSemaphore(max_per_host)
+
+def error_record(item, err):
+    """
+    Returns
+        dict: journal record of an item whose check raised an unexpected error
+    """
+
+    return {"item": item, "passed": False, "error": "{}: {}".format(type(err).__name__, err),
+            "finished": datetime.datetime.now(datetime.timezone.utc).isoformat()}
+
+
+class BatchRun:
+    """Check items with a pool of workers and record the outcomes in a journal"""
+
+    def __init__(self, config_path, verbosity, jobs, job_journal, profile_memory=False, http_slots=None):
+        """
+        Args:
+            config_path (str): path to the yaml configuration file
+            verbosity (int): verbosity of the workers
+            jobs (int): number of worker processes
+            job_journal (journal.Journal): opened journal
+            profile_memory (bool): record the memory use of the workers
+            http_slots: semaphore limiting the requests in progress of the workers, see shared_http_slots
+        """
+
+        self.config_path = config_path
+        self.verbosity = verbosity
+        self.jobs = jobs
+        self.journal = job_journal
+        self.profile_memory = profile_memory
+        self.http_slots = http_slots
+        # the working folders of the workers are named after the main process
+        self.run_id = os.getpid()
+        self.checked = 0
+        self.skipped = 0
+        self.failed = 0
+        # worker pid -> [items checked, first rss, last rss, peak rss] (KiB)
+        self.workers = {}
+
+    def _done(self, rec):
+        self.journal.append(rec)
+        self.checked += 1
+        if not rec["passed"]:
+            self.failed += 1
+        memory = rec.get("memory")
+        if memory is not None and memory["rss_kib"] is not None:
+            worker = self.workers.setdefault(memory["pid"], [0, memory["rss_kib"], 0, 0])
+            worker[0] += 1
+            worker[2] = memory["rss_kib"]
+            worker[3] = max(worker[3], memory["rss_kib"])
+        if self.checked % 1000 == 0:
+            LOGGER.warning("{} items checked, {} failed".format(self.checked, self.failed))
+            if self.workers:
+                report = self.memory_report()
+                LOGGER.warning("Worker memory: peak RSS {} KiB, growth {} KiB per 1000 items".format(
+                    report["peak_rss_kib"], report["growth_per_1000_kib"]))
+
+    def memory_report(self):
+        """
+        Memory use of the workers
+
+        Returns
+            dict: peak resident set size of a worker, and its mean growth per 1000 items (KiB),
+                measured from the first item checked by the worker, once its imports and caches are loaded
+        """
+
+        growths = [(last - first) * 1000 / (count - 1) for count, first, last, peak in self.workers.values()
+                   if count >= GROWTH_MIN_ITEMS]
+        return {
+            "workers": len(self.workers),
+            "peak_rss_kib": max((worker[3] for worker in self.workers.values()), default=None),
+            "growth_per_1000_kib": round(sum(growths) / len(growths), 1) if growths else None
+            }
+
+    def run(self, items, done=frozenset(), shard=None, shard_key="path", license_index=None):
+        """
+        Check the items not in done, and in the shard (index, count) if any
+
+        Args:
+            license_index (license_index.LicenseIndex): index giving the license ids of the shard key
+        """
+
+        if shard is not None:
+            index, count = shard
+            items = (item for item in items if shard_of(item, count, shard_key, license_index) == index)
+        todo = self._skip(items, done)
+        if self.jobs == 1:
+            _init_worker(self.config_path, self.verbosity, profile_memory=self.profile_memory, run_id=self.run_id)
+            for item in todo:
+                self._done(_check(item))
+            return
+
+        # a bounded number of items is submitted ahead: the list of items may be huge
+        with ProcessPoolExecutor(max_workers=self.jobs, initializer=_init_worker,
+                initargs=(self.config_path, self.verbosity, self.jobs, self.profile_memory, None,
+                          self.run_id, self.http_slots)) as pool:
+            pending = set()
+            try:
+                for item in todo:
+                    if len(pending) >= self.jobs * QUEUE_FACTOR:
+                        finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in finished:
+                            self._done(future.result())
+                    pending.add(pool.submit(_check, item))
+                for future in wait(pending).done:
+                    self._done(future.result())
+            except BaseException:
+                pool.shutdown(wait=False, cancel_futures=True)
+                raise
+
+    def _skip(self, items, done):
+        for item in items:
+            if item in done:
+                self.skipped += 1
+            else:
+                yield item
+
+
+def _terminate(signum, frame):
+    # a terminated run is stopped like an interrupted one: the journal is flushed
+    raise KeyboardInterrupt
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="lcpcheck batch")
+    parser.add_argument("-v", "--verbosity", action="count", help="increase output verbosity")
+    parser.add_argument("-c", "--config", help="path to the yaml configuration file")
+    parser.add_argument("paths", nargs="*", help="licenses, protected publications, or folders containing them")
+    parser.add_argument("--list", help="file listing the items to check, one per line ('-' for stdin)")
+    parser.add_argument("--journal", required=True, help="path of the job journal (json lines)")
+    parser.add_argument("--resume", action="store_true", help="skip the items already recorded in the journal")
+    parser.add_argument("--jobs", type=int, default=1, help="number of worker processes (default 1)")
+    parser.add_argument("--batch-size", type=int, default=100, help="number of records written to the journal at once")
+    parser.add_argument("--flush-interval", type=float, default=5.0, help="maximum delay in seconds before records are written")
+    parser.add_argument("--summary", action="store_true", help="print the summary of the journal, possibly of a running batch, and exit")
+    parser.add_argument("--shard", type=parse_shard, help="check only the shard I of N (0 <= I < N) of the items")
+    parser.add_argument("--shard-key", choices=["path", "id"], default="path", help="hash the item path (default) or the license id to choose the shard; the id is read from every license, or from the index given by --index")
+    parser.add_argument("--profile-memory", action="store_true", help="record the memory use of every item, and the memory growth of the workers")
+    parser.add_argument("--index", help="check the licenses of this index (see lcpcheck index) matching the selection options")
+    import license_index
+    license_index.add_selection_arguments(parser)
+    args = parser.parse_args(argv)
+
+    util.init_logger(args.verbosity)
+
+    if args.summary:
+        if not os.path.exists(args.journal):
+            LOGGER.error("Journal {} not found".format(args.journal))
+            return 1
+        print(json.dumps(journal.summarize(journal.read_records(args.journal)), indent=2))
+        return 0
+
+    if not args.paths and not args.list and not args.index:
+        parser.error("no item to check")
+    if not args.index and any(value is not None for value in license_index.selection(args).values()):
+        parser.error("the selection options require --index")
+    index = None
+    if args.index:
+        if not os.path.exists(args.index):
+            LOGGER.error("Index {} not found".format(args.index))
+            return 1
+        index = license_index.LicenseIndex(args.index)
+        try:
+            indexed = index.select(**license_index.selection(args))
+        except ValueError as err:
+            LOGGER.error(err)
+            return 1
+    if os.path.exists(args.journal) and not args.resume:
+        LOGGER.error("Journal {} exists: use --resume to continue the run, or remove it".format(args.journal))
+        return 1
+
+    try:
+        config = TestConfig(args.config)
+    except FileNotFoundError as err:
+        LOGGER.error(err)
+        return 1
+    # the workers load the configuration themselves
+    config_path = args.config or os.environ.get('LCP_TST_CONFIG')
+
+    job_journal = journal.Journal(args.journal, args.batch_size, args.flush_interval)
+    done = job_journal.done_items() if args.resume else frozenset()
+    if done:
+        LOGGER.warning("{} items already checked".format(len(done)))
+
+    signal.signal(signal.SIGTERM, _terminate)
+    jobs = max(1, args.jobs)
+    batch = BatchRun(config_path, args.verbosity, jobs, job_journal, args.profile_memory,
+                     shared_http_slots(config.http, jobs) if jobs > 1 else None)
+    started = datetime.datetime.now(datetime.timezone.utc)
+    start = time.perf_counter()
+    interrupted = False
+    with job_journal:
+        try:
+            items = iter_items(args.paths, args.list)
+            if index is not None:
+                items = itertools.chain(items, indexed)
+            batch.run(items, done, args.shard, args.shard_key, index)
+        except KeyboardInterrupt:
+            interrupted = True
+        elapsed = time.perf_counter() - start
+        run = {
+            "shard": "{}/{}".format(*args.shard) if args.shard else None,
+            "host": socket.gethostname(),
+            "jobs": batch.jobs,
+            "started": started.isoformat(),
+            "elapsed": round(elapsed, 3),
+            "checked": batch.checked,
+            "failed": batch.failed,
+            "skipped": batch.skipped,
+            "interrupted": interrupted,
+            "items_per_s": round(batch.checked / elapsed, 2) if elapsed else 0
+            }
+        if batch.workers:
+            run["memory"] = batch.memory_report()
+        # timing of the run, used to merge the journals of the shards
+        job_journal.append({"run": run})
+    if index is not None:
+        index.close()
+    remove_worker_paths(config.working_path, batch.run_id)
+
+    print(json.dumps(run, indent=2))
+    if interrupted:
+        return 130
+    return 5 if batch.failed else 0
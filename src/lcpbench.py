@@ -0,0 +1,410 @@
+# -*- coding: utf-8 -*-
+
+"""
+Comparative latency benchmark of License Server deployments
+
+The same generated workload is run against every server listed in the benchmark section
+of the configuration file. An iteration of the workload:
+    store a content, generate a license, generate a protected publication,
+    fetch the status document of the license, register a device, renew and return the license.
+The throughput and latency percentiles of every operation are displayed side by side.
+
+The license issuance benchmark (IssuanceBenchmark, bench command of lcpcmd) loads the license
+generation endpoint alone, with partial licenses varying the user, rights and passphrase.
+
+Copyright 2017 European Digital Reading Lab. All rights reserved.
+Licensed to the Readium Foundation under one or more contributor license agreements.
+Use of this source code is governed by a BSD-style license
+that can be found in the LICENSE file exposed on Github (readium) in the project repository.
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import util
+import lcp_client
+from chkconfig import TestConfig
+
+LOGGER = logging.getLogger(__name__)
+
+OPERATIONS = ["store", "license", "publication", "status", "register", "renew", "return"]
+
+# expected status codes per operation
+EXPECTED_STATUS = {
+    "store": (200, 201),
+    "license": (201,),
+    "publication": (201,),
+    "status": (200,),
+    "register": (200,),
+    "renew": (200,),
+    "return": (200,)
+    }
+
+
+def provider_uri(rng):
+    """Provider of a generated workload, in the form of a uri"""
+
+    return "http://{}.com".format(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+class Workload:
+    """Generated workload, identical for every server"""
+
+    def __init__(self, config, iterations, seed):
+        """
+        Args:
+            config (TestConfig): Configuration object
+            iterations (int): number of iterations
+            seed (int): seed of the random generator
+        """
+
+        rng = random.Random(seed)
+        passphrase = config.user_passphrase
+        hint = config.cmd.get('user_passphrase_hint', '')
+        provider_id = provider_uri(rng)
+        self.iterations = []
+        for _ in range(iterations):
+            content_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+            user_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+            device_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+            self.iterations.append({
+                "content_id": content_id,
+                "partial_license": lcp_client.build_partial_license(passphrase, hint, user_id=user_id,
+                                                                 provider_id=provider_id),
+                "device_id": device_id,
+                "renew_days": rng.randint(1, 10)
+                })
+
+
+class ServerBenchmark:
+    """Run the workload against a server"""
+
+    def __init__(self, server, content, concurrency):
+        """
+        Args:
+            server (dict): name and lcp_server configuration of the server
+            content (dict): protected publication stored by the workload
+            concurrency (int): number of iterations run concurrently
+        """
+
+        self.name = server['name']
+        self.lcp_server = server['lcp_server']
+        self.content = content
+        self.concurrency = concurrency
+        self.lock = threading.Lock()
+        self.durations = {op: [] for op in OPERATIONS}
+        self.errors = {op: 0 for op in OPERATIONS}
+        self.skipped = {op: 0 for op in OPERATIONS}
+        self.sessions = threading.local()
+        self.elapsed = 0
+
+    def _client(self):
+        # one session, i.e. one connection pool, per worker thread
+        if not hasattr(self.sessions, 'client'):
+            self.sessions.client = lcp_client.LicenseServerClient(
+                self.lcp_server['base_uri'],
+                self.lcp_server['auth']['user'], self.lcp_server['auth']['passwd'])
+        return self.sessions.client
+
+    def _call(self, op, func, *args):
+        """
+        Time an operation
+
+        Returns
+            the response, or None in case of error
+        """
+
+        start = time.perf_counter()
+        try:
+            r = func(*args)
+            if op == "publication" and r.status_code in EXPECTED_STATUS[op]:
+                # the publication is part of the response time, not kept
+                for _ in r.iter_content(chunk_size=65536):
+                    pass
+        except (requests.exceptions.RequestException, TypeError) as err:
+            # TypeError: missing link in the status document
+            LOGGER.debug("{} {}: {}".format(self.name, op, err))
+            r = None
+        duration = time.perf_counter() - start
+
+        with self.lock:
+            if r is None or r.status_code not in EXPECTED_STATUS[op]:
+                if r is not None:
+                    LOGGER.debug("{} {}: error {}".format(self.name, op, r.status_code))
+                self.errors[op] += 1
+                return None
+            self.durations[op].append(duration)
+        return r
+
+    def _skip(self, ops):
+        with self.lock:
+            for op in ops:
+                self.skipped[op] += 1
+
+    def _iteration(self, iteration):
+        client = self._client()
+        content_id = iteration['content_id']
+        partial_license = iteration['partial_license']
+        device_id = iteration['device_id']
+        device_name = "lcpbench {}".format(device_id[:8])
+
+        if self._call("store", client.store_content, content_id,
+                self.content['encryption_key'], self.content['location'],
+                self.content['length'], self.content['sha256'], self.content['disposition']) is None:
+            self._skip(OPERATIONS[1:])
+            return
+        r = self._call("license", client.generate_license, content_id, partial_license)
+        self._call("publication", client.generate_publication, content_id, partial_license)
+        if r is None:
+            self._skip(OPERATIONS[3:])
+            return
+
+        status_url = lcp_client.find_link(_json(r), 'status')
+        r = self._call("status", client.session.get, status_url)
+        status_document = _json(r)
+        if not status_document:
+            self._skip(OPERATIONS[4:])
+            return
+
+        r = self._call("register", lcp_client.register_device, client.session, status_document, device_id, device_name)
+        status_document = _json(r)
+        if not status_document:
+            self._skip(OPERATIONS[5:])
+            return
+
+        end = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=100 + iteration['renew_days'])
+        r = self._call("renew", lcp_client.renew_license, client.session, status_document, device_id, device_name, end)
+        status_document = _json(r) or status_document
+        self._call("return", lcp_client.return_license, client.session, status_document, device_id, device_name)
+
+    def run(self, workload):
+        LOGGER.info("Benchmark of {}: {} iterations, concurrency {}".format(
+            self.name, len(workload.iterations), self.concurrency))
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            for _ in pool.map(self._iteration, workload.iterations):
+                pass
+        self.elapsed = time.perf_counter() - start
+
+    def summary(self):
+        """
+        Returns
+            dict: per operation throughput, latency summary, errors and skipped calls
+        """
+
+        summary = {}
+        for op in OPERATIONS:
+            latency = util.latency_summary(self.durations[op])
+            summary[op] = {
+                "throughput": round(len(self.durations[op]) / self.elapsed, 2) if self.elapsed else 0,
+                "latency_ms": latency,
+                "errors": self.errors[op],
+                "skipped": self.skipped[op]
+                }
+        return {"server": self.name, "elapsed": round(self.elapsed, 3), "operations": summary}
+
+
+def issuance_workload(passphrase, hint, content_ids, count, seed):
+    """
+    Partial licenses of the license issuance benchmark: the user, rights and passphrase vary
+
+    Args:
+        passphrase (str): configured user passphrase, used by one user in four
+        hint (str): user passphrase hint
+        content_ids (list): ids of the stored contents, used in turn
+        count (int): number of licenses
+        seed (int): seed of the random generator
+
+    Returns
+        list: (content id, partial license) pairs
+    """
+
+    rng = random.Random(seed)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    provider_id = provider_uri(rng)
+    workload = []
+    for i in range(count):
+        user_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+        start = now - datetime.timedelta(days=rng.randint(0, 30))
+        end = start + datetime.timedelta(days=rng.randint(1, 365))
+        rights = {
+            "print": rng.choice((0, 2, 10, 100)),
+            "copy": rng.choice((0, 100, 1000, 10000)),
+            "start": start.strftime(lcp_client.W3C_DATETIME_FORMAT),
+            "end": end.strftime(lcp_client.W3C_DATETIME_FORMAT)
+            }
+        user_passphrase = passphrase if i % 4 == 0 else "{}-{:08x}".format(passphrase, rng.getrandbits(32))
+        workload.append((content_ids[i % len(content_ids)],
+            lcp_client.build_partial_license(user_passphrase, hint, user_id=user_id, rights=rights,
+                                             provider_id=provider_id)))
+    return workload
+
+
+class IssuanceBenchmark:
+    """Load the license generation endpoint of a License Server: POST /contents/{id}/license"""
+
+    def __init__(self, base_uri, user, passwd, concurrency):
+        """
+        Args:
+            base_uri (str): url of the License Server
+            user, passwd (str): credentials of the License Server API
+            concurrency (int): number of requests in progress
+        """
+
+        self.base_uri = base_uri
+        self.user = user
+        self.passwd = passwd
+        self.concurrency = concurrency
+        self.lock = threading.Lock()
+        self.durations = []
+        # status code, or "connection" -> number of failed requests
+        self.errors = {}
+        self.sessions = threading.local()
+        self.elapsed = 0
+
+    def _client(self):
+        # one session, i.e. one connection pool, per worker thread
+        if not hasattr(self.sessions, 'client'):
+            self.sessions.client = lcp_client.LicenseServerClient(self.base_uri, self.user, self.passwd)
+        return self.sessions.client
+
+    def _generate(self, entry):
+        content_id, partial_license = entry
+        start = time.perf_counter()
+        try:
+            r = self._client().generate_license(content_id, partial_license)
+            error = None if r.status_code == 201 else r.status_code
+        except requests.exceptions.RequestException as err:
+            LOGGER.debug("license {}: {}".format(content_id, err))
+            error = "connection"
+        duration = time.perf_counter() - start
+
+        with self.lock:
+            if error is None:
+                self.durations.append(duration)
+            else:
+                self.errors[error] = self.errors.get(error, 0) + 1
+
+    def run(self, workload):
+        LOGGER.info("License issuance benchmark of {}: {} licenses, concurrency {}".format(
+            self.base_uri, len(workload), self.concurrency))
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            for _ in pool.map(self._generate, workload):
+                pass
+        self.elapsed = time.perf_counter() - start
+
+    def summary(self):
+        """
+        Returns
+            dict: licenses per second, latency summary of the generated licenses, errors and error rate
+        """
+
+        failed = sum(self.errors.values())
+        requested = len(self.durations) + failed
+        return {
+            "server": self.base_uri,
+            "concurrency": self.concurrency,
+            "licenses": len(self.durations),
+            "elapsed": round(self.elapsed, 3),
+            "licenses_per_s": round(len(self.durations) / self.elapsed, 2) if self.elapsed else 0,
+            "latency_ms": util.latency_summary(self.durations),
+            "errors": {str(error): count for error, count in self.errors.items()},
+            "error_rate": round(failed / requested, 4) if requested else 0
+            }
+
+
+def _json(r):
+    """
+    Returns
+        the json body of a response, an empty dict if there is no response or the body is malformed
+    """
+
+    if r is None:
+        return {}
+    try:
+        return r.json()
+    except ValueError:
+        return {}
+
+
+def print_table(summaries):
+    """Display the summaries of the servers side by side"""
+
+    columns = "{:>9} {:>8} {:>8} {:>8} {:>6}"
+    header = "{:<12}".format("operation") + "".join(
+        " | {:^43}".format(s['server'][:43]) for s in summaries)
+    subheader = "{:<12}".format("") + "".join(
+        " | " + columns.format("ops/s", "p50 ms", "p95 ms", "p99 ms", "err") for _ in summaries)
+    print(header)
+    print(subheader)
+    print("-" * len(subheader))
+    for op in OPERATIONS:
+        line = "{:<12}".format(op)
+        for s in summaries:
+            o = s['operations'][op]
+            latency = o['latency_ms']
+            line += " | " + columns.format(
+                o['throughput'],
+                latency.get('p50', '-'), latency.get('p95', '-'), latency.get('p99', '-'),
+                o['errors'])
+        print(line)
+    print("{:<12}".format("elapsed (s)") + "".join(" | {:>43}".format(s['elapsed']) for s in summaries))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="lcpcheck bench")
+    parser.add_argument("-v", "--verbosity", action="count", help="increase output verbosity")
+    parser.add_argument("-c", "--config", help="path to the yaml configuration file")
+    parser.add_argument("-n", "--iterations", type=int, help="number of workload iterations (overrides the config)")
+    parser.add_argument("--concurrency", type=int, help="number of concurrent iterations (overrides the config)")
+    parser.add_argument("--servers", help="comma separated names of the servers to benchmark (default: all)")
+    parser.add_argument("--seed", type=int, help="seed of the workload generator")
+    parser.add_argument("--json", help="write the results to this json file")
+    args = parser.parse_args(argv)
+
+    util.init_logger(args.verbosity)
+
+    try:
+        config = TestConfig(args.config)
+    except FileNotFoundError as err:
+        LOGGER.error(err)
+        return 1
+
+    bench = config.benchmark
+    if not bench or not bench.get('servers'):
+        LOGGER.error("No server listed in the benchmark section of the configuration file")
+        return 1
+    servers = bench['servers']
+    if args.servers:
+        names = args.servers.split(",")
+        servers = [s for s in servers if s['name'] in names]
+
+    iterations = args.iterations or bench.get('iterations', 100)
+    concurrency = args.concurrency or bench.get('concurrency', 4)
+    seed = args.seed if args.seed is not None else random.randrange(2**32)
+    LOGGER.info("Workload seed {}".format(seed))
+    workload = Workload(config, iterations, seed)
+
+    summaries = []
+    # servers are benchmarked one after the other, so that they do not compete for the client resources
+    for server in servers:
+        benchmark = ServerBenchmark(server, bench['content'], concurrency)
+        benchmark.run(workload)
+        summaries.append(benchmark.summary())
+
+    print_table(summaries)
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump({"seed": seed, "iterations": iterations, "concurrency": concurrency,
+                       "servers": summaries}, json_file, indent=2)
+    return 0
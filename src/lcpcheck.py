@@ -5,26 +5,51 @@ Client test launcher
 """
 
 import argparse
+import os
 import sys
 import logging
 
 import util
 from chkconfig import TestConfig
-from lcpf_test_suite import LCPFTestSuite
-from lcpl_test_suite import LCPLTestSuite
-from lsd_test_suite import LSDTestSuite
+
+# the test suites, and their heavy dependencies (requests, jsonschema, lxml, dateutil ...),
+# are imported only when the corresponding option is used, to keep the startup time low.
 
 LOGGER = logging.getLogger(__name__)
 
+# sub-commands: name -> module exposing a main(argv) function
+COMMANDS = {
+    "serve": "lcpserve",
+    "bench": "lcpbench",
+    "batch": "lcpbatch",
+    "merge": "lcpmerge",
+    "encrypt": "epub_encrypt",
+    "export": "lcpexport",
+    "forecast": "rights_batch",
+    "index": "license_index"
+    }
+
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        command = __import__(COMMANDS[sys.argv[1]])
+        return command.main(sys.argv[2:])
+
     parser = argparse.ArgumentParser()
     parser.add_argument("-v", "--verbosity", action="count", help="increase output verbosity")
     parser.add_argument("-c", "--config", help="path to the yaml configuration file")
-    parser.add_argument("-f", "--file", nargs='?', const='-', help="check a protected file, retrieve a license; don't give the path to an LCP protected epub file if -e is used.")
+    parser.add_argument("-f", "--file", nargs='?', const='-', help="check a protected file (path or url), retrieve a license; without a value and with -l, check the publication referenced by the license.")
     parser.add_argument("-l", "--lcpl", nargs='?', const='-', help="check an LCP license; don't give the path to an LCP license if -p  is used")
     parser.add_argument("-s", "--lsd", nargs='?', const='-', help="launch lsd tests; don't give the path to an LCP license if -p or -l is used")
+    parser.add_argument("--startup-profile", action="store_true", help="run the command with -X importtime and report the import time breakdown")
+    parser.add_argument("--profile-memory", action="store_true", help="report the peak memory and the top allocation sites of every suite and test")
+    parser.add_argument("--watch", metavar="DIR", help="check the licenses and protected publications written to a folder, until interrupted")
+    parser.add_argument("--journal", help="with --watch, journal of the outcomes (default: <working_path>/watch.jsonl)")
+    parser.add_argument("--jobs", type=int, default=1, help="with --watch, number of worker processes (default 1)")
     args = parser.parse_args()
 
+    if args.startup_profile:
+        return util.startup_profile(__file__, [a for a in sys.argv[1:] if a != "--startup-profile"])
+
     # Initialize logger 
     util.init_logger(args.verbosity)
 
@@ -34,6 +59,26 @@ def main():
     except FileNotFoundError as err:
         LOGGER.error(err)
         return 1
+
+    if args.watch:
+        if not os.path.isdir(args.watch):
+            LOGGER.error("Folder {} not found".format(args.watch))
+            return 1
+        import lcpwatch
+        journal_path = args.journal or os.path.join(config.working_path, "watch.jsonl")
+        lcpwatch.watch(args.config or os.environ.get('LCP_TST_CONFIG'), args.watch, journal_path,
+                       max(1, args.jobs), args.verbosity)
+        return 0
+
+    if args.profile_memory:
+        import memprofile
+        memprofile.start()
+
+    def run_suite(suite):
+        passed = suite.run()
+        if args.profile_memory:
+            memprofile.print_report(suite.report())
+        return passed
     
     license_path = ""
         
@@ -41,8 +86,23 @@ def main():
     if args.file:
         # use the file argument value
         file_path = args.file
+        if file_path == "-" and args.lcpl and args.lcpl != "-":
+            # check the publication referenced by the license, straight from its url
+            from lcp_license import LCPLicense
+            from exception import LCPLicenseError
+            try:
+                lcpl = LCPLicense()
+                lcpl.parse(args.lcpl)
+            except LCPLicenseError as err:
+                LOGGER.error(err)
+                return 2
+            file_path = lcpl.publication_link()
+            if not file_path:
+                LOGGER.error("No publication link in the license")
+                return 2
+        from lcpf_test_suite import LCPFTestSuite
         lcpf_test_suite = LCPFTestSuite(config, file_path)
-        if not lcpf_test_suite.run():
+        if not run_suite(lcpf_test_suite):
             return 2
         license_path = lcpf_test_suite.license_path
             
@@ -50,16 +110,18 @@ def main():
     if args.lcpl:
         # the lcpl argument value takes precedence over the preceding license_path value
         license_path = args.lcpl if args.lcpl != "-"  else license_path
+        from lcpl_test_suite import LCPLTestSuite
         lcpl_test_suite = LCPLTestSuite(config, license_path)
-        if not lcpl_test_suite.run():
+        if not run_suite(lcpl_test_suite):
             return 3
 
     # Check a License Status Document
     # the lsd argument value takes precedence over the lcpl test return
     if args.lsd:
         license_path = args.lsd if args.lsd != "-" else license_path
+        from lsd_test_suite import LSDTestSuite
         lsd_test_suite = LSDTestSuite(config, license_path)
-        if not lsd_test_suite.run():
+        if not run_suite(lsd_test_suite):
             return 4
 
     return 0
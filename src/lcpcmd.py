@@ -14,20 +14,20 @@ Note: The License Server must be running when the utility is started, if interac
 
 import sys
 import argparse
-import datetime
+import base64
 import hashlib
 import json
 import os.path
+import random
+import shlex
 import uuid
-import shutil
 import requests
 from urllib.parse import urljoin
 import util
+import lcp_client
 from cmd import Cmd
 from config.cmdconfig import CmdConfig
 
-W3C_DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S+00:00"
-
 class LCPCmdShell(Cmd):
     intro = 'Welcome to the LCP cmd shell.   Type help or ? to list commands.\n'
     prompt = '(lcp) '
@@ -74,53 +74,14 @@ class LCPCmdShell(Cmd):
             dict
         """
 
-        license_print = 2
-        license_copy = 100
-        # 100 days to read the publication
-        license_start_datetime = datetime.datetime.today()
-        license_end_datetime = license_start_datetime + \
-            datetime.timedelta(days=100)
-
-        # Random provider id, in the form of a uri
-        provider_id = "http://{}.com".format(str(uuid.uuid4()))
-        # Random user id and email
-        user_id = str(uuid.uuid4())
-        user_email = "{}@lcp.edrlab.org".format(user_id)
-
-        # Hash the passphrase (found in the config)
-        hash_engine = hashlib.sha256()
-        hash_engine.update(self.config.user_passphrase.encode("utf-8"))
-        user_hashed_passphrase = hash_engine.hexdigest()
-
-        # Prepare a partial license
-        partial_license = {
-            "provider": provider_id,
-            "user": {
-                "id": user_id,
-                "email": user_email,
-                "encrypted": ["email"]
-            },
-            "encryption": {
-                "user_key": {
-                    "text_hint": self.config.user_passphrase_hint,
-                    "value": user_hashed_passphrase,
-                    "algorithm": "http://www.w3.org/2001/04/xmlenc#sha256"
-                    }
-            },
-            "rights": {
-                "print": license_print,
-                "copy": license_copy,
-                "start": license_start_datetime.strftime(W3C_DATETIME_FORMAT),
-                "end": license_end_datetime.strftime(W3C_DATETIME_FORMAT)
-            }
-        }
-
-        return partial_license
+        return lcp_client.build_partial_license(
+            self.config.user_passphrase, self.config.user_passphrase_hint)
 
 
     def do_encrypt(self, args):
         """
-        Encrypt an epub file using the *local* lcpencrypt command line
+        Encrypt an epub file using the *local* lcpencrypt command line,
+        or the native encryption engine if encrypt_engine is native in the configuration
         """
 
         print("Let's encrypt {}".format(self.epub_path))
@@ -133,20 +94,83 @@ class LCPCmdShell(Cmd):
             self.config.encrypted_file_path, output_filename
         )
 
-        # Execute the encryption using the lcpencrypt utility
-        return_code, stdout, stderr = util.execute_command([
-            self.config.encrypt_cmd_path,
-            '-input', self.epub_path,
-            '-contentid', content_id,
-            '-output', output_file_path])
+        if self.config.encrypt_engine == "native":
+            # Encrypt in process, without the lcpencrypt utility
+            result = self.__native_encrypt(self.epub_path, output_file_path, content_id)
+            if result is None:
+                return
+        else:
+            # Execute the encryption using the lcpencrypt utility
+            return_code, stdout, stderr = util.execute_command([
+                self.config.encrypt_cmd_path,
+                '-input', self.epub_path,
+                '-contentid', content_id,
+                '-output', output_file_path])
+
+            if return_code != 0:
+                print("Encryption failed, err {}".format(return_code))
+                print (stderr)
+                return
+
+            # Parse the resulting json message
+            result = json.loads(stdout.decode("utf-8"))
+
+        self.__set_encrypted_content(result)
 
-        if return_code != 0:
-            print("Encryption failed, err {}".format(return_code))
-            print (stderr)
+    def do_update(self, args):
+        """
+        Encrypt a revised version of the current epub, with the same content id and key
+        update <path of the revised epub>
+        With the native engine and an encryption cache, only the resources which changed are encrypted.
+        """
+
+        if self.encrypted_content_id == None:
+            print("encrypt an EPUB file before calling update")
             return
+        if self.config.encrypt_engine != "native":
+            print("update requires the native encryption engine")
+            return
+        revised_path = args.strip()
+        if not os.path.exists(revised_path):
+            print("{} not found".format(revised_path))
+            return
+
+        print("Let's encrypt {} as a new version of {}".format(revised_path, self.encrypted_content_id))
+
+        output_filename = "{}-{}.crypt.epub".format(
+            os.path.splitext(os.path.basename(revised_path))[0], self.encrypted_content_id)
+        output_file_path = os.path.join(self.config.encrypted_file_path, output_filename)
+        result = self.__native_encrypt(revised_path, output_file_path, self.encrypted_content_id,
+            base64.b64decode(self.encrypted_content_encryption_key))
+        if result is None:
+            return
+
+        self.epub_path = revised_path
+        self.epub_filename = os.path.splitext(os.path.basename(revised_path))[0]
+        self.__set_encrypted_content(result)
 
-        # Parse the resulting json message
-        result = json.loads(stdout.decode("utf-8"))
+    def __native_encrypt(self, epub_path, output_file_path, content_id, content_key=None):
+        """Encrypt with the native engine, using the encryption cache if configured
+
+        Returns:
+            dict: the lcpencrypt json message fields, None in case of error
+        """
+
+        import epub_encrypt
+        import encrypt_cache
+        from exception import EncryptionError
+
+        cache = None
+        if self.config.encrypt_cache_path:
+            cache = encrypt_cache.EncryptionCache(self.config.encrypt_cache_path)
+        try:
+            return epub_encrypt.encrypt_epub(epub_path, output_file_path, content_id, content_key, cache=cache)
+        except EncryptionError as err:
+            print("Encryption failed: {}".format(err))
+            return None
+
+    def __set_encrypted_content(self, result):
+        """Keep the protected content information, for subsequent actions"""
 
         self.encrypted_content_id = result["content-id"]
         self.encrypted_content_encryption_key = result["content-encryption-key"]
@@ -286,15 +310,65 @@ class LCPCmdShell(Cmd):
         filename = "{0}-{1}.lcp.epub".format(self.epub_filename, self.encrypted_content_id)
         file_path = os.path.join(self.config.working_path, filename)
 
+        # written as it is received, hashed on the way: no second read of the file
+        sha256 = hashlib.sha256()
+        length = 0
         with open(file_path, 'wb') as file:
-            r.raw.decode_content = True
-            shutil.copyfileobj(r.raw, file) 
+            for chunk in r.iter_content(chunk_size=1 << 20):
+                file.write(chunk)
+                sha256.update(chunk)
+                length += len(chunk)
 
-        print("Publication stored in %s", file_path)
+        print("Publication stored in {} ({} bytes, sha256 {})".format(file_path, length, sha256.hexdigest()))
         # for later use?
         self.protected_file_path = file_path
 
-            
+
+    def do_bench(self, args):
+        """
+        Benchmark the license generation of the License Server
+        bench [-n LICENSES] [-c CONCURRENCY] [--seed SEED] [--json PATH] [CONTENT_ID ...]
+        Without content id, the licenses are generated for the current encrypted epub.
+        """
+
+        parser = argparse.ArgumentParser(prog="bench")
+        parser.add_argument("-n", "--licenses", type=int, default=1000, help="number of licenses to generate")
+        parser.add_argument("-c", "--concurrency", type=int, default=8, help="number of concurrent requests")
+        parser.add_argument("--seed", type=int, help="seed of the workload generator")
+        parser.add_argument("--json", help="write the results to this json file")
+        parser.add_argument("content_ids", nargs="*", help="ids of stored contents")
+        try:
+            options = parser.parse_args(shlex.split(args))
+        except SystemExit:
+            return
+
+        content_ids = options.content_ids or ([self.encrypted_content_id] if self.encrypted_content_id else [])
+        if not content_ids:
+            print("encrypt and store an EPUB file, or give content ids, before calling bench")
+            return
+
+        import lcpbench
+        seed = options.seed if options.seed is not None else random.randrange(2**32)
+        workload = lcpbench.issuance_workload(self.config.user_passphrase, self.config.user_passphrase_hint,
+            content_ids, options.licenses, seed)
+        benchmark = lcpbench.IssuanceBenchmark(self.config.lcp_server_base_uri,
+            self.config.lcp_server_auth_user, self.config.lcp_server_auth_passwd, options.concurrency)
+        print("Let's generate {} licenses for {} contents, {} at a time (seed {})".format(
+            options.licenses, len(content_ids), options.concurrency, seed))
+        benchmark.run(workload)
+
+        summary = benchmark.summary()
+        summary["seed"] = seed
+        latency = summary["latency_ms"]
+        print("{} licenses in {}s: {} licenses/s".format(summary["licenses"], summary["elapsed"], summary["licenses_per_s"]))
+        if summary["licenses"]:
+            print("Latency (ms): p50 {} p90 {} p95 {} p99 {} max {}".format(
+                latency["p50"], latency["p90"], latency["p95"], latency["p99"], latency["max"]))
+        print("Error rate {:.2%} {}".format(summary["error_rate"], summary["errors"] or ""))
+        if options.json:
+            with open(options.json, 'w') as json_file:
+                json.dump(summary, json_file, indent=2)
+
     def do_EOF(self, line):
         return True
 
@@ -10,6 +10,7 @@ Use of this source code is governed by a BSD-style license
 that can be found in the LICENSE file exposed on Github (readium) in the project repository.
 """
 
+import functools
 import logging
 from Crypto.Hash import SHA256
 from Crypto.Cipher import AES
@@ -36,6 +37,59 @@ def hash(message, hash_algorithm):
   LOGGER.debug("digest size {}".format(len(hash.digest())))
   return hash.digest()
 
+@functools.lru_cache(maxsize=64)
+def user_key(passphrase, hash_algorithm):
+  """
+  derive the user key from a passphrase, once per passphrase
+  params: passphrase - (unicode) string
+          hash_algorithm: http://www.w3.org/2001/04/xmlenc#sha256 
+  returns: the 32 bytes user key
+  """
+
+  # only algo supported: SHA256
+  return SHA256.new(passphrase.encode('utf-8')).digest()
+
+@functools.lru_cache(maxsize=64)
+def _block_cipher(key):
+  # the AES key schedule is computed once per key;
+  # ECB mode is stateless, the CBC chaining is done by decrypt_cbc
+  return AES.new(key, AES.MODE_ECB)
+
+def decrypt_cbc(data, key):
+  """
+  decrypt a bytes value (iv + ciphertext) with AES256-CBC and check the padding
+  params: data - bytes
+          key - bytes
+  returns: the decrypted bytes, or None in case of error
+  """
+
+  block_size = AES.block_size
+  if len(data) < 2 * block_size or len(data) % block_size:
+    return None
+
+  # CBC: each decrypted block is xored with the previous ciphertext block (the iv for the first one)
+  ciphertext = data[block_size:]
+  blocks = _block_cipher(key).decrypt(ciphertext)
+  clear_data = (int.from_bytes(blocks, 'big') ^ int.from_bytes(data[:-block_size], 'big')).to_bytes(len(blocks), 'big')
+
+  # PKCS#7 padding
+  padding = clear_data[-1]
+  if padding < 1 or padding > block_size or clear_data[-padding:] != bytes([padding]) * padding:
+    return None
+  return clear_data[:-padding]
+
+def encrypt_cbc(data, key):
+  """
+  encrypt a bytes value with AES256-CBC, a random iv and PKCS#7 padding
+  params: data - bytes
+          key - bytes
+  returns: iv + ciphertext, as bytes
+  """
+
+  iv = Random.get_random_bytes(AES.block_size)
+  padding = AES.block_size - len(data) % AES.block_size
+  return iv + AES.new(key, AES.MODE_CBC, iv).encrypt(data + bytes([padding]) * padding)
+
 def decrypt(data, passphrase_hash, decrypt_algorithm):
   """
   decrypt a bytes value
@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+
+"""
+Export the fields of a corpus of licenses to a columnar file, one row per license
+
+    lcpcheck export -o licenses.parquet licenses/ --journal audit.jsonl
+    lcpcheck export -o licenses.npz licenses/
+
+The licenses are read once, then analyzed with vectorized queries (numpy, pandas, polars, duckdb ...)
+instead of parsing the json files again. Formats, chosen by the extension of the output file:
+    - .parquet: Apache Parquet, written by row groups (requires pyarrow)
+    - .npz: NumPy archive of the columns (requires numpy)
+
+Columns:
+    path, id, provider, user_id                       strings
+    issued, updated, rights_start, rights_end         dates, UTC (datetime64[s]; milliseconds in Parquet)
+    rights_print, rights_copy                         integers, -1 when absent (null in Parquet)
+    publication_type, publication_length, hint_type, status_type, link_rels
+    passed, failures                                  outcome of the checks, from batch journals:
+                                                      1 passed, 0 failed, -1 not checked; failed tests
+    error                                             the license could not be read
+
+Copyright 2017 European Digital Reading Lab. All rights reserved.
+Licensed to the Readium Foundation under one or more contributor license agreements.
+Use of this source code is governed by a BSD-style license
+that can be found in the LICENSE file exposed on Github (readium) in the project repository.
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+
+import util
+import journal
+from lcpbatch import iter_items
+from exception import ZipArchiveError
+
+LOGGER = logging.getLogger(__name__)
+
+# number of licenses per row group (Parquet) or per chunk of columns (npz)
+CHUNK_ROWS = 100000
+
+STRING_COLUMNS = ("path", "id", "provider", "user_id", "publication_type", "hint_type", "status_type",
+                  "link_rels", "failures", "error")
+DATE_COLUMNS = ("issued", "updated", "rights_start", "rights_end")
+INT_COLUMNS = ("rights_print", "rights_copy", "publication_length", "passed")
+COLUMNS = ("path", "id", "provider", "user_id", "issued", "updated", "rights_start", "rights_end",
+           "rights_print", "rights_copy", "publication_type", "publication_length", "hint_type", "status_type",
+           "link_rels", "passed", "failures", "error")
+
+EMBEDDED_LICENSE = "META-INF/license.lcpl"
+
+
+def read_license(path):
+    """
+    Json object of a license file, or of the license embedded in a protected publication
+
+    Raises
+        ValueError, OSError or ZipArchiveError
+    """
+
+    if path.lower().endswith('.lcpl'):
+        with open(path, 'rb') as license_file:
+            lcpl = json.loads(license_file.read())
+    else:
+        from zipview import ZipView, MmapSource
+        zip_view = ZipView(MmapSource(path))
+        try:
+            lcpl = json.loads(bytes(zip_view.read(EMBEDDED_LICENSE)))
+        except KeyError:
+            raise ValueError("no license in the publication")
+        finally:
+            zip_view.close()
+    return json_object(lcpl, "the license")
+
+
+def json_object(value, name):
+    """
+    Returns
+        dict: the value, {} if absent
+
+    Raises
+        ValueError if the value is not a json object
+    """
+
+    if value is None:
+        return {}
+    if not isinstance(value, dict):
+        raise ValueError("{} is not a json object".format(name))
+    return value
+
+
+def license_links(lcpl):
+    """
+    Returns
+        list: links of a license
+
+    Raises
+        ValueError if the links are not an array of json objects
+    """
+
+    links = lcpl.get('links')
+    if links is None:
+        return []
+    if not isinstance(links, list):
+        raise ValueError("links is not a json array")
+    for link in links:
+        json_object(link, "a link")
+    return links
+
+
+def epoch_seconds(value):
+    """
+    Returns
+        int: an RFC 3339 date as seconds since the epoch (UTC), None if absent or invalid
+    """
+
+    if not value:
+        return None
+    try:
+        date = datetime.datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        LOGGER.debug("Invalid date {}".format(value))
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    return int(date.timestamp())
+
+
+def integer(value):
+    """
+    Returns
+        int: the value if it is an integer, None otherwise
+    """
+
+    return value if isinstance(value, int) and not isinstance(value, bool) else None
+
+
+def text(value):
+    """
+    Returns
+        str: the value if it is a string, None otherwise
+    """
+
+    return value if isinstance(value, str) else None
+
+
+def license_row(path, lcpl, outcome=None):
+    """
+    Row of a license: column -> value, None when absent
+
+    Args:
+        outcome (dict): journal record of the license, if it was checked
+
+    Raises
+        ValueError if the rights, user or links of the license are not json objects
+    """
+
+    rights = json_object(lcpl.get('rights'), "rights")
+    user = json_object(lcpl.get('user'), "user")
+    links = {}
+    for link in license_links(lcpl):
+        rel = text(link.get('rel'))
+        if rel:
+            links.setdefault(rel, link)
+    row = {
+        "path": path,
+        "id": text(lcpl.get('id')),
+        "provider": text(lcpl.get('provider')),
+        "user_id": text(user.get('id')),
+        "issued": epoch_seconds(lcpl.get('issued')),
+        "updated": epoch_seconds(lcpl.get('updated')),
+        "rights_start": epoch_seconds(rights.get('start')),
+        "rights_end": epoch_seconds(rights.get('end')),
+        "rights_print": integer(rights.get('print')),
+        "rights_copy": integer(rights.get('copy')),
+        "publication_type": text(links.get('publication', {}).get('type')),
+        "publication_length": integer(links.get('publication', {}).get('length')),
+        "hint_type": text(links.get('hint', {}).get('type')),
+        "status_type": text(links.get('status', {}).get('type')),
+        "link_rels": " ".join(links),
+        "error": None
+        }
+    row.update(outcome_columns(outcome))
+    return row
+
+
+def outcome_columns(outcome):
+    if outcome is None:
+        return {"passed": -1, "failures": None}
+    failures = " ".join("{}.{}".format(f["suite"], f["test"]) for f in outcome.get("failures", []))
+    if "error" in outcome:
+        failures = " ".join(filter(None, [failures, "error"]))
+    return {"passed": 1 if outcome.get("passed") else 0, "failures": failures or None}
+
+
+def read_outcomes(journal_paths):
+    """
+    Returns
+        dict: item path -> last journal record of the item
+    """
+
+    outcomes = {}
+    for journal_path in journal_paths:
+        for record in journal.read_records(journal_path):
+            if "item" in record:
+                outcomes[record["item"]] = record
+    return outcomes
+
+
+class NpzWriter:
+    """Columns accumulated by chunks, saved as a compressed NumPy archive"""
+
+    def __init__(self, output_path):
+        import numpy
+        self.np = numpy
+        self.output_path = output_path
+        self.chunks = {name: [] for name in COLUMNS}
+
+    def write(self, columns):
+        np = self.np
+        for name in STRING_COLUMNS:
+            self.chunks[name].append(np.array(["" if v is None else str(v) for v in columns[name]], dtype=str))
+        for name in DATE_COLUMNS:
+            # NaT for the missing dates
+            self.chunks[name].append(np.array(
+                [np.datetime64("NaT") if v is None else v for v in columns[name]], dtype="datetime64[s]"))
+        for name in INT_COLUMNS:
+            self.chunks[name].append(np.array([-1 if v is None else v for v in columns[name]],
+                                              dtype=np.int8 if name == "passed" else np.int64))
+
+    def close(self):
+        np = self.np
+        arrays = {}
+        for name, chunks in self.chunks.items():
+            # the string chunks may have different widths
+            arrays[name] = np.concatenate(chunks) if chunks else np.array([])
+        # the file is written as it is named, even without the .npz extension
+        with open(self.output_path, 'wb') as output_file:
+            np.savez_compressed(output_file, **arrays)
+
+
+class ParquetWriter:
+    """Columns written by row groups to a Parquet file"""
+
+    def __init__(self, output_path):
+        import pyarrow
+        import pyarrow.parquet
+        self.pa = pyarrow
+        fields = []
+        for name in COLUMNS:
+            if name in DATE_COLUMNS:
+                fields.append(pyarrow.field(name, pyarrow.timestamp('s', tz='UTC')))
+            elif name == "passed":
+                fields.append(pyarrow.field(name, pyarrow.int8()))
+            elif name in INT_COLUMNS:
+                fields.append(pyarrow.field(name, pyarrow.int64()))
+            else:
+                fields.append(pyarrow.field(name, pyarrow.string()))
+        self.schema = pyarrow.schema(fields)
+        self.writer = pyarrow.parquet.ParquetWriter(output_path, self.schema, compression='zstd')
+
+    def write(self, columns):
+        batch = self.pa.record_batch([self.pa.array(columns[f.name], type=f.type) for f in self.schema],
+                                     schema=self.schema)
+        self.writer.write_batch(batch)
+
+    def close(self):
+        self.writer.close()
+
+
+WRITERS = {".npz": NpzWriter, ".parquet": ParquetWriter}
+
+
+def export(items, writer, outcomes=None):
+    """
+    Write the rows of the licenses by chunks of CHUNK_ROWS
+
+    Args:
+        items: paths of the licenses or protected publications
+        writer: NpzWriter or ParquetWriter
+        outcomes (dict): item path -> journal record
+
+    Returns
+        (int, int): number of rows written, number of unreadable items
+    """
+
+    outcomes = outcomes or {}
+    columns = {name: [] for name in COLUMNS}
+    rows = errors = 0
+    for path in items:
+        try:
+            row = license_row(path, read_license(path), outcomes.get(path))
+        except (OSError, ValueError, ZipArchiveError) as err:
+            errors += 1
+            row = dict.fromkeys(COLUMNS)
+            row.update(outcome_columns(outcomes.get(path)), path=path, error=str(err))
+        for name in COLUMNS:
+            columns[name].append(row[name])
+        rows += 1
+        if len(columns["path"]) >= CHUNK_ROWS:
+            writer.write(columns)
+            columns = {name: [] for name in COLUMNS}
+            LOGGER.info("{} licenses exported".format(rows))
+    if columns["path"] or not rows:
+        writer.write(columns)
+    writer.close()
+    return rows, errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="lcpcheck export")
+    parser.add_argument("-v", "--verbosity", action="count", help="increase output verbosity")
+    parser.add_argument("paths", nargs="*", help="licenses, protected publications, or folders containing them")
+    parser.add_argument("--list", help="file listing the items to export, one per line ('-' for stdin)")
+    parser.add_argument("-o", "--output", required=True, help="columnar file to write, .parquet or .npz")
+    parser.add_argument("--format", choices=["parquet", "npz"], help="format of the output (default: from its extension)")
+    parser.add_argument("--journal", action="append", default=[], help="batch journal giving the outcome of the checks (repeatable)")
+    args = parser.parse_args(argv)
+
+    util.init_logger(args.verbosity)
+
+    extension = "." + args.format if args.format else os.path.splitext(args.output)[1].lower()
+    if extension not in WRITERS:
+        LOGGER.error("Unknown output format {}, use .parquet or .npz".format(extension))
+        return 1
+    for journal_path in args.journal:
+        if not os.path.exists(journal_path):
+            LOGGER.error("Journal {} not found".format(journal_path))
+            return 1
+    try:
+        writer = WRITERS[extension](args.output)
+    except ImportError as err:
+        LOGGER.error("The {} format requires {}: pip3 install {}".format(
+            extension[1:], err.name, "numpy" if extension == ".npz" else "pyarrow"))
+        return 1
+
+    rows, errors = export(iter_items(args.paths, args.list), writer, read_outcomes(args.journal))
+    LOGGER.warning("{} licenses exported to {}, {} unreadable".format(rows, args.output, errors))
+    return 0
@@ -11,15 +11,37 @@ that can be found in the LICENSE file exposed on Github (readium) in the project
 
 import logging
 import os.path
-import zipfile
+import threading
 import util
 
+from urllib.parse import urlparse
 from lxml import etree
-from exception import TestSuiteRunningError
+from exception import TestSuiteRunningError, ZipArchiveError
 from base_test_suite import BaseTestSuite
+from zipview import ZipView, MmapSource, HTTPRangeSource, ZIP_DEFLATED
 
 LOGGER = logging.getLogger(__name__)
 
+# resources which should not be compressed
+MEDIA_EXTENSIONS = ('.jpg','.png','.gif','.mp3')
+
+# compiled XML schemas, per thread: an lxml XMLSchema object and its error log 
+# must not be shared between threads
+_xml_schemas = threading.local()
+
+def xml_schema(schema_path):
+    """
+    Load and compile an XML schema, once per thread
+
+    Raises
+        OSError if the schema cannot be read
+    """
+
+    schemas = _xml_schemas.__dict__
+    if schema_path not in schemas:
+        schemas[schema_path] = etree.XMLSchema(etree.parse(schema_path))
+    return schemas[schema_path]
+
 class LCPFTestSuite(BaseTestSuite):
     """LCP Protected file test suite"""
 
@@ -27,39 +49,90 @@ class LCPFTestSuite(BaseTestSuite):
         """
         Args:
             config (TestConfig): Configuration object
-            file_path (str): Path to a protected publication (epub+lcpl)
+            file_path (str): Path or http(s) url of a protected publication (epub+lcpl);
+                a remote publication is read using range requests, it is not downloaded.
         """
 
         self.config = config
         self.file_path = file_path
+        self.remote = file_path.startswith(('http://', 'https://'))
 
         # To be used by subsequent tests
         # the target folder name will get '-', not '.'
-        self.target_path = os.path.join(self.config.working_path, 
-                                os.path.basename(self.file_path).replace('.','-'))
+        file_name = os.path.basename(urlparse(file_path).path if self.remote else file_path)
+        self.target_path = os.path.join(self.config.working_path, file_name.replace('.','-'))
 
         self.license_path = None
 
+        # zip archive, opened once for all tests
+        self.zip = None
+
     def initialize(self):
         """Initialize tests"""
 
-        if not os.path.exists(self.file_path):
-            raise TestSuiteRunningError(
-                "The protected publication does not exist {0}".format(self.file_path))
+        if self.remote:
+            import requests
+            import http_client
+
+            try:
+                source = HTTPRangeSource(self.file_path, http_client.session(self.config))
+            except requests.exceptions.RequestException as err:
+                raise TestSuiteRunningError(err)
+            except ZipArchiveError as err:
+                raise TestSuiteRunningError(err)
+        else:
+            if not os.path.exists(self.file_path):
+                raise TestSuiteRunningError(
+                    "The protected publication does not exist {0}".format(self.file_path))
+            # the archive is memory-mapped: only the pages touched by the tests are read
+            try:
+                source = MmapSource(self.file_path)
+            except ZipArchiveError as err:
+                raise TestSuiteRunningError(err)
 
+        try:
+            self.zip = ZipView(source)
+        except ZipArchiveError as err:
+            source.close()
+            raise TestSuiteRunningError(err)
 
-    def test_validate_encryption_xml(self):
+    def finalize(self):
+        """Close the archive"""
+
+        if self.zip is not None:
+            self.zip.close()
+            self.zip = None
+
+    def _extract(self, name):
         """
-        Check if encryption.xml is present in the protected publication
-        Validate the xml file.
+        Extract an entry of the archive in the target folder
+
+        Returns
+            str: path of the extracted file
         """
 
         try:
-            with zipfile.ZipFile(self.file_path) as zip:
-                # it will store the xml file in the working dir, in a subfolder named after the protected publication
-                encryption_file = zip.extract('META-INF/encryption.xml', self.target_path)
+            data = self.zip.read(name)
         except KeyError as err:
             raise TestSuiteRunningError(err)
+        except ZipArchiveError as err:
+            raise TestSuiteRunningError(err)
+
+        path = os.path.join(self.target_path, *name.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file:
+            file.write(data)
+        return path
+
+
+    def test_validate_encryption_xml(self):
+        """
+        Check if encryption.xml is present in the protected publication
+        Validate the xml file.
+        """
+
+        # it will store the xml file in the working dir, in a subfolder named after the protected publication
+        encryption_file = self._extract('META-INF/encryption.xml')
 
         """
         The W3C schema checks the following rules:
@@ -70,11 +143,9 @@ class LCPFTestSuite(BaseTestSuite):
         - The Type attribute MUST use a value of “http://readium.org/2014/01/lcp#EncryptedContentKey” to identify the target of the URI as an encrypted Content Key.
         """
         try:
-            schema = etree.parse(self.config.encryption_schema)
+            xsd = xml_schema(self.config.encryption_schema)
         except OSError as err:
             raise TestSuiteRunningError(err)
-            
-        xsd = etree.XMLSchema(schema)
 
         doc = etree.parse(os.path.join(self.target_path, 'META-INF/encryption.xml'))
         if not xsd.validate(doc):
@@ -95,12 +166,14 @@ class LCPFTestSuite(BaseTestSuite):
                         'e':'http://www.w3.org/2001/04/xmlenc#'})
 
         try:
-            with zipfile.ZipFile(self.file_path) as zip:
-                for r in enc_res:
-                    info = zip.getinfo(r)
-                    #print(info)
+            for r in enc_res:
+                info = self.zip.getinfo(r)
+                #print(info)
+                self._check_entry_compression(r, info)
         except KeyError as err:
             raise TestSuiteRunningError(err)
+        except ZipArchiveError as err:
+            raise TestSuiteRunningError(err)
 
         """
         The following resource MUST NOT be encrypted:
@@ -118,21 +191,37 @@ class LCPFTestSuite(BaseTestSuite):
                         'e':'http://www.w3.org/2001/04/xmlenc#',
                         'cp':'http://www.idpf.org/2016/encryption#compression'})
         for r in cmp_res:
-            if r.endswith(('.jpg','.png','.gif','.mp3')):
+            if r.endswith(MEDIA_EXTENSIONS):
                 raise TestSuiteRunningError("{0} should not be compressed in encryption.xml".format(r))
         
 
+    def _check_entry_compression(self, name, info):
+        """
+        Check the compression method of an encrypted resource in the archive,
+        from the zip headers alone: the data is neither read nor inflated.
+        """
+
+        # one more request per resource on a remote publication: only done on local files
+        if not self.remote:
+            local_method, _ = self.zip.local_header(name)
+            if local_method != info.compress_type:
+                raise TestSuiteRunningError(
+                    "{0}: compression method {1} in the local header, {2} in the central directory".format(
+                        name, local_method, info.compress_type))
+
+        if info.compress_type == ZIP_DEFLATED:
+            if name.endswith(MEDIA_EXTENSIONS):
+                raise TestSuiteRunningError("{0} should not be compressed in the archive".format(name))
+            # encrypted data does not compress, a deflated entry is only slower to read
+            LOGGER.warning("{0} is encrypted and compressed in the archive".format(name))
+
     def test_check_license_lcpl(self):
         """
         Check if license.lcpl is present in the protected publication
         Extract license.lcpl (as license_path)
         """
 
-        try:
-            with zipfile.ZipFile(self.file_path) as zip:
-                self.license_path = zip.extract('META-INF/license.lcpl', self.target_path)
-        except KeyError as err:
-            raise TestSuiteRunningError(err)
+        self.license_path = self._extract('META-INF/license.lcpl')
 
     def get_tests(self):
         """
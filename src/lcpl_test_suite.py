@@ -10,7 +10,7 @@ that can be found in the LICENSE file exposed on Github (readium) in the project
 """
 
 import logging
-import requests
+import link_checker
 from lcp_license import LCPLicense
 from exception import LCPLicenseError, TestSuiteRunningError
 from base_test_suite import BaseTestSuite
@@ -85,13 +85,32 @@ class LCPLTestSuite(BaseTestSuite):
         # through the passphrase->user-key algorithm, then decrypting the info via the user key
         # and the encryption algorithm identified in the encryption/content_key)
         # cf 2.1.4.7
-
-        pass
+        try:
+            self.license.check_user_info(self.config.user_passphrase)
+        except LCPLicenseError as err:
+            raise TestSuiteRunningError(err)
 
 
     def test_certificate(self):
         # check the validity of the certificate, relative to the CA and issued datetime.
-        pass
+        try:
+            self.license.check_certificate(self.config.cacert)
+        except LCPLicenseError as err:
+            raise TestSuiteRunningError(err)
+
+
+    def test_revocation(self):
+        # check that the certificates are not revoked, using the CRL files listed in the config
+        if not self.config.crl:
+            LOGGER.info("No CRL configured, revocation not checked")
+            return
+        import crl_index
+
+        try:
+            index = crl_index.get_index(self.config.crl, self.config.crl_index_path, self.config.cacert)
+            self.license.check_revocation(index, self.config.cacert)
+        except LCPLicenseError as err:
+            raise TestSuiteRunningError(err)
 
 
     def test_signature(self):
@@ -116,19 +135,33 @@ class LCPLTestSuite(BaseTestSuite):
             raise TestSuiteRunningError(err)
 
     def test_hint_resource(self):
-        # check that the hint resource is fetchable
+        # check that the hint resource is fetchable; a HEAD request, through the link cache
         hint_url = self.license.hint_link()
         if not hint_url:
             return
-        try:
-            r = requests.get(hint_url)
-            if r.status_code != requests.codes.ok:
-                raise TestSuiteRunningError(
-                    "Impossible to fetch the hint resource at {}: error {}".format(
-                        hint_url, r.status_code)
-                    )
-        except requests.exceptions.RequestException as err:
+        response = link_checker.get_checker(self.config).check(hint_url)
+        if response.get("error"):
             LOGGER.warning("Impossible to fetch the hint resource")
+        elif response["status"] not in link_checker.AVAILABLE:
+            raise TestSuiteRunningError(
+                "Impossible to fetch the hint resource at {}: error {}".format(
+                    hint_url, response["status"])
+                )
+
+    def test_links(self):
+        # check every link of the license concurrently: status, type, length and hash
+        if not self.config.links.get('check'):
+            LOGGER.info("Link checks not enabled in the configuration, links not checked")
+            return
+        results = link_checker.get_checker(self.config).check_links(self.license.l['links'])
+        errors = []
+        for link, link_errors, warnings in results:
+            for warning in warnings:
+                LOGGER.warning(warning)
+            errors.extend("{} link, {}".format(link.get("rel"), error) for error in link_errors)
+        if errors:
+            raise TestSuiteRunningError("; ".join(errors))
+        LOGGER.info("{} links checked".format(len(results)))
 
 
     def get_tests(self):
@@ -139,11 +172,13 @@ class LCPLTestSuite(BaseTestSuite):
         return [
             "validate_license",
             "certificate",
+            "revocation",
             "signature",
             "required_links",
             "content_key",
             #"key_check",
             "user_info",
             "rights",
-            "hint_resource"
+            "hint_resource",
+            "links"
             ]
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+"""
+Merge the journals of a sharded batch audit into a single report
+
+    lcpcheck merge -o audit.json audit-0.jsonl audit-1.jsonl audit-2.jsonl audit-3.jsonl
+
+The journals are only read, from a shared filesystem for instance: the shards may still be running.
+When an item is recorded several times (resumed after an error, or checked by several shards),
+its last record is used.
+
+Copyright 2017 European Digital Reading Lab. All rights reserved.
+Licensed to the Readium Foundation under one or more contributor license agreements.
+Use of this source code is governed by a BSD-style license
+that can be found in the LICENSE file exposed on Github (readium) in the project repository.
+"""
+
+import argparse
+import heapq
+import json
+import logging
+import os
+
+import util
+import journal
+
+LOGGER = logging.getLogger(__name__)
+
+
+def merge(journal_paths, top=10):
+    """
+    Merge journals
+
+    Args:
+        journal_paths (list): paths of the journals
+        top (int): number of slowest items reported
+
+    Returns
+        dict: runs of every journal, merged summary, shard coverage and timing
+    """
+
+    # first pass: position of the last record of every item
+    last = {}
+    duplicates = set()
+    for journal_index, journal_path in enumerate(journal_paths):
+        for line, record in enumerate(journal.read_records(journal_path)):
+            item = record.get("item")
+            if item is None:
+                continue
+            previous = last.get(item)
+            if previous is not None and previous[0] != journal_index:
+                duplicates.add(item)
+            last[item] = (journal_index, line)
+
+    # second pass: the last records only
+    journals = [{"journal": journal_path, "runs": []} for journal_path in journal_paths]
+    shard_counts = set()
+    shard_indexes = set()
+    suites = {}
+    slowest = []
+    wall_clock = 0.0
+
+    def records():
+        for journal_index, journal_path in enumerate(journal_paths):
+            runs = []
+            for line, record in enumerate(journal.read_records(journal_path)):
+                if "run" in record:
+                    runs.append(record["run"])
+                elif last.get(record.get("item")) == (journal_index, line):
+                    yield record
+            journals[journal_index]["runs"] = runs
+
+    def timed(records):
+        for record in records:
+            for suite, duration in record.get("suites", {}).items():
+                suites[suite] = suites.get(suite, 0) + duration
+            entry = (record.get("duration", 0), record["item"])
+            if len(slowest) < top:
+                heapq.heappush(slowest, entry)
+            elif entry > slowest[0]:
+                heapq.heapreplace(slowest, entry)
+            yield record
+
+    total = journal.summarize(timed(records()))
+
+    for entry in journals:
+        shards = sorted({run["shard"] for run in entry["runs"] if run.get("shard")})
+        entry["shards"] = shards
+        for shard in shards:
+            index, count = (int(v) for v in shard.split('/'))
+            shard_indexes.add(index)
+            shard_counts.add(count)
+        # the runs of a journal are sequential, the journals ran in parallel
+        elapsed = sum(run["elapsed"] for run in entry["runs"])
+        entry["elapsed"] = round(elapsed, 3)
+        wall_clock = max(wall_clock, elapsed)
+
+    report = {
+        "journals": journals,
+        "total": total,
+        "duplicates": len(duplicates),
+        "timing": {
+            "wall_clock": round(wall_clock, 3),
+            "check_time": total["duration"],
+            "suites": {suite: round(duration, 3) for suite, duration in suites.items()},
+            "slowest": [{"item": item, "duration": duration} for duration, item in sorted(slowest, reverse=True)]
+            }
+        }
+    if shard_counts:
+        count = max(shard_counts)
+        report["shards"] = {
+            "count": count,
+            "missing": sorted(set(range(count)) - shard_indexes),
+            "consistent": len(shard_counts) == 1
+            }
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="lcpcheck merge")
+    parser.add_argument("-v", "--verbosity", action="count", help="increase output verbosity")
+    parser.add_argument("journals", nargs="+", help="journals of the shards")
+    parser.add_argument("-o", "--output", help="write the merged report to this json file (default: standard output)")
+    parser.add_argument("--top", type=int, default=10, help="number of slowest items reported")
+    args = parser.parse_args(argv)
+
+    util.init_logger(args.verbosity)
+
+    for journal_path in args.journals:
+        if not os.path.exists(journal_path):
+            LOGGER.error("Journal {} not found".format(journal_path))
+            return 1
+
+    report = merge(args.journals, args.top)
+    if "shards" in report:
+        if not report["shards"]["consistent"]:
+            LOGGER.error("The journals come from different shardings")
+        if report["shards"]["missing"]:
+            LOGGER.error("Missing shards: {}".format(report["shards"]["missing"]))
+    if report["duplicates"]:
+        LOGGER.warning("{} items recorded by several journals".format(report["duplicates"]))
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    return 0
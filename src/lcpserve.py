@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+
+"""
+Validation service: a local HTTP server which checks LCP licenses and protected publications
+
+    POST /license       body: an LCP license
+    POST /publication   body: an LCP protected publication (the embedded license is checked as well)
+    GET  /metrics       request counts and latencies per endpoint
+
+A check returns a JSON report built from the test suites reports.
+Schemas are loaded once and the checks are run by a bounded pool of workers.
+
+Copyright 2017 European Digital Reading Lab. All rights reserved.
+Licensed to the Readium Foundation under one or more contributor license agreements.
+Use of this source code is governed by a BSD-style license
+that can be found in the LICENSE file exposed on Github (readium) in the project repository.
+"""
+
+import argparse
+import collections
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import util
+import suite_runner
+from chkconfig import TestConfig
+from lcp_license import schema_validator
+
+LOGGER = logging.getLogger(__name__)
+
+# number of latencies kept per endpoint for the metrics
+LATENCY_WINDOW = 10000
+
+ENDPOINTS = {
+    "/license": ".lcpl",
+    "/publication": ".epub"
+    }
+
+
+class ValidationService:
+    """Run the checks requested to the server"""
+
+    def __init__(self, config, workers, backlog):
+        """
+        Args:
+            config (TestConfig): Configuration object
+            workers (int): number of checks run concurrently
+            backlog (int): number of checks which may wait for a worker
+        """
+
+        self.config = config
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        # requests beyond the capacity of the pool are rejected, not queued indefinitely
+        self.slots = threading.BoundedSemaphore(workers + backlog)
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.metrics = {
+            endpoint: {
+                "requests": 0, "passed": 0, "failed": 0, "errors": 0, "rejected": 0,
+                "latencies": collections.deque(maxlen=LATENCY_WINDOW)
+                }
+            for endpoint in ENDPOINTS
+            }
+
+    def warm_up(self):
+        """Load the resources shared by every check"""
+
+        schema_validator(self.config.license_schema_path)
+        if not os.path.exists(self.config.cacert):
+            LOGGER.warning("Root certificate file {} not found".format(self.config.cacert))
+
+    def check(self, endpoint, body):
+        """
+        Check an uploaded file
+
+        Returns
+            dict: the report, or None if the server is busy
+        """
+
+        if not self.slots.acquire(blocking=False):
+            self._count(endpoint, "rejected")
+            return None
+
+        start = time.perf_counter()
+        try:
+            result = self.pool.submit(self._check, endpoint, body).result()
+        except Exception:
+            self._count(endpoint, "errors")
+            raise
+        finally:
+            self.slots.release()
+
+        with self.lock:
+            metrics = self.metrics[endpoint]
+            metrics["requests"] += 1
+            metrics["passed" if result["passed"] else "failed"] += 1
+            metrics["latencies"].append(time.perf_counter() - start)
+        return result
+
+    def _check(self, endpoint, body):
+        # the test suites work on files: store the upload in the working path
+        upload_path = os.path.join(
+            self.config.working_path, "upload-{}{}".format(uuid.uuid4(), ENDPOINTS[endpoint]))
+        with open(upload_path, 'wb') as upload:
+            upload.write(body)
+
+        try:
+            return suite_runner.check_file(self.config, upload_path)
+        finally:
+            os.remove(upload_path)
+
+    def _count(self, endpoint, counter):
+        with self.lock:
+            self.metrics[endpoint][counter] += 1
+
+    def metrics_report(self):
+        """
+        Returns
+            dict: counters and latency summary per endpoint
+        """
+
+        with self.lock:
+            endpoints = {}
+            for endpoint, metrics in self.metrics.items():
+                report = {k: v for k, v in metrics.items() if k != "latencies"}
+                report["latency_ms"] = util.latency_summary(metrics["latencies"])
+                endpoints[endpoint] = report
+        return {"uptime": round(time.time() - self.started, 1), "endpoints": endpoints}
+
+
+class ValidationRequestHandler(BaseHTTPRequestHandler):
+    """HTTP interface of the validation service"""
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            self._send_json(200, self.server.service.metrics_report())
+        else:
+            self._send_json(404, {"error": "unknown endpoint {}".format(self.path)})
+
+    def do_POST(self):
+        if self.path not in ENDPOINTS:
+            self._send_json(404, {"error": "unknown endpoint {}".format(self.path)})
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        if length <= 0:
+            self._send_json(400, {"error": "empty body"})
+            return
+        body = self.rfile.read(length)
+
+        try:
+            result = self.server.service.check(self.path, body)
+        except Exception as err:
+            LOGGER.exception("Check failed")
+            self._send_json(500, {"error": str(err)})
+            return
+
+        if result is None:
+            self._send_json(503, {"error": "too many pending checks"})
+        else:
+            self._send_json(200, result)
+
+    def _send_json(self, status, content):
+        data = json.dumps(content).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        LOGGER.debug("%s - %s", self.address_string(), format % args)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="lcpcheck serve")
+    parser.add_argument("-v", "--verbosity", action="count", help="increase output verbosity")
+    parser.add_argument("-c", "--config", help="path to the yaml configuration file")
+    parser.add_argument("--host", default="127.0.0.1", help="listening address (default 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8080, help="listening port (default 8080)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of concurrent checks (default: number of cores)")
+    parser.add_argument("--backlog", type=int, default=64, help="number of checks waiting for a worker before requests are rejected")
+    args = parser.parse_args(argv)
+
+    util.init_logger(args.verbosity)
+
+    try:
+        config = TestConfig(args.config)
+    except FileNotFoundError as err:
+        LOGGER.error(err)
+        return 1
+
+    service = ValidationService(config, args.workers, args.backlog)
+    service.warm_up()
+
+    server = ThreadingHTTPServer((args.host, args.port), ValidationRequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    print("Validation service listening on http://{}:{}".format(args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.pool.shutdown()
+    return 0
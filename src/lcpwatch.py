@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+
+"""
+Watch a folder and check the licenses and protected publications as they are written
+
+    lcpcheck -c config.yml --watch /spool --journal /var/log/lcp/watch.jsonl --jobs 2
+
+The new or modified .lcpl and .epub files of the folder and its subfolders are queued once their
+writing is over: a short delay (DEBOUNCE) after the file is closed or moved into the folder,
+a longer one (SETTLE) after the last change of a file not closed yet. The files are checked by a pool
+of worker processes started once, as in a batch audit, and their outcome is appended to the journal
+at once (one record per check, see lcpbatch).
+
+The folder is watched with inotify on Linux, through ctypes; elsewhere, or if inotify is not available,
+it is scanned every POLL_INTERVAL seconds. The files present when the watch starts are not checked:
+a batch audit checks them.
+
+Copyright 2017 European Digital Reading Lab. All rights reserved.
+Licensed to the Readium Foundation under one or more contributor license agreements.
+Use of this source code is governed by a BSD-style license
+that can be found in the LICENSE file exposed on Github (readium) in the project repository.
+"""
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import signal
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import journal
+import lcpbatch
+from chkconfig import TestConfig
+from lcpbatch import ITEM_EXTENSIONS
+
+LOGGER = logging.getLogger(__name__)
+
+# delay after a file is closed or moved in, before it is checked (seconds)
+DEBOUNCE = 0.2
+# delay after the last change of a file which is not closed yet
+SETTLE = 2.0
+# scan interval of the polling watcher
+POLL_INTERVAL = 1.0
+
+# inotify constants, from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF | IN_ONLYDIR
+EVENT_STRUCT = struct.Struct("iIII")
+
+
+def _is_item(name):
+    return name.lower().endswith(ITEM_EXTENSIONS)
+
+
+def _walk_items(folder):
+    for root, dirs, files in os.walk(folder):
+        for name in files:
+            if _is_item(name):
+                yield os.path.join(root, name)
+
+
+class InotifyWatcher:
+    """Changes of the files of a folder tree, from inotify"""
+
+    def __init__(self, folder):
+        """
+        Raises
+            OSError if inotify is not available
+        """
+
+        libc_name = ctypes.util.find_library("c")
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self.libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        # watch descriptor -> folder
+        self.folders = {}
+        # time of the last read: after a queue overflow, the files changed since are looked for
+        self.synced = time.time()
+        for root, dirs, files in os.walk(folder):
+            self._add_watch(root)
+
+    def _add_watch(self, folder):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(folder), WATCH_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            LOGGER.warning("Impossible to watch {}: {}".format(folder, os.strerror(errno)))
+            return
+        self.folders[wd] = folder
+
+    def poll(self, timeout):
+        """
+        Wait for changes
+
+        Returns
+            list: (path, closed) of the changed files; closed is True if the file was closed or moved in
+        """
+
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        changes = []
+        synced = self.synced
+        self.synced = time.time()
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_STRUCT.unpack_from(data, offset)
+            name = data[offset + EVENT_STRUCT.size:offset + EVENT_STRUCT.size + length].rstrip(b"\0")
+            offset += EVENT_STRUCT.size + length
+            if mask & IN_Q_OVERFLOW:
+                LOGGER.warning("Events lost, the watched folders are scanned")
+                changes.extend(self._changed_since(synced))
+                continue
+            folder = self.folders.get(wd)
+            if mask & IN_IGNORED:
+                self.folders.pop(wd, None)
+                continue
+            if folder is None or not name:
+                continue
+            path = os.path.join(folder, os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # a new subfolder: its files may have been written before its watch was added
+                    for root, dirs, files in os.walk(path):
+                        self._add_watch(root)
+                    changes.extend((item, True) for item in _walk_items(path))
+            elif _is_item(path):
+                changes.append((path, bool(mask & (IN_CLOSE_WRITE | IN_MOVED_TO))))
+        return changes
+
+    def _changed_since(self, since):
+        for folder in list(self.folders.values()):
+            try:
+                entries = list(os.scandir(folder))
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    if entry.is_file() and _is_item(entry.name) and entry.stat().st_mtime >= since - 1:
+                        yield entry.path, True
+                except OSError:
+                    continue
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Changes of the files of a folder tree, from periodic scans"""
+
+    def __init__(self, folder, interval=POLL_INTERVAL):
+        self.folder = folder
+        self.interval = interval
+        self.files = self._scan()
+        self.next_scan = time.monotonic() + interval
+
+    def _scan(self):
+        files = {}
+        for path in _walk_items(self.folder):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files[path] = (stat.st_mtime_ns, stat.st_size)
+        return files
+
+    def poll(self, timeout):
+        """
+        Wait for changes
+
+        Returns
+            list: (path, closed) of the changed files; closed is always False, a scan cannot tell
+                whether a file is still being written
+        """
+
+        time.sleep(max(0.0, min(timeout, self.next_scan - time.monotonic())))
+        if time.monotonic() < self.next_scan:
+            return []
+        self.next_scan = time.monotonic() + self.interval
+        files = self._scan()
+        changes = [(path, False) for path, state in files.items() if self.files.get(path) != state]
+        self.files = files
+        return changes
+
+    def close(self):
+        pass
+
+
+def _warm_up():
+    # the suites are imported by the workers before the first file comes
+    import lcpl_test_suite
+    import lcpf_test_suite
+
+
+def open_watcher(folder):
+    """Watcher of a folder: inotify if available, polling otherwise"""
+
+    try:
+        return InotifyWatcher(folder)
+    except (OSError, AttributeError, TypeError) as err:
+        LOGGER.warning("inotify not available ({}), {} is scanned every {}s".format(err, folder, POLL_INTERVAL))
+        return PollingWatcher(folder)
+
+
+def _start_pool(config_path, jobs, verbosity, run_id, http_config):
+    # a new semaphore for every pool: a worker which died may have held a slot of the previous one
+    http_slots = lcpbatch.shared_http_slots(http_config, jobs)
+    pool = ProcessPoolExecutor(max_workers=jobs, initializer=lcpbatch._init_worker,
+                               initargs=(config_path, verbosity, jobs, False, True, run_id, http_slots))
+    for _ in range(jobs):
+        pool.submit(_warm_up)
+    return pool
+
+
+def _result(future, path):
+    """
+    Returns
+        (dict, bool): journal record of a check, True if the worker pool is broken
+    """
+
+    try:
+        return future.result(), False
+    except BrokenProcessPool as err:
+        # a worker died (out of memory, crash of a native library): every check in progress or queued fails
+        LOGGER.error("{} not checked: a worker process died".format(path))
+        return lcpbatch.error_record(path, err), True
+
+
+def watch(config_path, folder, journal_path, jobs=1, verbosity=None):
+    """
+    Check the files written to a folder until interrupted
+
+    Args:
+        config_path (str): path to the yaml configuration file
+        folder (str): watched folder
+        journal_path (str): journal of the outcomes
+        jobs (int): number of worker processes
+    """
+
+    config = TestConfig(config_path)
+    working_path = config.working_path
+    # the working folders of the workers are named after this process
+    run_id = os.getpid()
+    watcher = open_watcher(folder)
+    # every record is written at once
+    job_journal = journal.Journal(journal_path, batch_size=1)
+    # path -> time at which the file is checked
+    due = {}
+    # future -> (path, time of the last change, pool)
+    pending = {}
+    changed = {}
+    signal.signal(signal.SIGTERM, lcpbatch._terminate)
+    LOGGER.warning("Watching {}".format(folder))
+    pool = _start_pool(config_path, jobs, verbosity, run_id, config.http)
+    try:
+        with job_journal:
+            try:
+                while True:
+                    timeout = POLL_INTERVAL
+                    if due:
+                        timeout = max(0.0, min(min(due.values()) - time.monotonic(), timeout))
+                    if pending:
+                        timeout = min(timeout, 0.05)
+                    for path, closed in watcher.poll(timeout):
+                        now = time.monotonic()
+                        due[path] = now + (DEBOUNCE if closed else SETTLE)
+                        changed[path] = now
+
+                    now = time.monotonic()
+                    for path in [path for path, when in due.items() if when <= now]:
+                        del due[path]
+                        if not os.path.exists(path):
+                            changed.pop(path)
+                            continue
+                        try:
+                            future = pool.submit(lcpbatch._check, path)
+                        except BrokenProcessPool:
+                            LOGGER.warning("A worker died, the worker processes are restarted")
+                            pool.shutdown(wait=False)
+                            pool = _start_pool(config_path, jobs, verbosity, run_id, config.http)
+                            future = pool.submit(lcpbatch._check, path)
+                        pending[future] = (path, changed.pop(path), pool)
+
+                    for future in [future for future in pending if future.done()]:
+                        path, since, future_pool = pending.pop(future)
+                        rec, broken = _result(future, path)
+                        job_journal.append(rec)
+                        if broken and future_pool is pool:
+                            # the futures of the broken pool fail, the next checks go to a new one
+                            LOGGER.warning("The worker processes are restarted")
+                            pool.shutdown(wait=False)
+                            pool = _start_pool(config_path, jobs, verbosity, run_id, config.http)
+                        LOGGER.info("{} {} in {:.3f}s after its last change".format(
+                            path, "passed" if rec["passed"] else "failed", time.monotonic() - since))
+                        if not rec["passed"]:
+                            LOGGER.warning("{} failed: {}".format(path, rec.get("error") or
+                                ", ".join("{}.{}".format(f["suite"], f["test"]) for f in rec["failures"])))
+            except KeyboardInterrupt:
+                LOGGER.warning("Watch stopped, {} checks in progress are completed".format(len(pending)))
+                for future, (path, since, future_pool) in pending.items():
+                    job_journal.append(_result(future, path)[0])
+    finally:
+        pool.shutdown()
+        watcher.close()
+        lcpbatch.remove_worker_paths(working_path, run_id)
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+
+"""
+Index of a corpus of licenses in a sqlite file, to select licenses without walking and parsing the tree
+
+    lcpcheck index --db licenses.sqlite /store
+    lcpcheck index --db licenses.sqlite --provider http://edrlab.org --issued-since 2024-05-01
+    lcpcheck batch -c config.yml --journal audit.jsonl --index licenses.sqlite --content 1234-5678
+
+One row per license file (or protected publication, for its embedded license): license id, content id,
+user id, provider, sha256 of the file, issue and update dates, rights start and end (seconds since the epoch).
+The content id is the last segment of the path of the publication link, without its extension.
+An update parses only the files added or modified since the previous one (size and mtime);
+the rows of the files removed from the indexed folders are deleted.
+
+Copyright 2017 European Digital Reading Lab. All rights reserved.
+Licensed to the Readium Foundation under one or more contributor license agreements.
+Use of this source code is governed by a BSD-style license
+that can be found in the LICENSE file exposed on Github (readium) in the project repository.
+"""
+
+import argparse
+import hashlib
+import logging
+import os
+import posixpath
+import sqlite3
+from urllib.parse import urlsplit
+
+import util
+from lcpbatch import iter_items
+from lcpexport import epoch_seconds, json_object, license_links, read_license, text
+from exception import ZipArchiveError
+
+LOGGER = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS licenses (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER,
+    size INTEGER,
+    sha256 TEXT,
+    id TEXT,
+    content_id TEXT,
+    user_id TEXT,
+    provider TEXT,
+    issued INTEGER,
+    updated INTEGER,
+    rights_start INTEGER,
+    rights_end INTEGER,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS licenses_id ON licenses (id);
+CREATE INDEX IF NOT EXISTS licenses_content_id ON licenses (content_id);
+CREATE INDEX IF NOT EXISTS licenses_user_id ON licenses (user_id);
+CREATE INDEX IF NOT EXISTS licenses_provider_issued ON licenses (provider, issued);
+CREATE INDEX IF NOT EXISTS licenses_issued ON licenses (issued);
+"""
+
+_FIELDS = ("path", "mtime_ns", "size", "sha256", "id", "content_id", "user_id", "provider",
+           "issued", "updated", "rights_start", "rights_end", "error")
+
+# rows written per transaction
+COMMIT_ROWS = 1000
+
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def content_id(lcpl):
+    """
+    Returns
+        str: content id of a license, from its publication link, None if there is no such link
+    """
+
+    for link in license_links(lcpl):
+        if link.get('rel') == 'publication' and text(link.get('href')):
+            name = posixpath.basename(urlsplit(link['href']).path.rstrip('/'))
+            return posixpath.splitext(name)[0] or None
+    return None
+
+
+class LicenseIndex:
+    """sqlite index of licenses"""
+
+    def __init__(self, db_path):
+        self.db = sqlite3.connect(db_path)
+        with self.db:
+            self.db.executescript(_SCHEMA)
+        # statistics of the last update
+        self.added = 0
+        self.modified = 0
+        self.removed = 0
+        self.unchanged = 0
+
+    def close(self):
+        self.db.close()
+
+    def _row(self, path, stat):
+        sha256 = hashlib.sha256()
+        with open(path, 'rb') as license_file:
+            for chunk in iter(lambda: license_file.read(HASH_CHUNK_SIZE), b""):
+                sha256.update(chunk)
+        row = dict.fromkeys(_FIELDS)
+        row.update(path=path, mtime_ns=stat.st_mtime_ns, size=stat.st_size, sha256=sha256.hexdigest())
+        try:
+            lcpl = read_license(path)
+            rights = json_object(lcpl.get('rights'), "rights")
+            user = json_object(lcpl.get('user'), "user")
+            license_content_id = content_id(lcpl)
+        except (ValueError, ZipArchiveError) as err:
+            row["error"] = str(err)
+            return row
+        row.update(
+            id=text(lcpl.get('id')),
+            content_id=license_content_id,
+            user_id=text(user.get('id')),
+            provider=text(lcpl.get('provider')),
+            issued=epoch_seconds(lcpl.get('issued')),
+            updated=epoch_seconds(lcpl.get('updated')),
+            rights_start=epoch_seconds(rights.get('start')),
+            rights_end=epoch_seconds(rights.get('end')))
+        return row
+
+    def update(self, paths, list_path=None):
+        """
+        Index the new and modified licenses, remove the licenses gone from the folders
+
+        Args:
+            paths (list): files, or folders searched recursively
+            list_path (str): file listing one item per line, '-' for stdin
+        """
+
+        self.added = self.modified = self.removed = self.unchanged = 0
+        known = {path: (mtime_ns, size) for path, mtime_ns, size in
+                 self.db.execute("SELECT path, mtime_ns, size FROM licenses")}
+        folders = [os.path.join(path, '') for path in paths if os.path.isdir(path)]
+        seen = set()
+        pending = 0
+        insert = "INSERT OR REPLACE INTO licenses ({}) VALUES ({})".format(
+            ", ".join(_FIELDS), ", ".join("?" * len(_FIELDS)))
+        try:
+            for path in iter_items(paths, list_path):
+                seen.add(path)
+                try:
+                    stat = os.stat(path)
+                except OSError as err:
+                    LOGGER.warning("{}: {}".format(path, err))
+                    continue
+                previous = known.get(path)
+                if previous == (stat.st_mtime_ns, stat.st_size):
+                    self.unchanged += 1
+                    continue
+                try:
+                    row = self._row(path, stat)
+                except OSError as err:
+                    LOGGER.warning("{}: {}".format(path, err))
+                    continue
+                self.db.execute(insert, [row[f] for f in _FIELDS])
+                if previous is None:
+                    self.added += 1
+                else:
+                    self.modified += 1
+                pending += 1
+                if pending >= COMMIT_ROWS:
+                    self.db.commit()
+                    pending = 0
+
+            # the files of the indexed folders which are gone
+            gone = [path for path in known if path not in seen and path.startswith(tuple(folders))] \
+                if folders else []
+            self.db.executemany("DELETE FROM licenses WHERE path = ?", ((path,) for path in gone))
+            self.removed = len(gone)
+        finally:
+            self.db.commit()
+
+    def license_id(self, path):
+        """
+        Id of an indexed license, if the file is unchanged since it was indexed
+
+        Returns
+            str: license id, or None if the license is not indexed, modified since or invalid
+        """
+
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        row = self.db.execute("SELECT id FROM licenses WHERE path = ? AND mtime_ns = ? AND size = ?",
+                              (path, stat.st_mtime_ns, stat.st_size)).fetchone()
+        return row[0] if row else None
+
+    def select(self, license_id=None, content_id=None, user_id=None, provider=None,
+               issued_since=None, issued_until=None):
+        """
+        Paths of the licenses matching all the given criteria
+
+        Args:
+            issued_since, issued_until: ISO 8601 dates, the second one excluded
+
+        Returns
+            iterator of the license paths
+
+        Raises
+            ValueError if a date is invalid
+        """
+
+        clauses = []
+        values = []
+        for column, value in (("id", license_id), ("content_id", content_id), ("user_id", user_id),
+                              ("provider", provider)):
+            if value is not None:
+                clauses.append("{} = ?".format(column))
+                values.append(value)
+        for operator, value in ((">=", issued_since), ("<", issued_until)):
+            if value is not None:
+                seconds = epoch_seconds(value)
+                if seconds is None:
+                    raise ValueError("Invalid date {}".format(value))
+                clauses.append("issued {} ?".format(operator))
+                values.append(seconds)
+        query = "SELECT path FROM licenses WHERE error IS NULL"
+        if clauses:
+            query += " AND " + " AND ".join(clauses)
+        return (path for (path,) in self.db.execute(query + " ORDER BY path", values))
+
+
+def add_selection_arguments(parser):
+    """Options selecting licenses in an index"""
+
+    parser.add_argument("--license-id", help="select the license of this id")
+    parser.add_argument("--content", help="select the licenses of this content id")
+    parser.add_argument("--user", help="select the licenses of this user id")
+    parser.add_argument("--provider", help="select the licenses of this provider")
+    parser.add_argument("--issued-since", help="select the licenses issued from this date (ISO 8601)")
+    parser.add_argument("--issued-until", help="select the licenses issued before this date (ISO 8601)")
+
+def selection(args):
+    """
+    Returns
+        dict: criteria of the selection options, as arguments of LicenseIndex.select
+    """
+
+    return {"license_id": args.license_id, "content_id": args.content, "user_id": args.user,
+            "provider": args.provider, "issued_since": args.issued_since, "issued_until": args.issued_until}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="lcpcheck index")
+    parser.add_argument("-v", "--verbosity", action="count", help="increase output verbosity")
+    parser.add_argument("--db", required=True, help="path of the sqlite index")
+    parser.add_argument("paths", nargs="*", help="licenses, protected publications, or folders containing them, to index")
+    parser.add_argument("--list", help="file listing the items to index, one per line ('-' for stdin)")
+    add_selection_arguments(parser)
+    args = parser.parse_args(argv)
+
+    util.init_logger(args.verbosity)
+
+    index = LicenseIndex(args.db)
+    try:
+        if args.paths or args.list:
+            index.update(args.paths, args.list)
+            LOGGER.warning("{} licenses added, {} modified, {} removed, {} unchanged".format(
+                index.added, index.modified, index.removed, index.unchanged))
+        criteria = selection(args)
+        if any(value is not None for value in criteria.values()):
+            try:
+                for path in index.select(**criteria):
+                    print(path)
+            except ValueError as err:
+                LOGGER.error(err)
+                return 1
+    finally:
+        index.close()
+    return 0
@@ -0,0 +1,423 @@
+# -*- coding: utf-8 -*-
+
+"""
+Verification of the links of a license: the links are checked concurrently, the responses
+are kept in an on-disk HTTP cache shared by the runs and the worker processes
+
+A link is checked with a HEAD request, or a GET of its first byte if the server refuses HEAD;
+the resource is fully downloaded only to check a hash, when it is small enough, or for the
+publication if stream_publication is set.
+The status, type, length and hash of the response are compared with the link.
+
+The cache (sqlite) follows the caching headers of the responses: a fresh response is reused,
+a stale one is revalidated with its ETag or Last-Modified date. A response without caching
+headers is considered fresh for heuristic_ttl seconds. Within a process, the last responses are
+also kept in memory while they are fresh: a hint page shared by many licenses is not looked up
+again for every license.
+
+Configuration (optional):
+
+    links:
+      # verify the links of the licenses (links test of the license suite, default false)
+      check: true
+      # sqlite file of the cache (default: <working_path>/links.sqlite)
+      cache_path: /var/cache/lcp/links.sqlite
+      # number of links checked at once (default 8)
+      workers: 8
+      # freshness in seconds of the responses without caching headers (default 300)
+      heuristic_ttl: 300
+      # size up to which a resource is downloaded to check its hash, in bytes (default 1 MiB)
+      max_hash_size: 1048576
+      # download the publication in full to check the length and hash of its link, whatever
+      # its size; it is hashed as it comes and never stored, within http/max_bandwidth (default false)
+      stream_publication: false
+
+Copyright 2017 European Digital Reading Lab. All rights reserved.
+Licensed to the Readium Foundation under one or more contributor license agreements.
+Use of this source code is governed by a BSD-style license
+that can be found in the LICENSE file exposed on Github (readium) in the project repository.
+"""
+
+import base64
+import collections
+import contextlib
+import email.utils
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import http_client
+
+LOGGER = logging.getLogger(__name__)
+
+# status codes of a server which does not accept HEAD requests
+HEAD_REFUSED = (403, 405, 501)
+
+# status codes of an available resource: 206 answers the GET of the first byte sent when HEAD is refused
+AVAILABLE = (200, 206)
+
+# hash of a resource: none, only if it is small enough, whatever its size
+HASH_NONE, HASH_SMALL, HASH_STREAMED = 0, 1, 2
+
+# number of responses kept in memory by a checker
+MEMO_SIZE = 1000
+# seconds during which an unreachable url is not requested again by a process
+ERROR_TTL = 30
+
+STREAM_CHUNK_SIZE = 65536
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    url TEXT PRIMARY KEY,
+    status INTEGER,
+    content_type TEXT,
+    content_length INTEGER,
+    sha256 TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    fresh_until REAL,
+    checked REAL
+)
+"""
+
+_FIELDS = ("url", "status", "content_type", "content_length", "sha256", "etag", "last_modified", "fresh_until", "checked")
+
+
+class HTTPCache:
+    """Responses of the checked links, in a sqlite file"""
+
+    def __init__(self, cache_path):
+        os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+        # shared by the threads of the checker; the worker processes share the file
+        self.db = sqlite3.connect(cache_path, timeout=30, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.db:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute(_SCHEMA)
+
+    def get(self, url):
+        """
+        Returns
+            dict: cached response of the url, or None
+        """
+
+        with self.lock:
+            row = self.db.execute("SELECT {} FROM responses WHERE url = ?".format(", ".join(_FIELDS)), (url,)).fetchone()
+        return dict(zip(_FIELDS, row)) if row else None
+
+    def put(self, response):
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO responses ({}) VALUES ({})".format(
+                ", ".join(_FIELDS), ", ".join("?" * len(_FIELDS))), [response[f] for f in _FIELDS])
+
+    def close(self):
+        self.db.close()
+
+
+def freshness(headers, now, heuristic_ttl):
+    """
+    Returns
+        float: time until which a response is fresh, None if it must not be stored
+    """
+
+    cache_control = headers.get("Cache-Control", "").lower()
+    directives = {}
+    for directive in cache_control.split(","):
+        name, _, value = directive.strip().partition("=")
+        directives[name] = value.strip('"')
+    if "no-store" in directives:
+        return None
+    if "no-cache" in directives:
+        return now
+    for name in ("s-maxage", "max-age"):
+        if directives.get(name, "").isdigit():
+            return now + int(directives[name])
+    if "Expires" in headers:
+        try:
+            expires = email.utils.parsedate_to_datetime(headers["Expires"]).timestamp()
+            date = email.utils.parsedate_to_datetime(headers["Date"]).timestamp() if "Date" in headers else time.time()
+        except (TypeError, ValueError):
+            # an invalid Expires date means already expired
+            return now
+        return now + max(0.0, expires - date)
+    return now + heuristic_ttl
+
+
+def _media_type(content_type):
+    return (content_type or "").split(";")[0].strip().lower()
+
+
+def verify(link, response):
+    """
+    Compare a link of a license with the response of its server
+
+    Returns
+        (list, list): errors and warnings
+    """
+
+    errors = []
+    warnings = []
+    href = link["href"]
+    if response.get("error"):
+        return ["{}: {}".format(href, response["error"])], warnings
+    if response["status"] not in AVAILABLE:
+        return ["{}: error {}".format(href, response["status"])], warnings
+
+    expected = _media_type(link.get("type"))
+    actual = _media_type(response["content_type"])
+    if expected and actual and expected != actual:
+        # application/json for application/vnd...+json
+        suffix = re.match(r"^(\w+)/.+\+(\w+)$", expected)
+        if suffix and actual == "{}/{}".format(suffix.group(1), suffix.group(2)):
+            warnings.append("{}: type {} served as {}".format(href, expected, actual))
+        else:
+            errors.append("{}: type {} expected, {} served".format(href, expected, actual))
+
+    if link.get("length") is not None and response["content_length"] is not None \
+            and int(link["length"]) != response["content_length"]:
+        errors.append("{}: length {} expected, {} served".format(href, link["length"], response["content_length"]))
+
+    if link.get("hash"):
+        if response["sha256"] is None:
+            warnings.append("{}: hash not checked, the resource is too large".format(href))
+        else:
+            digest = bytes.fromhex(response["sha256"])
+            # hexadecimal or base64
+            link_hash = link["hash"]
+            if re.fullmatch(r"[0-9a-fA-F]{64}", link_hash):
+                link_hash, served = link_hash.lower(), digest.hex()
+            else:
+                served = base64.b64encode(digest).decode('ascii')
+            if link_hash != served:
+                errors.append("{}: hash {} expected, {} served".format(href, link["hash"], served))
+    return errors, warnings
+
+
+class LinkChecker:
+    """Concurrent checks of links, through the HTTP cache"""
+
+    def __init__(self, config):
+        """
+        Args:
+            config (TestConfig): Configuration object
+        """
+
+        options = config.links
+        self.workers = options.get("workers", 8)
+        self.heuristic_ttl = options.get("heuristic_ttl", 300)
+        self.max_hash_size = options.get("max_hash_size", 1 << 20)
+        self.stream_publication = options.get("stream_publication", False)
+        self.cache = HTTPCache(options.get("cache_path") or os.path.join(config.working_path, "links.sqlite"))
+        self.session = http_client.session(config)
+        self.bandwidth = http_client.get_bandwidth(config.http)
+        # url -> fresh response checked by this process, least recently used first
+        self.checked = collections.OrderedDict()
+        self.lock = threading.Lock()
+        # url -> [lock, number of threads holding or waiting for it]
+        self.url_locks = {}
+        # statistics: requests sent, responses taken from the cache
+        self.requests = 0
+        self.cache_hits = 0
+
+    @contextlib.contextmanager
+    def _url_lock(self, url):
+        with self.lock:
+            entry = self.url_locks.setdefault(url, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self.lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self.url_locks[url]
+
+    def _memo(self, url, level):
+        with self.lock:
+            response = self.checked.get(url)
+            if response is None:
+                return None
+            if response["fresh_until"] <= time.time():
+                # stale: revalidated through the cache
+                del self.checked[url]
+                return None
+            self.checked.move_to_end(url)
+            return response if response.get("hash_level", HASH_NONE) >= level else None
+
+    def _remember(self, url, response):
+        with self.lock:
+            self.checked[url] = response
+            self.checked.move_to_end(url)
+            while len(self.checked) > MEMO_SIZE:
+                self.checked.popitem(last=False)
+
+    def check(self, url, with_hash=False, stream=False):
+        """
+        Response of a url: status, content type and length, sha256 (hex) if with_hash and the
+        resource is small enough, or error if the server cannot be reached
+
+        Args:
+            stream (bool): download the whole resource whatever its size, within the bandwidth limit,
+                to hash it and count its bytes; nothing is kept but the hash and the length
+
+        Returns
+            dict
+        """
+
+        level = HASH_STREAMED if stream else HASH_SMALL if with_hash else HASH_NONE
+        # concurrent checks of the same url wait for the first one
+        with self._url_lock(url):
+            response = self._memo(url, level)
+            if response is not None:
+                return response
+            response = self._check(url, level)
+            if response["fresh_until"] > time.time():
+                self._remember(url, response)
+            return response
+
+    def _check(self, url, level):
+        now = time.time()
+        cached = self.cache.get(url)
+        # a resource too large to be hashed is not downloaded again, unless it is streamed
+        usable = cached is not None and (level == HASH_NONE or cached["sha256"] is not None or
+            (level == HASH_SMALL and (cached["content_length"] or 0) > self.max_hash_size))
+        if usable and cached["fresh_until"] > now:
+            with self.lock:
+                self.cache_hits += 1
+            return dict(cached, hash_level=level)
+
+        headers = {}
+        if usable:
+            if cached["etag"]:
+                headers["If-None-Match"] = cached["etag"]
+            if cached["last_modified"]:
+                headers["If-Modified-Since"] = cached["last_modified"]
+        try:
+            r = self._request(url, headers, level)
+        except requests.exceptions.RequestException as err:
+            LOGGER.debug("{}: {}".format(url, err))
+            return {"url": url, "error": "unreachable ({})".format(type(err).__name__),
+                    "fresh_until": now + ERROR_TTL, "hash_level": level}
+
+        fresh_until = freshness(r.headers, now, self.heuristic_ttl)
+        if r.status_code == 304 and usable:
+            response = dict(cached)
+        else:
+            response = {
+                "url": url,
+                "status": r.status_code,
+                "content_type": r.headers.get("Content-Type"),
+                # the bytes received, if the resource was downloaded
+                "content_length": getattr(r, "received", None) or _content_length(r),
+                "sha256": getattr(r, "sha256", None),
+                "etag": r.headers.get("ETag"),
+                "last_modified": r.headers.get("Last-Modified")
+                }
+        response["checked"] = now
+        response["fresh_until"] = fresh_until if fresh_until is not None else now
+        if fresh_until is not None:
+            self.cache.put(response)
+        response["hash_level"] = level
+        return response
+
+    def _request(self, url, headers, level):
+        with self.lock:
+            self.requests += 1
+        if level == HASH_NONE:
+            r = self.session.head(url, headers=headers, allow_redirects=True)
+            if r.status_code not in HEAD_REFUSED:
+                return r
+            # the first byte only
+            headers = dict(headers, Range="bytes=0-0")
+        r = self.session.get(url, headers=headers, stream=True, allow_redirects=True)
+        try:
+            if level != HASH_NONE and r.status_code == 200:
+                max_size = None if level == HASH_STREAMED else self.max_hash_size
+                length = _content_length(r)
+                if max_size is None or length is None or length <= max_size:
+                    # the chunks are hashed and dropped
+                    sha256 = hashlib.sha256()
+                    size = 0
+                    for chunk in r.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                        if self.bandwidth is not None:
+                            self.bandwidth.acquire(len(chunk))
+                        sha256.update(chunk)
+                        size += len(chunk)
+                        if max_size is not None and size > max_size:
+                            break
+                    else:
+                        r.sha256 = sha256.hexdigest()
+                        r.received = size
+        finally:
+            r.close()
+        return r
+
+    def check_links(self, links):
+        """
+        Check links concurrently; templated links are skipped
+
+        Args:
+            links (list): links of a license or status document
+
+        Returns
+            list: (link, errors, warnings)
+        """
+
+        links = [link for link in links if link.get("href") and not link.get("templated")]
+        if not links:
+            return []
+
+        def check_link(link):
+            stream = self.stream_publication and link.get("rel") == "publication" and \
+                (link.get("hash") or link.get("length") is not None)
+            response = self.check(link["href"], with_hash=bool(link.get("hash")), stream=stream)
+            return (link,) + verify(link, response)
+
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(links))) as pool:
+            return list(pool.map(check_link, links))
+
+    def close(self):
+        self.session.close()
+        self.cache.close()
+
+
+def _content_length(r):
+    """Length of the resource, from Content-Range (partial response) or Content-Length"""
+
+    content_range = r.headers.get("Content-Range")
+    if r.status_code == 206 and content_range and "/" in content_range:
+        total = content_range.rsplit("/", 1)[1]
+        return int(total) if total.isdigit() else None
+    length = r.headers.get("Content-Length")
+    if r.request is not None and r.request.method == "GET" and "Range" in r.request.headers:
+        # a server which ignored the range gives the full length
+        return int(length) if length and length.isdigit() and r.status_code == 200 else None
+    return int(length) if length and length.isdigit() else None
+
+
+# one checker per process and cache: its memory of the checked urls is shared by the suites
+_checkers = {}
+_checkers_lock = threading.Lock()
+
+def get_checker(config):
+    """
+    Link checker of the process
+
+    Args:
+        config (TestConfig): Configuration object
+    """
+
+    key = (config.links.get("cache_path") or os.path.join(config.working_path, "links.sqlite"),
+           tuple(sorted(config.http.items())))
+    with _checkers_lock:
+        if key not in _checkers:
+            _checkers[key] = LinkChecker(config)
+        return _checkers[key]
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+
+"""
+Streaming parser of License Status Documents
+
+The status document of a license used for a long time holds a long list of events.
+The document is parsed incrementally from the response: the events are passed
+one at a time to a callback and are not kept, the other members are returned.
+The memory used does not depend on the number of events.
+
+Copyright 2017 European Digital Reading Lab. All rights reserved.
+Licensed to the Readium Foundation under one or more contributor license agreements.
+Use of this source code is governed by a BSD-style license
+that can be found in the LICENSE file exposed on Github (readium) in the project repository.
+"""
+
+import codecs
+import collections
+import functools
+import json
+import re
+
+import jsonschema
+
+# size of the chunks read from the response
+CHUNK_SIZE = 65536
+
+# size above which a value which cannot be parsed is not completed by more data
+MAX_VALUE_SIZE = 1 << 24
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_NUMBER_CHARS = '0123456789.eE+-'
+
+_DECODER = json.JSONDecoder()
+
+
+class _Reader:
+    """Buffer over a stream of utf-8 chunks, the consumed text is dropped"""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        # returns False if the end of the stream was already reached
+        if self.eof:
+            return False
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            self.eof = True
+            text = self.decoder.decode(b'', final=True)
+        else:
+            text = self.decoder.decode(chunk)
+        self.buffer = self.buffer[self.pos:] + text
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Next non whitespace character, '' at the end of the stream"""
+
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer) or not self._fill():
+                return self.buffer[self.pos:self.pos + 1]
+
+    def expect(self, chars):
+        """Consume the next character, which must be one of chars"""
+
+        c = self.peek()
+        if not c or c not in chars:
+            raise ValueError("Expecting one of '{}', found '{}'".format(chars, c))
+        self.pos += 1
+        return c
+
+    def value(self):
+        """Parse the next json value"""
+
+        self.peek()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self.buffer, self.pos)
+                # a number is complete only when it is followed by another character
+                if self.eof or (end < len(self.buffer) and self.buffer[end] not in _NUMBER_CHARS):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof or len(self.buffer) - self.pos > MAX_VALUE_SIZE:
+                    raise
+            self._fill()
+
+
+def parse(chunks, on_event):
+    """
+    Parse a status document
+
+    Args:
+        chunks: iterable of bytes, e.g. the iter_content() of a response
+        on_event: function called with every event of the document
+
+    Returns
+        dict: the status document, without its events
+
+    Raises
+        ValueError if the document is not valid json
+    """
+
+    reader = _Reader(chunks)
+    reader.expect('{')
+    document = {}
+    if reader.peek() == '}':
+        reader.expect('}')
+    else:
+        while True:
+            key = reader.value()
+            if not isinstance(key, str):
+                raise ValueError("Expecting a property name")
+            reader.expect(':')
+            if key == 'events' and reader.peek() == '[':
+                reader.expect('[')
+                if reader.peek() == ']':
+                    reader.expect(']')
+                else:
+                    while True:
+                        on_event(reader.value())
+                        if reader.expect(',]') == ']':
+                            break
+            else:
+                document[key] = reader.value()
+            if reader.expect(',}') == '}':
+                break
+    if reader.peek():
+        raise ValueError("Extra data after the status document")
+    return document
+
+
+@functools.lru_cache(maxsize=None)
+def event_validator(schema_path):
+    # validator of a single event, built from the status document schema
+    with open(schema_path, 'r', encoding='utf8') as schema_file:
+        json_schema = json.load(schema_file)
+    event_schema = {
+        "definitions": json_schema.get("definitions", {}),
+        "$ref": "#/definitions/eventObject"
+        }
+    validator_class = jsonschema.validators.validator_for(json_schema)
+    return validator_class(event_schema, format_checker=jsonschema.FormatChecker())
+
+
+class EventSummary:
+    """Statistics of the events of a status document, built one event at a time"""
+
+    def __init__(self, validator=None):
+        """
+        Args:
+            validator: json schema validator of an event, or None
+        """
+
+        self.validator = validator
+        self.count = 0
+        self.types = collections.Counter()
+        # one entry per registered device, not per event
+        self.devices = set()
+        self.first = None
+        self.last = None
+        self.errors = 0
+        self.first_error = None
+
+    def add(self, event):
+        self.count += 1
+        if self.validator is not None:
+            error = jsonschema.exceptions.best_match(self.validator.iter_errors(event))
+            if error is not None:
+                self.errors += 1
+                if self.first_error is None:
+                    self.first_error = "event {}: {}".format(self.count, error.message)
+        if not isinstance(event, dict):
+            return
+        self.types[event.get('type')] += 1
+        if event.get('id') is not None:
+            self.devices.add(event['id'])
+        timestamp = event.get('timestamp')
+        if isinstance(timestamp, str):
+            if self.first is None or timestamp < self.first:
+                self.first = timestamp
+            if self.last is None or timestamp > self.last:
+                self.last = timestamp
+
+    def report(self):
+        """
+        Returns
+            dict: event count, count per type, device count and time span of the events
+        """
+
+        return {
+            "events": self.count,
+            "types": dict(self.types),
+            "devices": len(self.devices),
+            "first": self.first,
+            "last": self.last,
+            "invalid": self.errors
+            }
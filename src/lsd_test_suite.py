@@ -21,7 +21,10 @@ import datetime, time
 import dateutil.parser
 import requests
 import jsonschema
+import http_client
 import re
+import lsd_stream
+import util
 from exception import TestSuiteRunningError
 from base_test_suite import BaseTestSuite
 
@@ -29,6 +32,9 @@ LOGGER = logging.getLogger(__name__)
 
 DEFAULT_DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S+00:00"
 
+# statistics of the latency budgets, in milliseconds; a budget given as a number is a p95
+LATENCY_STATISTICS = ("mean", "p50", "p90", "p95", "p99", "max")
+
 
 
 class LSDTestSuite(BaseTestSuite):
@@ -50,6 +56,16 @@ class LSDTestSuite(BaseTestSuite):
         # License Status Document
         self.lsd = None
 
+        # streaming mode: the events of the status document are summarized, not kept
+        self.streaming = config.lsd_server_streaming
+        self.events = None
+
+        # http session
+        self.http = None
+
+        # operation -> response times of its calls, in seconds
+        self.latencies = {}
+
         # test device id and name
         self.device_id = 0
         self.device_name = ""
@@ -68,6 +84,16 @@ class LSDTestSuite(BaseTestSuite):
         self.device_id = 12345
         self.device_name = "EDRLab testing tools"
 
+        # the requests to the servers follow the limits of the configuration
+        self.http = http_client.session(self.config)
+
+    def finalize(self):
+        """Close the connections to the servers"""
+
+        if self.http is not None:
+            self.http.close()
+            self.http = None
+
 
     def _extract_lsd_url(self, lcpl):
         """
@@ -95,6 +121,35 @@ class LSDTestSuite(BaseTestSuite):
         # No status link found
         return None
 
+    def _read_lsd(self, r):
+        """
+        Parse the License Status Document returned in a response.
+        In streaming mode, the events are validated and summarized while the response is read.
+        A network error while the body is read fails the test.
+        """
+        try:
+            if self.streaming:
+                self.events = lsd_stream.EventSummary(lsd_stream.event_validator(self.config.status_schema_path))
+                self.lsd = lsd_stream.parse(r.iter_content(chunk_size=lsd_stream.CHUNK_SIZE), self.events.add)
+            else:
+                self.lsd = r.json()
+        except ValueError as err:
+            if not self.streaming:
+                LOGGER.debug(r.text)
+            raise TestSuiteRunningError("Malformed JSON License Status Document")
+        except requests.exceptions.RequestException as err:
+            # a truncated or reset response, when the body is read
+            raise TestSuiteRunningError("Impossible to read the License Status Document: {}".format(err))
+
+    def _record_latency(self, operation, r):
+        """
+        Record the response time of a successful call: the time until the response headers are received,
+        without the waits for the limits of the http section; the error responses are not measured
+        """
+        if not r.ok:
+            return
+        self.latencies.setdefault(operation, []).append(r.elapsed.total_seconds())
+
     def _check_datetime_updated(self, field, date_time):
         """
         Check the date related to the status or license update: 
@@ -122,19 +177,16 @@ class LSDTestSuite(BaseTestSuite):
             raise TestSuiteRunningError("No status document url found in the license")  
       
         try:
-            r = requests.get(lsd_url)
+            r = self.http.get(lsd_url, stream=self.streaming)
+            self._record_latency("fetch_lsd", r)
             if r.status_code != requests.codes.ok:
                 raise TestSuiteRunningError(
                     "Impossible to fetch the License Status Document at {}: error {}".format(
                         lsd_url, r.status_code)
                     )
+            self._read_lsd(r)
         except requests.exceptions.RequestException as err:
             raise TestSuiteRunningError(err)
-        try:
-            self.lsd = r.json()            
-        except ValueError as err:
-            LOGGER.debug(r.text)
-            raise TestSuiteRunningError("Malformed JSON License Status Document")
 
         LOGGER.debug("The License Status Document is available")  
         #LOGGER.debug(self.lsd)   
@@ -161,7 +213,13 @@ class LSDTestSuite(BaseTestSuite):
             LOGGER.info("The potential rights datetime is: %s", self.lsd['potential_rights']['end'])   
         else:
             LOGGER.info("No potential rights datetime in the status document")  
-        if 'events' in self.lsd:
+        if self.events is not None:
+            # streaming mode: the events were validated while the document was read
+            LOGGER.info("Events: {}".format(self.events.report()))
+            if self.events.errors:
+                raise TestSuiteRunningError("{} invalid events in the status document, {}".format(
+                    self.events.errors, self.events.first_error))
+        elif 'events' in self.lsd:
             for event in self.lsd['events']:
                 LOGGER.info("Event: type {}, timestamp {}, id {}, name {}".format(
                     event['type'], 
@@ -243,7 +301,8 @@ class LSDTestSuite(BaseTestSuite):
 
         # fetch the license
         try:
-            r = requests.get(license_url)
+            r = self.http.get(license_url)
+            self._record_latency("fetch_license", r)
             if r.status_code != requests.codes.ok:
                 raise TestSuiteRunningError(
                     "Impossible to fetch the License  at {}: error {}".format(
@@ -314,12 +373,13 @@ class LSDTestSuite(BaseTestSuite):
 
         # if we want to check that a register with no id and name fails
         if noname:
-            r = requests.post(register_url)
+            r = self.http.post(register_url, stream=self.streaming)
         else:
             # id and name are required in the LSD spec
             q = {"id": self.device_id, "name": self.device_name}
             # register the device for the current license
-            r = requests.post(register_url, params=q)
+            r = self.http.post(register_url, params=q, stream=self.streaming)
+            self._record_latency("register", r)
 
         # check the return code vs the license status
         if r.status_code != requests.codes.ok:
@@ -338,11 +398,7 @@ class LSDTestSuite(BaseTestSuite):
                 )
         # if the register operation succeeds, 
         # the server MUST return an updated License Status Document
-        try:
-            self.lsd = r.json()            
-        except ValueError as err:
-            LOGGER.debug(r.text)
-            raise TestSuiteRunningError("Malformed JSON License Status Document")
+        self._read_lsd(r)
         return True
 
     def test_register(self):
@@ -415,7 +471,8 @@ class LSDTestSuite(BaseTestSuite):
 
         # id and name are not required by the LSD spec, but let's add them
         q = {"id": self.device_id, "name": self.device_name, "end": end}
-        r = requests.put(renew_url, params=q)
+        r = self.http.put(renew_url, params=q, stream=self.streaming)
+        self._record_latency("renew", r)
 
         # check the return code vs the license status
         license_status = self.lsd['status']
@@ -433,11 +490,7 @@ class LSDTestSuite(BaseTestSuite):
 
         # if the renew operation succeeds, 
         # the server MUST return an updated License Status Document         
-        try:
-            self.lsd = r.json()         
-        except ValueError as err:
-            LOGGER.debug(r.text)
-            raise TestSuiteRunningError("Malformed JSON License Status Document")
+        self._read_lsd(r)
         return True
 
 
@@ -484,7 +537,8 @@ class LSDTestSuite(BaseTestSuite):
 
         # id and name are not required by the LSD spec, but let's add them
         q = {"id": self.device_id, "name": self.device_name}
-        r = requests.put(return_url, params=q)
+        r = self.http.put(return_url, params=q, stream=self.streaming)
+        self._record_latency("return", r)
 
         # check the return code vs the license status
         license_status = self.lsd['status']
@@ -503,11 +557,7 @@ class LSDTestSuite(BaseTestSuite):
 
         # if the return operation succeeds, 
         # the server MUST return an updated License Status Document
-        try:
-            self.lsd = r.json()            
-        except ValueError as err:
-            LOGGER.debug(r.text)
-            raise TestSuiteRunningError("Malformed JSON License Status Document")
+        self._read_lsd(r)
 
         # check the the new lsd structure is valid
         self.test_validate_lsd()
@@ -529,6 +579,59 @@ class LSDTestSuite(BaseTestSuite):
          
         return
 
+    def test_latency(self):
+        """ Check the response times against the budgets of the configuration.
+            The fetch operations are repeated until they have enough samples;
+            the others (register, renew, return) change the license, only their calls are measured.
+        """
+        latency = self.config.lsd_server_latency
+        budgets = latency.get('budgets') or {}
+        if not budgets:
+            LOGGER.info("No latency budgets in the configuration")
+            return
+        repeat = latency.get('repeat', 10)
+
+        urls = {"fetch_lsd": self._extract_lsd_url(self.lcpl)}
+        license = next((l for l in self.lsd['links'] if l['rel'] == 'license'), None)
+        if license is not None:
+            urls["fetch_license"] = license['href']
+        try:
+            for operation, url in urls.items():
+                if operation not in budgets or url is None:
+                    continue
+                while len(self.latencies.get(operation, [])) < repeat:
+                    with self.http.get(url) as r:
+                        if r.status_code != requests.codes.ok:
+                            raise TestSuiteRunningError("{} answered error {} while its latency was measured".format(
+                                url, r.status_code))
+                        self._record_latency(operation, r)
+        except requests.exceptions.RequestException as err:
+            raise TestSuiteRunningError(err)
+
+        exceeded = []
+        for operation, budget in budgets.items():
+            if not isinstance(budget, dict):
+                budget = {"p95": budget}
+            summary = util.latency_summary(self.latencies.get(operation, []))
+            if not summary["count"]:
+                LOGGER.warning("No {} call measured, its latency budget is not checked".format(operation))
+                continue
+            LOGGER.info("{} latency (ms): {}".format(operation, summary))
+            for statistic, limit in budget.items():
+                if statistic not in LATENCY_STATISTICS:
+                    raise TestSuiteRunningError("Unknown latency statistic {} for {}, use one of {}".format(
+                        statistic, operation, ", ".join(LATENCY_STATISTICS)))
+                if summary[statistic] > limit:
+                    exceeded.append("{} {} {} ms > {} ms over {} calls (p50 {}, p95 {}, p99 {}, max {})".format(
+                        operation, statistic, summary[statistic], limit, summary["count"],
+                        summary["p50"], summary["p95"], summary["p99"], summary["max"]))
+
+        if exceeded:
+            if latency.get('fail', True):
+                raise TestSuiteRunningError("Latency budgets exceeded: {}".format("; ".join(exceeded)))
+            for message in exceeded:
+                LOGGER.warning("Latency budget exceeded: {}".format(message))
+
     def get_tests(self):
         """
         Names of tests to run
@@ -549,5 +652,6 @@ class LSDTestSuite(BaseTestSuite):
             "rights",
             "return",
             "fetch_license",
-            "rights"
+            "rights",
+            "latency"
             ]
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+"""
+Memory profiling of the test suites (--profile-memory)
+
+When profiling is on, every step of a suite (initialization and tests) is measured:
+    - the peak of the memory allocated by Python during the step (tracemalloc)
+    - the memory still allocated at the end of the step, and the top allocation sites of this memory
+    - the variation of the resident set size: it includes the memory allocated by C libraries
+      (libxml2 trees of lxml, OpenSSL ...), which tracemalloc does not see
+The peak resident set size of the process is reported as well.
+
+Copyright 2017 European Digital Reading Lab. All rights reserved.
+Licensed to the Readium Foundation under one or more contributor license agreements.
+Use of this source code is governed by a BSD-style license
+that can be found in the LICENSE file exposed on Github (readium) in the project repository.
+"""
+
+import os
+import sys
+import tracemalloc
+
+# number of allocation sites reported per step, None if profiling is off
+_top = None
+
+# allocations of the profiler and of the import machinery are not reported
+_IGNORED = (tracemalloc.__file__, __file__, "<unknown>")
+_IGNORED_PREFIX = "<frozen importlib."
+
+
+def start(top=5):
+    """
+    Turn profiling on
+
+    Args:
+        top (int): number of allocation sites reported per step; 0 measures the memory only,
+            without the cost of the snapshots of the allocations
+    """
+
+    global _top
+    _top = top
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+def active():
+    return _top is not None and tracemalloc.is_tracing()
+
+
+def peak_rss():
+    """
+    Returns
+        int: peak resident set size of the process in KiB, None if unknown
+    """
+
+    try:
+        import resource
+    except ImportError:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KiB elsewhere
+    return maxrss // 1024 if sys.platform == 'darwin' else maxrss
+
+def current_rss():
+    """
+    Returns
+        int: resident set size of the process in KiB, None if unknown
+    """
+
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class Probe:
+    """Memory used by a step"""
+
+    def __init__(self):
+        self.snapshot = tracemalloc.take_snapshot() if _top else None
+        self.rss = current_rss()
+        tracemalloc.reset_peak()
+        self.size = tracemalloc.get_traced_memory()[0]
+
+    def stop(self):
+        """
+        Returns
+            dict: peak and retained memory, variation of the RSS (KiB), top allocation sites of the retained memory
+        """
+
+        size, peak = tracemalloc.get_traced_memory()
+        rss = current_rss()
+        top = []
+        if self.snapshot is not None:
+            snapshot, self.snapshot = self.snapshot, None
+            stats = tracemalloc.take_snapshot().compare_to(snapshot, 'lineno')
+            for stat in sorted(stats, key=lambda stat: stat.size_diff, reverse=True):
+                if len(top) >= _top or stat.size_diff <= 0:
+                    break
+                frame = stat.traceback[0]
+                if frame.filename in _IGNORED or frame.filename.startswith(_IGNORED_PREFIX):
+                    continue
+                top.append({
+                    "site": "{}:{}".format(frame.filename, frame.lineno),
+                    "size_kib": round(stat.size_diff / 1024, 1),
+                    "count": stat.count_diff
+                    })
+        return {
+            "peak_kib": round((peak - self.size) / 1024, 1),
+            "retained_kib": round((size - self.size) / 1024, 1),
+            "rss_delta_kib": rss - self.rss if rss is not None and self.rss is not None else None,
+            "top": top
+            }
+
+def probe():
+    """
+    Returns
+        a Probe started now, or None if profiling is off
+    """
+
+    return Probe() if active() else None
+
+
+def print_report(report):
+    """Display the memory used by the steps of a suite (see BaseTestSuite.report)"""
+
+    print("Memory profile of {}, peak RSS {} KiB".format(report["suite"], peak_rss()))
+    steps = [("initialize", report.get("memory"))] + [(result["test"], result.get("memory")) for result in report["tests"]]
+    for step, memory in steps:
+        if memory is None:
+            continue
+        print("  {:<24} peak {:>9} KiB  retained {:>9} KiB  rss {:>+7} KiB".format(
+            step, memory["peak_kib"], memory["retained_kib"], memory["rss_delta_kib"] or 0))
+        for site in memory["top"]:
+            print("      {:>9} KiB {:>6} blocks  {}".format(site["size_kib"], site["count"], site["site"]))
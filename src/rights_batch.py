@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+
+"""
+Rights of many licenses evaluated at once, with NumPy
+
+The rights come as arrays: start and end dates (datetime64, NaT when absent), print and copy
+rights (-1 when absent, i.e. unlimited), as written by the export command.
+The status of a license at an instant follows LCPLicense.check_dates: not yet valid before its start,
+expired after its end, active otherwise. A sweep over many instants sorts the dates once,
+then counts the licenses of every status with binary searches.
+
+The forecast command reads a columnar export and counts the licenses of every status over a period,
+and the expirations per provider:
+
+    lcpcheck forecast licenses.parquet --from 2024-06-01 --days 30 --by provider
+
+Copyright 2017 European Digital Reading Lab. All rights reserved.
+Licensed to the Readium Foundation under one or more contributor license agreements.
+Use of this source code is governed by a BSD-style license
+that can be found in the LICENSE file exposed on Github (readium) in the project repository.
+"""
+
+import argparse
+import collections
+import json
+import logging
+import os
+import time
+
+import util
+
+LOGGER = logging.getLogger(__name__)
+
+RightsStatus = collections.namedtuple("RightsStatus", ["not_yet_valid", "active", "expired"])
+
+# unit of the dates
+DATE_UNIT = "datetime64[s]"
+
+
+class RightsBatch:
+    """Rights of a set of licenses"""
+
+    def __init__(self, start, end, print_rights=None, copy_rights=None):
+        """
+        Args:
+            start, end: arrays of dates, NaT when the license has no start or end
+            print_rights, copy_rights: arrays of integers, -1 when unlimited
+        """
+
+        import numpy as np
+        self.np = np
+        self.start = np.asarray(start).astype(DATE_UNIT)
+        self.end = np.asarray(end).astype(DATE_UNIT)
+        self.size = len(self.start)
+        self.print_rights = np.full(self.size, -1) if print_rights is None else np.asarray(print_rights)
+        self.copy_rights = np.full(self.size, -1) if copy_rights is None else np.asarray(copy_rights)
+        # sorted dates of the licenses which have them, for the sweeps
+        self._sorted_start = None
+        self._sorted_end = None
+        # start and end of the licenses ending before they start
+        self._inverted = None
+
+    @classmethod
+    def from_columns(cls, columns):
+        """Rights from the columns of an export (see lcpexport)"""
+
+        return cls(columns["rights_start"], columns["rights_end"], columns["rights_print"], columns["rights_copy"])
+
+    def _instant(self, instant):
+        np = self.np
+        if isinstance(instant, str):
+            # numpy reads naive dates only
+            instant = instant.rstrip("Z")
+        return np.datetime64(instant, "s")
+
+    def status(self, instant):
+        """
+        Status of every license at an instant (datetime64, naive UTC datetime or ISO 8601 string)
+
+        Returns
+            RightsStatus: boolean masks not_yet_valid, active, expired
+        """
+
+        instant = self._instant(instant)
+        # comparisons with NaT are false: no start, never too early; no end, never expired
+        not_yet_valid = self.start > instant
+        expired = (self.end < instant) & ~not_yet_valid
+        return RightsStatus(not_yet_valid, ~(not_yet_valid | expired), expired)
+
+    def _prepare_sweep(self):
+        if self._sorted_start is not None:
+            return
+        np = self.np
+        self._sorted_start = np.sort(self.start[~np.isnat(self.start)])
+        self._sorted_end = np.sort(self.end[~np.isnat(self.end)])
+        inverted = self.start > self.end
+        self._inverted = (self.start[inverted], self.end[inverted])
+
+    def sweep(self, instants):
+        """
+        Number of licenses of every status at a series of instants
+
+        Args:
+            instants: array of dates
+
+        Returns
+            RightsStatus: arrays of counts, one per instant
+        """
+
+        np = self.np
+        self._prepare_sweep()
+        instants = np.asarray(instants).astype(DATE_UNIT)
+        not_yet_valid = len(self._sorted_start) - np.searchsorted(self._sorted_start, instants, side="right")
+        ended = np.searchsorted(self._sorted_end, instants, side="left")
+        # a license ending before it starts is not yet valid, not expired, between its end and its start
+        inverted_start, inverted_end = self._inverted
+        both = ((inverted_start[None, :] > instants[:, None]) &
+                (inverted_end[None, :] < instants[:, None])).sum(axis=1)
+        expired = ended - both
+        return RightsStatus(not_yet_valid, self.size - not_yet_valid - expired, expired)
+
+    def expiring(self, since, until):
+        """
+        Returns
+            mask of the licenses active at since and expired at until
+        """
+
+        since, until = self._instant(since), self._instant(until)
+        return self.status(since).active & (self.end < until)
+
+    def can_print(self, pages=1):
+        """Mask of the licenses allowing to print this number of pages"""
+
+        return (self.print_rights < 0) | (self.print_rights >= pages)
+
+    def can_copy(self, characters=1):
+        """Mask of the licenses allowing to copy this number of characters"""
+
+        return (self.copy_rights < 0) | (self.copy_rights >= characters)
+
+
+def read_columns(path, names):
+    """
+    Columns of an export file (.npz or .parquet) as NumPy arrays: dates as datetime64[s], NaT when absent,
+    integers with -1 when absent
+
+    Raises
+        KeyError if a column is not in the file
+    """
+
+    import numpy as np
+    if path.lower().endswith(".npz"):
+        with np.load(path) as archive:
+            for name in names:
+                if name not in archive.files:
+                    raise KeyError(name)
+            return {name: archive[name] for name in names}
+
+    import pyarrow
+    import pyarrow.compute
+    import pyarrow.parquet
+    available = pyarrow.parquet.read_schema(path).names
+    for name in names:
+        if name not in available:
+            raise KeyError(name)
+    table = pyarrow.parquet.read_table(path, columns=list(names))
+    columns = {}
+    for name in names:
+        column = table.column(name)
+        if pyarrow.types.is_timestamp(column.type):
+            column = column.cast(pyarrow.timestamp("s"))
+            columns[name] = column.to_numpy().astype(DATE_UNIT)
+        elif pyarrow.types.is_integer(column.type):
+            columns[name] = pyarrow.compute.fill_null(column, -1).to_numpy()
+        else:
+            columns[name] = np.asarray(pyarrow.compute.fill_null(column, "").to_numpy(zero_copy_only=False), dtype=str)
+    return columns
+
+
+def forecast(rights, start, days, step_days=1, groups=None):
+    """
+    Status counts and expirations over a period
+
+    Args:
+        rights (RightsBatch): rights of the licenses
+        start: first instant
+        days (int): length of the period
+        groups: array of group names (e.g. the providers), for the expirations per group
+
+    Returns
+        dict: instants, counts of every status, and expirations between two instants (per group)
+    """
+
+    np = rights.np
+    start = rights._instant(start)
+    instants = start + np.arange(0, days + 1, step_days).astype("timedelta64[D]").astype("timedelta64[s]")
+    counts = rights.sweep(instants)
+    result = {
+        "licenses": rights.size,
+        "instants": [str(instant) for instant in instants],
+        "not_yet_valid": counts.not_yet_valid.tolist(),
+        "active": counts.active.tolist(),
+        "expired": counts.expired.tolist(),
+        "expiring": np.diff(counts.expired).tolist()
+        }
+    if groups is not None:
+        mask = rights.expiring(instants[0], instants[-1])
+        names, totals = np.unique(groups[mask], return_counts=True)
+        result["expiring_by_group"] = {str(name): int(total) for name, total in zip(names, totals)}
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="lcpcheck forecast")
+    parser.add_argument("-v", "--verbosity", action="count", help="increase output verbosity")
+    parser.add_argument("export", help="columnar export of the licenses (.parquet or .npz, see lcpcheck export)")
+    parser.add_argument("--from", dest="start", help="first day of the forecast, ISO 8601 (default: now)")
+    parser.add_argument("--days", type=int, default=7, help="length of the forecast in days (default 7)")
+    parser.add_argument("--step", type=int, default=1, help="days between two instants (default 1)")
+    parser.add_argument("--by", help="count the expirations per value of this column, e.g. provider")
+    parser.add_argument("--json", action="store_true", help="print the forecast as json")
+    args = parser.parse_args(argv)
+
+    util.init_logger(args.verbosity)
+
+    if not os.path.exists(args.export):
+        LOGGER.error("Export {} not found".format(args.export))
+        return 1
+    names = ["rights_start", "rights_end", "rights_print", "rights_copy", "error"] + ([args.by] if args.by else [])
+    try:
+        columns = read_columns(args.export, names)
+    except ImportError as err:
+        LOGGER.error("The forecast requires {}: pip3 install {}".format(err.name, err.name))
+        return 1
+    except KeyError as err:
+        LOGGER.error("No column {} in {}".format(err, args.export))
+        return 1
+
+    import numpy as np
+    # the licenses which could not be read have no rights
+    readable = columns["error"] == ""
+    if not readable.all():
+        LOGGER.warning("{} unreadable licenses ignored".format(int((~readable).sum())))
+        columns = {name: column[readable] for name, column in columns.items()}
+    rights = RightsBatch.from_columns(columns)
+    start = args.start or np.datetime64("now", "s")
+    begin = time.perf_counter()
+    result = forecast(rights, start, args.days, args.step, columns.get(args.by))
+    result["duration_ms"] = round((time.perf_counter() - begin) * 1000, 3)
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return 0
+    print("{} licenses, forecast computed in {} ms".format(result["licenses"], result["duration_ms"]))
+    print("{:<20} {:>12} {:>12} {:>12}".format("instant", "not yet", "active", "expired"))
+    for instant, not_yet_valid, active, expired in zip(
+            result["instants"], result["not_yet_valid"], result["active"], result["expired"]):
+        print("{:<20} {:>12} {:>12} {:>12}".format(instant, not_yet_valid, active, expired))
+    if "expiring_by_group" in result:
+        print("expiring by {}:".format(args.by))
+        for name, total in sorted(result["expiring_by_group"].items(), key=lambda item: -item[1]):
+            print("  {:<40} {:>12}".format(name or "-", total))
+    return 0
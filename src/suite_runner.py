@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+"""
+Run the test suites on a license or a protected publication and collect their reports,
+for the tools which check many files in a row (service mode, batch mode ...).
+
+Copyright 2017 European Digital Reading Lab. All rights reserved.
+Licensed to the Readium Foundation under one or more contributor license agreements.
+Use of this source code is governed by a BSD-style license
+that can be found in the LICENSE file exposed on Github (readium) in the project repository.
+"""
+
+import logging
+import shutil
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+
+def check_license(config, license_path):
+    """
+    Check an LCP license
+
+    Returns
+        dict: global result, duration and reports of the suites
+    """
+
+    from lcpl_test_suite import LCPLTestSuite
+
+    start = time.perf_counter()
+    lcpl_test_suite = LCPLTestSuite(config, license_path)
+    lcpl_test_suite.run()
+    return _result([lcpl_test_suite.report()], start)
+
+
+def check_publication(config, file_path, with_license=True, cleanup=False):
+    """
+    Check an LCP protected publication, then the license it embeds
+
+    Args:
+        cleanup (bool): remove the files extracted from the publication once checked
+
+    Returns
+        dict: global result, duration and reports of the suites
+    """
+
+    from lcpf_test_suite import LCPFTestSuite
+
+    start = time.perf_counter()
+    lcpf_test_suite = LCPFTestSuite(config, file_path)
+    try:
+        lcpf_test_suite.run()
+        reports = [lcpf_test_suite.report()]
+        if with_license and reports[0]["passed"]:
+            from lcpl_test_suite import LCPLTestSuite
+
+            lcpl_test_suite = LCPLTestSuite(config, lcpf_test_suite.license_path)
+            lcpl_test_suite.run()
+            reports.append(lcpl_test_suite.report())
+    finally:
+        if cleanup:
+            shutil.rmtree(lcpf_test_suite.target_path, ignore_errors=True)
+    return _result(reports, start)
+
+
+def check_file(config, path):
+    """
+    Check an LCP license (.lcpl) or a protected publication, depending on the file extension.
+    The files extracted from a publication are removed.
+
+    Returns
+        dict: global result, duration and reports of the suites
+    """
+
+    if path.lower().endswith('.lcpl'):
+        return check_license(config, path)
+    return check_publication(config, path, cleanup=True)
+
+
+def _result(reports, start):
+    return {
+        "passed": all(report["passed"] for report in reports),
+        "duration": time.perf_counter() - start,
+        "suites": reports
+        }
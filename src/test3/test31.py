@@ -0,0 +1,48 @@
+import glob
+import os
+import shutil
+import subprocess
+import unittest
+from unittest import TestCase
+
+import jsoncanon
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'canonical')
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class Test31(TestCase):
+  # conformance of the canonical form of licenses with the Java signature verifier.
+  # every NN-name.lcpl of the corpus has an expected NN-name.canonical, 
+  # or must be rejected if there is none.
+
+  def corpus(self):
+    for license_path in sorted(glob.glob(os.path.join(CORPUS, '*.lcpl'))):
+      expected_path = license_path[:-len('.lcpl')] + '.canonical'
+      expected = None
+      if os.path.exists(expected_path):
+        with open(expected_path, 'rb') as expected_file:
+          expected = expected_file.read()
+      yield license_path, expected
+
+  def test_a_expected_canonical_form(self):
+    for license_path, expected in self.corpus():
+      with self.subTest(license=os.path.basename(license_path)):
+        with open(license_path, 'rb') as license_file:
+          data = license_file.read()
+        if expected is None:
+          self.assertRaises(jsoncanon.CanonicalizationError, jsoncanon.canonicalize, data)
+        else:
+          self.assertEqual(expected, jsoncanon.canonicalize(data))
+
+  @unittest.skipUnless(shutil.which('java') and shutil.which('javac'), "java is not available")
+  def test_b_java_canonical_form(self):
+    run_script = 'SignatureVerifier_Java/run-from-py.sh' if os.name == 'posix' else 'SignatureVerifier_Java/run-from-py.bat'
+    for license_path, expected in self.corpus():
+      with self.subTest(license=os.path.basename(license_path)):
+        r = subprocess.run([os.path.join(ROOT, run_script), 'canonical', license_path],
+          stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, cwd=ROOT)
+        if expected is None:
+          self.assertNotEqual(0, r.returncode)
+        else:
+          self.assertEqual(0, r.returncode)
+          self.assertEqual(expected, r.stdout)
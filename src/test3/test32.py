@@ -0,0 +1,104 @@
+import base64
+import datetime
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import jsoncanon
+from exception import LCPLicenseError
+from lcp_license import LCPLicense, RSA_SHA256, ECDSA_SHA256
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'canonical')
+
+class Test32(TestCase):
+  # signature check of licenses over their canonical form, with a root and provider certificate
+  # generated for the test, for both signature algorithms
+
+  def setUp(self):
+    self.folder = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.folder)
+
+  def certificates(self, key_type):
+    from cryptography import x509
+    from cryptography.x509.oid import NameOID
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec, rsa
+
+    def new_key():
+      return ec.generate_private_key(ec.SECP256R1()) if key_type == 'ec' else rsa.generate_private_key(65537, 2048)
+
+    def certificate(name, key, issuer_name, issuer_key, ca):
+      now = datetime.datetime.now(datetime.timezone.utc)
+      return (x509.CertificateBuilder()
+        .subject_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, name)]))
+        .issuer_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, issuer_name)]))
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=365))
+        .add_extension(x509.BasicConstraints(ca=ca, path_length=None), critical=True)
+        .sign(issuer_key, hashes.SHA256()))
+
+    root_key, provider_key = new_key(), new_key()
+    root = certificate("test root", root_key, "test root", root_key, True)
+    provider = certificate("test provider", provider_key, "test root", root_key, False)
+    cacert_path = os.path.join(self.folder, 'cacert-{}.pem'.format(key_type))
+    with open(cacert_path, 'wb') as cert_file:
+      cert_file.write(root.public_bytes(serialization.Encoding.PEM))
+    return cacert_path, provider_key, provider.public_bytes(serialization.Encoding.DER)
+
+  def signed_license(self, key_type):
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import ec, padding, utils
+
+    cacert_path, provider_key, provider_der = self.certificates(key_type)
+    with open(os.path.join(CORPUS, '01-license.lcpl'), 'rb') as license_file:
+      lcpl = json.loads(license_file.read())
+    data = jsoncanon.canonicalize(json.dumps(lcpl).encode('utf-8'))
+    if key_type == 'ec':
+      r, s = utils.decode_dss_signature(provider_key.sign(data, ec.ECDSA(hashes.SHA256())))
+      value = r.to_bytes(32, 'big') + s.to_bytes(32, 'big')
+      algorithm = ECDSA_SHA256
+    else:
+      value = provider_key.sign(data, padding.PKCS1v15(), hashes.SHA256())
+      algorithm = RSA_SHA256
+    lcpl['signature'] = {
+      "algorithm": algorithm,
+      "certificate": base64.b64encode(provider_der).decode('ascii'),
+      "value": base64.b64encode(value).decode('ascii')
+      }
+    return cacert_path, lcpl
+
+  def check(self, cacert_path, lcpl):
+    license_path = os.path.join(self.folder, 'license.lcpl')
+    with open(license_path, 'w', encoding='utf-8') as license_file:
+      json.dump(lcpl, license_file, indent=2)
+    license = LCPLicense()
+    license.parse(license_path)
+    license.check_signature(cacert_path)
+
+  def test_a_valid_signature(self):
+    for key_type in ('ec', 'rsa'):
+      with self.subTest(key=key_type):
+        self.check(*self.signed_license(key_type))
+
+  def test_b_modified_license(self):
+    for key_type in ('ec', 'rsa'):
+      with self.subTest(key=key_type):
+        cacert_path, lcpl = self.signed_license(key_type)
+        lcpl['rights']['print'] = 1000
+        self.assertRaises(LCPLicenseError, self.check, cacert_path, lcpl)
+
+  def test_c_other_root(self):
+    cacert_path, lcpl = self.signed_license('ec')
+    other_cacert_path, _, _ = self.certificates('rsa')
+    self.assertRaises(LCPLicenseError, self.check, other_cacert_path, lcpl)
+
+  def test_d_algorithm_of_another_key(self):
+    cacert_path, lcpl = self.signed_license('ec')
+    lcpl['signature']['algorithm'] = RSA_SHA256
+    self.assertRaises(LCPLicenseError, self.check, cacert_path, lcpl)
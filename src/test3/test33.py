@@ -0,0 +1,111 @@
+import io
+import os
+import shutil
+import tempfile
+import zipfile
+import zlib
+from unittest import TestCase
+
+import encrypt_cache
+import lcpcrypto
+from epub_encrypt import encrypt_epub, STREAM_THRESHOLD
+from exception import ZipArchiveError
+from zipstream import ZipStreamWriter
+
+CONTAINER = b"""<?xml version="1.0"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/></rootfiles>
+</container>"""
+
+PACKAGE = b"""<?xml version="1.0"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0">
+  <manifest>
+    <item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>
+    <item id="c1" href="chapter1.xhtml" media-type="application/xhtml+xml"/>
+    <item id="c2" href="chapter2.xhtml" media-type="application/xhtml+xml"/>
+    <item id="video" href="video.mp4" media-type="video/mp4"/>
+  </manifest>
+</package>"""
+
+class Test33(TestCase):
+  # round trip of the archives written by ZipStreamWriter and of the EPUB files encrypted with it,
+  # read back by zipfile; the large resources are above the threshold of the encryption by chunks
+
+  def setUp(self):
+    self.folder = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.folder)
+
+  def test_a_entries(self):
+    large = os.urandom(3 << 20)
+    output = io.BytesIO()
+    writer = ZipStreamWriter(output)
+    writer.write_entry('mimetype', b"application/epub+zip")
+    writer.write_entry('deflated.txt', b"text " * 1000, zipfile.ZIP_DEFLATED)
+    writer.write_stored('stored.bin', [large[:1 << 20], large[1 << 20:]], zlib.crc32(large), len(large))
+    writer.write_stream('stream.txt', [b"chunk " * 1000] * 3)
+    writer.close()
+    self.assertEqual(len(output.getvalue()), writer.offset)
+
+    with zipfile.ZipFile(io.BytesIO(output.getvalue())) as archive:
+      self.assertIsNone(archive.testzip())
+      self.assertEqual(b"application/epub+zip", archive.read('mimetype'))
+      self.assertEqual(large, archive.read('stored.bin'))
+      self.assertEqual(b"chunk " * 3000, archive.read('stream.txt'))
+      # no data descriptor after a stored entry
+      for info in archive.infolist():
+        if info.compress_type == zipfile.ZIP_STORED:
+          self.assertFalse(info.flag_bits & 0x08, info.filename)
+
+  def test_b_invalid_entries(self):
+    writer = ZipStreamWriter(io.BytesIO())
+    self.assertRaises(ZipArchiveError, writer.write_stream, 'stream.bin', [b"data"], zipfile.ZIP_STORED)
+    self.assertRaises(ZipArchiveError, writer.write_stored, 'stored.bin', [b"data"], zlib.crc32(b"other"), 4)
+    self.assertRaises(ZipArchiveError, writer.write_stored, 'stored.bin', [b"data"], zlib.crc32(b"data"), 5)
+
+  def epub(self):
+    resources = {
+      'OEBPS/nav.xhtml': b"<html>nav</html>",
+      'OEBPS/chapter1.xhtml': b"<html>small chapter</html>",
+      'OEBPS/chapter2.xhtml': b"<html>" + b"large chapter " * (STREAM_THRESHOLD // 10) + b"</html>",
+      'OEBPS/video.mp4': os.urandom(STREAM_THRESHOLD + 12345)
+      }
+    epub_path = os.path.join(self.folder, 'book.epub')
+    with zipfile.ZipFile(epub_path, 'w') as epub:
+      epub.writestr('mimetype', b"application/epub+zip", zipfile.ZIP_STORED)
+      epub.writestr('META-INF/container.xml', CONTAINER, zipfile.ZIP_DEFLATED)
+      epub.writestr('OEBPS/content.opf', PACKAGE, zipfile.ZIP_DEFLATED)
+      for name, data in resources.items():
+        epub.writestr(name, data, zipfile.ZIP_DEFLATED)
+    return epub_path, resources
+
+  def check_protected(self, path, resources, key):
+    with zipfile.ZipFile(path) as archive:
+      self.assertIsNone(archive.testzip())
+      self.assertEqual(resources['OEBPS/nav.xhtml'], archive.read('OEBPS/nav.xhtml'))
+      for name in ('OEBPS/chapter1.xhtml', 'OEBPS/chapter2.xhtml'):
+        clear = lcpcrypto.decrypt_cbc(archive.read(name), key)
+        self.assertEqual(resources[name], zlib.decompress(clear, -15))
+      self.assertEqual(resources['OEBPS/video.mp4'], lcpcrypto.decrypt_cbc(archive.read('OEBPS/video.mp4'), key))
+      for info in archive.infolist():
+        if info.compress_type == zipfile.ZIP_STORED:
+          self.assertFalse(info.flag_bits & 0x08, info.filename)
+
+  def test_c_encrypted_epub(self):
+    epub_path, resources = self.epub()
+    key = os.urandom(32)
+    output_path = os.path.join(self.folder, 'book.lcp.epub')
+    result = encrypt_epub(epub_path, output_path, 'content', key, jobs=2)
+    self.assertEqual(os.path.getsize(output_path), result["protected-content-length"])
+    self.check_protected(output_path, resources, key)
+
+  def test_d_encrypted_epub_from_cache(self):
+    epub_path, resources = self.epub()
+    key = os.urandom(32)
+    cache = encrypt_cache.EncryptionCache(os.path.join(self.folder, 'cache'))
+    for run in range(2):
+      with self.subTest(run=run):
+        output_path = os.path.join(self.folder, 'book-{}.lcp.epub'.format(run))
+        encrypt_epub(epub_path, output_path, 'content', key, jobs=2, cache=cache)
+        self.check_protected(output_path, resources, key)
@@ -2,11 +2,17 @@ import unittest
 from test1.test11 import Test11
 from test1.test12 import Test12
 from test2.test21 import Test21
+from test3.test31 import Test31
+from test3.test32 import Test32
+from test3.test33 import Test33
 
 
 if __name__ == '__main__':
   test11 = unittest.TestLoader().loadTestsFromTestCase(Test11)
   test12 = unittest.TestLoader().loadTestsFromTestCase(Test12)
   test21 = unittest.TestLoader().loadTestsFromTestCase(Test21)
-  alltests = unittest.TestSuite([test11, test12, test21])
+  test31 = unittest.TestLoader().loadTestsFromTestCase(Test31)
+  test32 = unittest.TestLoader().loadTestsFromTestCase(Test32)
+  test33 = unittest.TestLoader().loadTestsFromTestCase(Test33)
+  alltests = unittest.TestSuite([test11, test12, test21, test31, test32, test33])
   unittest.TextTestRunner(verbosity=2).run(alltests)
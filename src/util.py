@@ -4,7 +4,9 @@
 Utilities
 """
 
+import math
 import subprocess
+import sys
 import os.path
 import logging
 
@@ -50,3 +52,77 @@ def execute_command(cmd, cwd=None):
     stdout, stderr = process.communicate()
     return process.returncode, stdout, stderr
 
+
+
+
+def percentile(sorted_values, pct):
+    """
+    Nearest-rank percentile of a sorted list of values
+
+    Returns
+        the value, or None if the list is empty
+    """
+
+    if not sorted_values:
+        return None
+    rank = max(int(math.ceil(pct / 100.0 * len(sorted_values))), 1)
+    return sorted_values[rank - 1]
+
+
+def latency_summary(durations):
+    """
+    Summarize a list of durations (in seconds)
+
+    Returns
+        dict: count, mean, p50, p90, p95, p99 and max, in milliseconds
+    """
+
+    values = sorted(durations)
+    summary = {"count": len(values)}
+    if not values:
+        return summary
+    summary["mean"] = round(sum(values) * 1000 / len(values), 3)
+    for pct in (50, 90, 95, 99):
+        summary["p{}".format(pct)] = round(percentile(values, pct) * 1000, 3)
+    summary["max"] = round(values[-1] * 1000, 3)
+    return summary
+
+
+def startup_profile(script_path, argv, limit=20):
+    """
+    Run a python script with -X importtime and report the import time breakdown
+
+    The other messages written on stderr by the script are passed through.
+
+    Returns
+        int: return code of the script
+    """
+
+    cmd = [sys.executable, '-X', 'importtime', script_path] + argv
+    process = subprocess.run(cmd, stderr=subprocess.PIPE, universal_newlines=True)
+
+    # import time: self [us] | cumulative | imported package
+    imports = []
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:"):
+            sys.stderr.write(line + "\n")
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            # header line
+            continue
+        package = fields[2].rstrip()
+        # nested imports are indented; keep the top level ones only
+        if package.startswith("  "):
+            continue
+        imports.append((int(fields[1]), int(fields[0]), package.strip()))
+
+    total = sum(cumulative for cumulative, _, _ in imports)
+    imports.sort(reverse=True)
+
+    print("\nImport time: {:.1f} ms in total".format(total / 1000))
+    print("{:>12} {:>12}  {}".format("cumul. (ms)", "self (ms)", "package"))
+    for cumulative, self_time, package in imports[:limit]:
+        print("{:>12.1f} {:>12.1f}  {}".format(cumulative / 1000, self_time / 1000, package))
+
+    return process.returncode
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+
+"""
+Zip archive written sequentially, with no seek and no temporary file:
+the output can be a file, a pipe, a socket or any object with a write() method.
+
+Four kinds of entries:
+    - write_entry: data in memory, its sizes and CRC are in the local header
+    - write_raw: data copied as stored in another archive (still compressed), with its CRC
+    - write_stored: data written as its chunks come, stored, with its size and CRC known beforehand
+      (the caller computes them in a first pass)
+    - write_stream: data deflated as its chunks come; the sizes and CRC follow the data,
+      in a data descriptor (limited to 4 GiB per entry)
+The entries written with write_entry, write_raw and write_stored have no data descriptor and no extra
+field (below 4 GiB): the mimetype entry of an EPUB file keeps the layout required by the OCF container.
+A stored entry is never followed by a data descriptor: a reader which does not use the central
+directory (java.util.zip.ZipInputStream) cannot find the end of its data, and rejects it.
+
+The length and the SHA-256 hash of the archive are computed as it is written.
+
+Copyright 2017 European Digital Reading Lab. All rights reserved.
+Licensed to the Readium Foundation under one or more contributor license agreements.
+Use of this source code is governed by a BSD-style license
+that can be found in the LICENSE file exposed on Github (readium) in the project repository.
+"""
+
+import hashlib
+import struct
+import zlib
+
+from exception import ZipArchiveError
+from zipview import (ZIP_STORED, ZIP_DEFLATED, LOCAL_STRUCT, LOCAL_SIGNATURE, CDIR_STRUCT, CDIR_SIGNATURE,
+                     EOCD_STRUCT, EOCD_SIGNATURE, EOCD64_STRUCT, EOCD64_SIGNATURE,
+                     EOCD64_LOCATOR_STRUCT, EOCD64_LOCATOR_SIGNATURE, ZIP64_EXTRA_ID, EXTRA_HEADER_STRUCT)
+
+DESCRIPTOR_STRUCT = struct.Struct("<4s3L")
+DESCRIPTOR_SIGNATURE = b"PK\x07\x08"
+
+ZIP64_LIMIT = 0xFFFFFFFF
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+# version 2.0, 4.5 with zip64 extensions; made by unix
+VERSION = 20
+VERSION_ZIP64 = 45
+MADE_BY_UNIX = 3 << 8
+
+
+def _dos_date_time(date_time):
+    year, month, day, hour, minute, second = date_time[:6]
+    return (max(year - 1980, 0) << 9 | month << 5 | day), (hour << 11 | minute << 5 | second // 2)
+
+
+class _Entry:
+    __slots__ = ("name", "flags", "compress_type", "date_time", "crc", "compress_size", "file_size",
+                 "header_offset", "external_attr")
+
+
+class ZipStreamWriter:
+    """Zip archive written sequentially"""
+
+    def __init__(self, output):
+        """
+        Args:
+            output: writable binary stream
+        """
+
+        self.output = output
+        self.offset = 0
+        self.entries = []
+        self.sha256 = hashlib.sha256()
+        self.closed = False
+
+    def _write(self, data):
+        self.output.write(data)
+        self.sha256.update(data)
+        self.offset += len(data)
+
+    def _entry(self, name, compress_type, date_time, external_attr, flags=0):
+        if compress_type not in (ZIP_STORED, ZIP_DEFLATED):
+            raise ZipArchiveError("Unsupported compression method {} for {}".format(compress_type, name))
+        entry = _Entry()
+        entry.name = name
+        entry.flags = flags | (0 if name.isascii() else FLAG_UTF8)
+        entry.compress_type = compress_type
+        entry.date_time = date_time
+        entry.external_attr = external_attr
+        entry.header_offset = self.offset
+        return entry
+
+    def _local_header(self, entry):
+        name = entry.name.encode('utf-8')
+        extra = b""
+        crc, compress_size, file_size = entry.crc, entry.compress_size, entry.file_size
+        version = VERSION
+        if compress_size >= ZIP64_LIMIT or file_size >= ZIP64_LIMIT:
+            extra = EXTRA_HEADER_STRUCT.pack(ZIP64_EXTRA_ID, 16) + struct.pack("<2Q", file_size, compress_size)
+            compress_size = file_size = ZIP64_LIMIT
+            version = VERSION_ZIP64
+        dosdate, dostime = _dos_date_time(entry.date_time)
+        self._write(LOCAL_STRUCT.pack(LOCAL_SIGNATURE, version, entry.flags, entry.compress_type,
+            dostime, dosdate, crc, compress_size, file_size, len(name), len(extra)) + name + extra)
+
+    def write_entry(self, name, data, compress_type=ZIP_STORED, date_time=(1980, 1, 1, 0, 0, 0), external_attr=0):
+        """Add an entry whose data is in memory; it is deflated here if compress_type is ZIP_DEFLATED"""
+
+        raw = data
+        if compress_type == ZIP_DEFLATED:
+            compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+            raw = compressor.compress(data) + compressor.flush()
+        self.write_raw(name, raw, zlib.crc32(data), len(data), compress_type, date_time, external_attr)
+
+    def write_raw(self, name, raw, crc, file_size, compress_type=ZIP_STORED, date_time=(1980, 1, 1, 0, 0, 0),
+                  external_attr=0):
+        """
+        Add an entry from its stored data
+
+        Args:
+            raw (bytes): data of the entry, compressed with compress_type
+            crc (int): CRC-32 of the uncompressed data
+            file_size (int): size of the uncompressed data
+        """
+
+        entry = self._entry(name, compress_type, date_time, external_attr)
+        entry.crc = crc
+        entry.compress_size = len(raw)
+        entry.file_size = file_size
+        self._local_header(entry)
+        self._write(raw)
+        self.entries.append(entry)
+
+    def write_stored(self, name, chunks, crc, file_size, date_time=(1980, 1, 1, 0, 0, 0), external_attr=0):
+        """
+        Add a stored entry from an iterable of chunks of data, whose CRC and size are known
+
+        Args:
+            chunks: iterable of bytes-like objects
+            crc (int): CRC-32 of the data
+            file_size (int): size of the data
+
+        Raises
+            ZipArchiveError if the chunks do not match the CRC or the size; the archive is then invalid
+        """
+
+        entry = self._entry(name, ZIP_STORED, date_time, external_attr)
+        entry.crc = crc
+        entry.compress_size = entry.file_size = file_size
+        self._local_header(entry)
+        written_crc = written_size = 0
+        for chunk in chunks:
+            written_crc = zlib.crc32(chunk, written_crc)
+            written_size += len(chunk)
+            self._write(chunk)
+        if written_crc != crc or written_size != file_size:
+            raise ZipArchiveError("{}: the data written does not match the CRC and size of the entry".format(name))
+        self.entries.append(entry)
+
+    def write_stream(self, name, chunks, compress_type=ZIP_DEFLATED, date_time=(1980, 1, 1, 0, 0, 0),
+                     external_attr=0):
+        """
+        Add a deflated entry from an iterable of chunks of data; see write_stored for a stored entry
+
+        Raises
+            ZipArchiveError if the entry is not deflated, or if it reaches 4 GiB
+        """
+
+        if compress_type != ZIP_DEFLATED:
+            raise ZipArchiveError("{}: an entry written as a stream must be deflated".format(name))
+        entry = self._entry(name, compress_type, date_time, external_attr, FLAG_DATA_DESCRIPTOR)
+        entry.crc = entry.compress_size = entry.file_size = 0
+        self._local_header(entry)
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+
+        crc = file_size = compress_size = 0
+        for chunk in chunks:
+            crc = zlib.crc32(chunk, crc)
+            file_size += len(chunk)
+            chunk = compressor.compress(chunk)
+            if chunk:
+                self._write(chunk)
+                compress_size += len(chunk)
+        chunk = compressor.flush()
+        self._write(chunk)
+        compress_size += len(chunk)
+        if file_size >= ZIP64_LIMIT or compress_size >= ZIP64_LIMIT:
+            raise ZipArchiveError("{}: an entry written as a stream is limited to 4 GiB".format(name))
+
+        entry.crc, entry.compress_size, entry.file_size = crc, compress_size, file_size
+        self._write(DESCRIPTOR_STRUCT.pack(DESCRIPTOR_SIGNATURE, crc, compress_size, file_size))
+        self.entries.append(entry)
+
+    def close(self):
+        """Write the central directory; the output is not closed"""
+
+        if self.closed:
+            return
+        self.closed = True
+        cdir_offset = self.offset
+        for entry in self.entries:
+            name = entry.name.encode('utf-8')
+            values = []
+            file_size, compress_size, header_offset = entry.file_size, entry.compress_size, entry.header_offset
+            # zip64 values, in this order, for the fields which overflow
+            if file_size >= ZIP64_LIMIT:
+                values.append(file_size)
+                file_size = ZIP64_LIMIT
+            if compress_size >= ZIP64_LIMIT:
+                values.append(compress_size)
+                compress_size = ZIP64_LIMIT
+            if header_offset >= ZIP64_LIMIT:
+                values.append(header_offset)
+                header_offset = ZIP64_LIMIT
+            extra = b""
+            version = VERSION
+            if values:
+                extra = EXTRA_HEADER_STRUCT.pack(ZIP64_EXTRA_ID, 8 * len(values)) + struct.pack(
+                    "<{}Q".format(len(values)), *values)
+                version = VERSION_ZIP64
+            dosdate, dostime = _dos_date_time(entry.date_time)
+            self._write(CDIR_STRUCT.pack(CDIR_SIGNATURE, MADE_BY_UNIX | version, version, entry.flags,
+                entry.compress_type, dostime, dosdate, entry.crc, compress_size, file_size,
+                len(name), len(extra), 0, 0, 0, entry.external_attr, header_offset) + name + extra)
+
+        count = len(self.entries)
+        cdir_size = self.offset - cdir_offset
+        if count >= 0xFFFF or cdir_size >= ZIP64_LIMIT or cdir_offset >= ZIP64_LIMIT:
+            eocd64_offset = self.offset
+            self._write(EOCD64_STRUCT.pack(EOCD64_SIGNATURE, EOCD64_STRUCT.size - 12,
+                MADE_BY_UNIX | VERSION_ZIP64, VERSION_ZIP64, 0, 0, count, count, cdir_size, cdir_offset))
+            self._write(EOCD64_LOCATOR_STRUCT.pack(EOCD64_LOCATOR_SIGNATURE, 0, eocd64_offset, 1))
+            count = min(count, 0xFFFF)
+            cdir_size = min(cdir_size, ZIP64_LIMIT)
+            cdir_offset = min(cdir_offset, ZIP64_LIMIT)
+        self._write(EOCD_STRUCT.pack(EOCD_SIGNATURE, 0, 0, count, count, cdir_size, cdir_offset, 0))
+        if hasattr(self.output, 'flush'):
+            self.output.flush()
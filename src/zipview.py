@@ -0,0 +1,401 @@
+# -*- coding: utf-8 -*-
+
+"""
+Read-only view of a zip archive (an EPUB file) which reads only what it needs:
+the end of central directory record, the central directory, then the entries actually read.
+
+The archive is accessed through a source object exposing its size and a read_at(offset, length) method:
+    - MmapSource for a local file, memory-mapped: read_at returns zero-copy views 
+      and only the pages touched are read from the disk
+    - HTTPRangeSource for a remote file, fetched with HTTP Range requests
+
+Zip64 archives (more than 4 GiB or 65535 entries) are supported.
+
+Copyright 2017 European Digital Reading Lab. All rights reserved.
+Licensed to the Readium Foundation under one or more contributor license agreements.
+Use of this source code is governed by a BSD-style license
+that can be found in the LICENSE file exposed on Github (readium) in the project repository.
+"""
+
+import logging
+import mmap
+import os
+import struct
+import zlib
+
+from exception import ZipArchiveError
+
+LOGGER = logging.getLogger(__name__)
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+
+# end of central directory record
+EOCD_STRUCT = struct.Struct("<4s4H2LH")
+EOCD_SIGNATURE = b"PK\x05\x06"
+# the record is followed by a comment of 64 KiB max
+EOCD_MAX_SEARCH = EOCD_STRUCT.size + 0xFFFF
+
+# zip64 end of central directory locator and record
+EOCD64_LOCATOR_STRUCT = struct.Struct("<4sLQL")
+EOCD64_LOCATOR_SIGNATURE = b"PK\x06\x07"
+EOCD64_STRUCT = struct.Struct("<4sQ2H2L4Q")
+EOCD64_SIGNATURE = b"PK\x06\x06"
+ZIP64_EXTRA_ID = 0x0001
+EXTRA_HEADER_STRUCT = struct.Struct("<2H")
+
+# central directory file header
+CDIR_STRUCT = struct.Struct("<4s6H3L5H2L")
+CDIR_SIGNATURE = b"PK\x01\x02"
+
+# local file header
+LOCAL_STRUCT = struct.Struct("<4s5H3L2H")
+LOCAL_SIGNATURE = b"PK\x03\x04"
+# room left for the local extra field when an entry is read in one go
+LOCAL_EXTRA_ALLOWANCE = 256
+
+
+class MmapSource:
+    """Local file, memory-mapped"""
+
+    def __init__(self, path):
+        self.name = path
+        with open(path, 'rb') as file:
+            self.size = os.fstat(file.fileno()).st_size
+            if self.size == 0:
+                raise ZipArchiveError("{} is not a zip file".format(path))
+            # the mapping stays valid after the file is closed
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+
+    def read_at(self, offset, length):
+        # no copy: the caller gets a view on the mapped pages
+        return self.view[offset:offset + length]
+
+    def close(self):
+        self.view.release()
+        try:
+            self.map.close()
+        except BufferError:
+            # views are still referenced, the mapping is released with them
+            pass
+
+
+class HTTPRangeSource:
+    """Remote file, read with HTTP Range requests"""
+
+    def __init__(self, url, session=None):
+        """
+        Args:
+            url (str): url of the file
+            session (requests.Session): session used for the requests, closed with the source; a new one if None
+        """
+        import requests
+
+        self.name = url
+        self.session = session or requests.Session()
+        # statistics: number of range requests and bytes fetched
+        self.requests = 0
+        self.fetched = 0
+
+        r = self.session.head(url, allow_redirects=True)
+        if r.status_code != requests.codes.ok:
+            raise ZipArchiveError("Impossible to reach {}: error {}".format(url, r.status_code))
+        if r.headers.get("Accept-Ranges", "bytes") != "bytes":
+            raise ZipArchiveError("The server of {} does not accept range requests".format(url))
+        try:
+            self.size = int(r.headers["Content-Length"])
+        except (KeyError, ValueError):
+            raise ZipArchiveError("Unknown length for {}".format(url))
+        # follow redirections once and for all
+        self.url = r.url
+
+    def read_at(self, offset, length):
+        if length <= 0:
+            return b""
+        r = self.session.get(self.url, headers={
+            "Range": "bytes={}-{}".format(offset, offset + length - 1),
+            # the bytes must be the stored ones
+            "Accept-Encoding": "identity"
+            })
+        if r.status_code != 206:
+            raise ZipArchiveError(
+                "Range request refused by the server of {}: error {}".format(self.url, r.status_code))
+        self.requests += 1
+        self.fetched += len(r.content)
+        return r.content
+
+    def close(self):
+        LOGGER.info("{} range requests, {} bytes fetched out of {}".format(
+            self.requests, self.fetched, self.size))
+        self.session.close()
+
+
+class ZipEntry:
+    """Entry of the central directory; attribute names follow zipfile.ZipInfo"""
+
+    __slots__ = ("filename", "flag_bits", "compress_type", "CRC",
+                 "compress_size", "file_size", "header_offset", "date_time")
+
+    def __init__(self, filename, flag_bits, compress_type, crc, compress_size, file_size, header_offset,
+                 date_time=(1980, 1, 1, 0, 0, 0)):
+        self.filename = filename
+        self.flag_bits = flag_bits
+        self.compress_type = compress_type
+        self.CRC = crc
+        self.compress_size = compress_size
+        self.file_size = file_size
+        self.header_offset = header_offset
+        self.date_time = date_time
+
+    def __repr__(self):
+        return "<ZipEntry {} method={} size={}/{}>".format(
+            self.filename, self.compress_type, self.compress_size, self.file_size)
+
+
+class ZipView:
+    """Zip archive, parsed from its central directory"""
+
+    def __init__(self, source):
+        """
+        Args:
+            source: MmapSource, HTTPRangeSource or any object with a size and a read_at() method
+
+        Raises
+            ZipArchiveError if the archive is not a valid zip file
+        """
+
+        self.source = source
+        self.entries = {}
+        self._read_central_directory()
+
+    def _read_central_directory(self):
+        size = self.source.size
+        tail_length = min(size, EOCD_MAX_SEARCH)
+        tail = self.source.read_at(size - tail_length, tail_length)
+
+        pos = _rfind(tail, EOCD_SIGNATURE)
+        if pos < 0 or pos + EOCD_STRUCT.size > len(tail):
+            raise ZipArchiveError("{} is not a zip file".format(self.source.name))
+        (_, _, _, _, count, cdir_size, cdir_offset, _) = EOCD_STRUCT.unpack_from(tail, pos)
+
+        if 0xFFFF in (count,) or 0xFFFFFFFF in (cdir_size, cdir_offset):
+            count, cdir_size, cdir_offset = self._read_zip64_eocd(tail, pos, size - tail_length)
+
+        if cdir_offset + cdir_size > size:
+            raise ZipArchiveError("Invalid central directory in {}".format(self.source.name))
+        # the central directory is often in the tail already fetched
+        tail_offset = size - tail_length
+        if cdir_offset >= tail_offset:
+            cdir = tail[cdir_offset - tail_offset:cdir_offset - tail_offset + cdir_size]
+        else:
+            cdir = self.source.read_at(cdir_offset, cdir_size)
+
+        offset = 0
+        for _ in range(count):
+            if bytes(cdir[offset:offset + 4]) != CDIR_SIGNATURE:
+                raise ZipArchiveError("Invalid central directory in {}".format(self.source.name))
+            (_, _, _, flags, method, dostime, dosdate, crc, csize, usize,
+             name_len, extra_len, comment_len, _, _, _, header_offset) = CDIR_STRUCT.unpack_from(cdir, offset)
+            offset += CDIR_STRUCT.size
+            name = bytes(cdir[offset:offset + name_len])
+            name = name.decode("utf-8" if flags & 0x800 else "cp437")
+            offset += name_len
+            if 0xFFFFFFFF in (csize, usize, header_offset):
+                usize, csize, header_offset = _zip64_values(
+                    cdir[offset:offset + extra_len], usize, csize, header_offset)
+            offset += extra_len + comment_len
+            date_time = ((dosdate >> 9) + 1980, (dosdate >> 5) & 0xF, dosdate & 0x1F,
+                         dostime >> 11, (dostime >> 5) & 0x3F, (dostime & 0x1F) * 2)
+            self.entries[name] = ZipEntry(name, flags, method, crc, csize, usize, header_offset, date_time)
+
+    def _read_zip64_eocd(self, tail, pos, tail_offset):
+        """
+        Read the zip64 end of central directory record
+
+        Returns
+            (int, int, int): number of entries, size and offset of the central directory
+        """
+
+        locator_pos = pos - EOCD64_LOCATOR_STRUCT.size
+        if locator_pos < 0 or bytes(tail[locator_pos:locator_pos + 4]) != EOCD64_LOCATOR_SIGNATURE:
+            raise ZipArchiveError("Missing zip64 locator in {}".format(self.source.name))
+        (_, _, eocd64_offset, _) = EOCD64_LOCATOR_STRUCT.unpack_from(tail, locator_pos)
+
+        if eocd64_offset >= tail_offset:
+            record = tail[eocd64_offset - tail_offset:]
+        else:
+            record = self.source.read_at(eocd64_offset, EOCD64_STRUCT.size)
+        if len(record) < EOCD64_STRUCT.size or bytes(record[:4]) != EOCD64_SIGNATURE:
+            raise ZipArchiveError("Invalid zip64 end of central directory in {}".format(self.source.name))
+        (_, _, _, _, _, _, _, count, cdir_size, cdir_offset) = EOCD64_STRUCT.unpack_from(record)
+        return count, cdir_size, cdir_offset
+
+    def namelist(self):
+        return list(self.entries)
+
+    def infolist(self):
+        return list(self.entries.values())
+
+    def getinfo(self, name):
+        """
+        Raises
+            KeyError if the entry does not exist, like zipfile
+        """
+
+        try:
+            return self.entries[name]
+        except KeyError:
+            raise KeyError("There is no item named {!r} in the archive".format(name))
+
+    def local_header(self, name):
+        """
+        Read the local header of an entry, not its data
+
+        Returns
+            (int, int): compression method, offset of the data in the archive
+        """
+
+        entry = self.getinfo(name)
+        length = min(LOCAL_STRUCT.size, self.source.size - entry.header_offset)
+        header = self.source.read_at(entry.header_offset, length)
+        if len(header) < LOCAL_STRUCT.size or bytes(header[:4]) != LOCAL_SIGNATURE:
+            raise ZipArchiveError("Invalid local header for {}".format(name))
+        (_, _, _, method, _, _, _, _, _, name_len, extra_len) = LOCAL_STRUCT.unpack_from(header)
+        return method, entry.header_offset + LOCAL_STRUCT.size + name_len + extra_len
+
+    def read(self, name):
+        """
+        Read and decompress an entry
+
+        Raises
+            KeyError if the entry does not exist
+            ZipArchiveError if the entry cannot be read
+        """
+
+        entry = self.getinfo(name)
+        # read the local header and the data in one go, if the local extra field is not too large
+        length = LOCAL_STRUCT.size + len(entry.filename.encode("utf-8")) + LOCAL_EXTRA_ALLOWANCE + entry.compress_size
+        length = min(length, self.source.size - entry.header_offset)
+        chunk = self.source.read_at(entry.header_offset, length)
+
+        if bytes(chunk[:4]) != LOCAL_SIGNATURE:
+            raise ZipArchiveError("Invalid local header for {}".format(name))
+        (_, _, _, _, _, _, _, _, _, name_len, extra_len) = LOCAL_STRUCT.unpack_from(chunk)
+        start = LOCAL_STRUCT.size + name_len + extra_len
+        data = chunk[start:start + entry.compress_size]
+        if len(data) < entry.compress_size:
+            data = self.source.read_at(entry.header_offset + start, entry.compress_size)
+
+        if entry.compress_type == ZIP_DEFLATED:
+            try:
+                data = zlib.decompress(data, -15)
+            except zlib.error as err:
+                raise ZipArchiveError("Invalid compressed data for {}: {}".format(name, err))
+        elif entry.compress_type != ZIP_STORED:
+            raise ZipArchiveError("Unsupported compression method {} for {}".format(entry.compress_type, name))
+
+        if zlib.crc32(data) != entry.CRC:
+            raise ZipArchiveError("Bad CRC-32 for {}".format(name))
+        # a stored entry may be a view on the source
+        return bytes(data)
+
+    def raw(self, name):
+        """
+        Data of an entry as stored in the archive, still compressed; a view on a local file
+
+        Raises
+            KeyError if the entry does not exist
+            ZipArchiveError if the entry cannot be read
+        """
+
+        entry = self.getinfo(name)
+        _, data_offset = self.local_header(name)
+        return self.source.read_at(data_offset, entry.compress_size)
+
+    def iter_content(self, name, chunk_size=1 << 20):
+        """
+        Decompressed data of an entry, by chunks of chunk_size bytes at most:
+        the entry is never held in memory as a whole. The CRC is checked at the end.
+
+        Raises
+            KeyError if the entry does not exist
+            ZipArchiveError if the entry cannot be read
+        """
+
+        entry = self.getinfo(name)
+        if entry.compress_type not in (ZIP_STORED, ZIP_DEFLATED):
+            raise ZipArchiveError("Unsupported compression method {} for {}".format(entry.compress_type, name))
+        _, offset = self.local_header(name)
+        end = offset + entry.compress_size
+        decompressor = zlib.decompressobj(-15) if entry.compress_type == ZIP_DEFLATED else None
+        crc = 0
+        try:
+            while offset < end:
+                data = self.source.read_at(offset, min(chunk_size, end - offset))
+                offset += len(data)
+                if decompressor is not None:
+                    # the output is bounded: a small compressed chunk may inflate enormously
+                    data = decompressor.decompress(data, chunk_size)
+                    while decompressor.unconsumed_tail:
+                        crc = zlib.crc32(data, crc)
+                        yield data
+                        data = decompressor.decompress(decompressor.unconsumed_tail, chunk_size)
+                if data:
+                    crc = zlib.crc32(data, crc)
+                    yield data
+            if decompressor is not None:
+                data = decompressor.flush()
+                if data:
+                    crc = zlib.crc32(data, crc)
+                    yield data
+        except zlib.error as err:
+            raise ZipArchiveError("Invalid compressed data for {}: {}".format(name, err))
+        if crc != entry.CRC:
+            raise ZipArchiveError("Bad CRC-32 for {}".format(name))
+
+    def close(self):
+        self.source.close()
+
+
+def _rfind(view, sub):
+    """rfind in a memoryview or bytes, without copying the whole buffer"""
+
+    if isinstance(view, bytes):
+        return view.rfind(sub)
+    # the signature is searched backwards, by blocks overlapping by len(sub) - 1 bytes
+    block = 4096
+    end = len(view)
+    while end > 0:
+        start = max(end - block, 0)
+        pos = bytes(view[start:end]).rfind(sub)
+        if pos >= 0:
+            return start + pos
+        end = start + len(sub) - 1 if start > 0 else 0
+    return -1
+
+
+def _zip64_values(extra, usize, csize, header_offset):
+    """
+    Get the 64 bits values of an entry from its zip64 extra field
+
+    Only the values set to 0xFFFFFFFF in the header are present, in this order.
+    """
+
+    offset = 0
+    while offset + EXTRA_HEADER_STRUCT.size <= len(extra):
+        header_id, data_len = EXTRA_HEADER_STRUCT.unpack_from(extra, offset)
+        offset += EXTRA_HEADER_STRUCT.size
+        if header_id == ZIP64_EXTRA_ID:
+            values = []
+            for _ in range(data_len // 8):
+                values.append(struct.unpack_from("<Q", extra, offset + 8 * len(values))[0])
+            if usize == 0xFFFFFFFF and values:
+                usize = values.pop(0)
+            if csize == 0xFFFFFFFF and values:
+                csize = values.pop(0)
+            if header_offset == 0xFFFFFFFF and values:
+                header_offset = values.pop(0)
+            break
+        offset += data_len
+    return usize, csize, header_offset